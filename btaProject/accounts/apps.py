@@ -6,4 +6,4 @@ class AccountsConfig(AppConfig):
     name = 'accounts'
 
     def ready(self):
-        from . import signals
\ No newline at end of file
+        from . import checks, signals
\ No newline at end of file
@@ -1,7 +1,59 @@
+from allauth.account.auth_backends import AuthenticationBackend
 from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
 
+from .helpers import get_auth_cache, load_auth_cache, set_auth_cache
 
-class DemoUserAuthenticationBackend:
+
+class CachedUserMixin:
+    """
+    Rebuilds the session user from the cache, only hitting the database on a miss. Entries are stored with
+    the user's cache version, which user, group and role changes replace. The user's permissions and group
+    names are fetched in the same cache lookup and kept on the user for the rest of the request. Requires a
+    cache shared by every process (see accounts.checks), so that those changes reach all of them.
+    """
+    def load_user(self, user_id):
+        return super().get_user(user_id)
+
+    def get_user(self, user_id):
+        versions, entries = auth_cache = load_auth_cache(user_id)
+        user = entries.get('auth_user')
+        if user is None:
+            user = self.load_user(user_id)
+            if user is None:
+                return None
+            set_auth_cache(user_id, versions, 'auth_user', user)
+        # set after caching the user, so it is not stored with it
+        user._auth_cache = auth_cache
+        return user
+
+
+class CachedPermissionsMixin:
+    """
+    Loads a user's permissions from the cache (with the same versions) before asking the database
+    """
+    def get_all_permissions(self, user_obj, obj=None):
+        if obj is not None or not user_obj.is_active or user_obj.is_anonymous:
+            return super().get_all_permissions(user_obj, obj=obj)
+        if not hasattr(user_obj, '_perm_cache'):
+            versions, entries = get_auth_cache(user_obj)
+            perms = entries.get('auth_perms')
+            if perms is None:
+                perms = super().get_all_permissions(user_obj)
+                set_auth_cache(user_obj.pk, versions, 'auth_perms', perms)
+            user_obj._perm_cache = perms
+        return user_obj._perm_cache
+
+
+class CachedModelBackend(CachedUserMixin, CachedPermissionsMixin, ModelBackend):
+    """ModelBackend with cached user and permission loading"""
+
+
+class CachedAuthenticationBackend(CachedUserMixin, CachedPermissionsMixin, AuthenticationBackend):
+    """allauth's email authentication backend with cached user and permission loading"""
+
+
+class DemoUserAuthenticationBackend(CachedUserMixin):
     """Authenticates one of 4 demo users to login with"""
     def authenticate(self, request, username=None, password=None, **kwargs):
         UserModel = get_user_model()
@@ -13,9 +65,9 @@ class DemoUserAuthenticationBackend:
             return None
         
         
-    def get_user(self, user_id):
+    def load_user(self, user_id):
         UserModel = get_user_model()
         try:
             return UserModel.objects.get(pk=user_id)
         except UserModel.DoesNotExist:
-            return None
\ No newline at end of file
+            return None
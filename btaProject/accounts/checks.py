@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.checks import Error, register
+from django.utils.module_loading import import_string
+
+from .backends import CachedUserMixin
+from .helpers import is_cache_shared
+
+
+@register()
+def check_auth_cache(app_configs, **kwargs):
+    """
+    The cached authentication backends need a cache shared between processes: with one cache per process,
+    a role or permission change would only replace the cached user in the process that made it
+    """
+    backends = [path for path in settings.AUTHENTICATION_BACKENDS if issubclass(import_string(path), CachedUserMixin)]
+    if backends and not is_cache_shared():
+        return [Error(
+            'The authentication backends %s cache users in the default cache, which is local to each process.'
+            % ', '.join(backends),
+            hint='Configure a cache shared between processes in CACHES, e.g. Redis or the database cache.',
+            id='accounts.E001',
+        )]
+    return []
@@ -1,5 +1,11 @@
+from uuid import uuid4
+
+from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group, Permission
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
 
 GROUP_NAMES = {
     'AD': 'Administrator',
@@ -8,141 +14,203 @@ GROUP_NAMES = {
     'SM': 'Submitter',
 }
 
-def set_user_group_from_role(user):
-    group, created = Group.objects.get_or_create(name=GROUP_NAMES[user.user_role])
+def get_role_group(role):
+    group, created = Group.objects.get_or_create(name=GROUP_NAMES[role])
     # add permissions if group is newly created
     if created:
         add_group_permissions(group)
+    return group
+
+def set_user_group_from_role(user):
+    group = get_role_group(user.user_role)
     # remove all user groups
     user.groups.clear()
     # assign specific group based on role 
     user.groups.add(group)
-    
 
-# Get content types:
-project_content = ContentType.objects.get(app_label='pages', model='project')
-ticket_content = ContentType.objects.get(app_label='pages', model='ticket')
-history_content = ContentType.objects.get(app_label='pages', model='tickethistory')
-comment_content = ContentType.objects.get(app_label='pages', model='ticketcomment')
-ticketfiles_content = ContentType.objects.get(app_label='pages', model='ticketfiles')
-user_content = ContentType.objects.get(app_label='accounts', model='customuser')
-# Build permissions
-add_project, _ = Permission.objects.get_or_create(
-    codename='add_project',
-    name='Can add project',
-    content_type=project_content)
-add_ticket, _ = Permission.objects.get_or_create(
-    codename='add_ticket',
-    name='Can add ticket',
-    content_type=ticket_content)
-add_history, _ = Permission.objects.get_or_create(
-    codename='add_history',
-    name='Can add history',
-    content_type=history_content)
-add_comment, _ = Permission.objects.get_or_create(
-    codename='add_comment',
-    name='Can add comment',
-    content_type=comment_content)
-view_project, _ = Permission.objects.get_or_create(
-    codename='view_project',
-    name='Can view project',
-    content_type=project_content)
-view_ticket, _ = Permission.objects.get_or_create(
-    codename='view_ticket',
-    name='Can view ticket',
-    content_type=ticket_content)
-view_history, _ = Permission.objects.get_or_create(
-    codename='view_history',
-    name='Can view history',
-    content_type=history_content)
-view_comment, _ = Permission.objects.get_or_create(
-    codename='view_comment',
-    name='Can view comment',
-    content_type=comment_content)
-add_ticketfiles, _ = Permission.objects.get_or_create(
-    codename='add_ticketfiles',
-    name='Can add ticket files',
-    content_type=ticketfiles_content)
-change_ticketfiles, _ = Permission.objects.get_or_create(
-    codename='change_ticketfiles',
-    name='Can change ticket files',
-    content_type=ticketfiles_content)
-delete_ticketfiles, _ = Permission.objects.get_or_create(
-    codename='delete_ticketfiles',
-    name='Can delete ticket files',
-    content_type=ticketfiles_content)
-view_ticketfiles, _ = Permission.objects.get_or_create(
-    codename='view_ticketfiles',
-    name='Can view ticket files',
-    content_type=ticketfiles_content)
-change_user, _ = Permission.objects.get_or_create(
-    codename='change_user',
-    name='Can change user',
-    content_type=user_content)
-view_user, _ = Permission.objects.get_or_create(
-    codename='view_user',
-    name='Can view user',
-    content_type=user_content)
-change_project, _ = Permission.objects.get_or_create(
-    codename='change_project',
-    name='Can change project',
-    content_type=project_content)
-change_ticket, _ = Permission.objects.get_or_create(
-    codename='change_ticket',
-    name='Can change ticket',
-    content_type=ticket_content)
-delete_project, _ = Permission.objects.get_or_create(
-    codename='delete_project',
-    name='Can delete project',
-    content_type=project_content)
+
+AUTH_CACHE_TIMEOUT = 60 * 60
+GROUPS_VERSION_KEY = 'auth_groups_version'
+
+def user_version_key(user_pk):
+    return 'auth_user_version:%s' % user_pk
+
+# the data cached about each user, each stored with the versions it is valid for
+AUTH_CACHE_ENTRIES = ('auth_user', 'auth_perms', 'user_groups')
+
+def auth_cache_key(name, user_pk):
+    return '%s:%s' % (name, user_pk)
+
+def load_auth_cache(user_pk):
+    """
+    Returns the current versions of a user and of the groups, and the user's cached entries still valid for
+    them, with a single cache lookup. Versions are random tokens, so an evicted version can never bring back
+    stale entries. They are only replaced in the cache the change was made through, which is why it must be
+    shared.
+    """
+    version_keys = [user_version_key(user_pk), GROUPS_VERSION_KEY]
+    found = cache.get_many(version_keys + [auth_cache_key(name, user_pk) for name in AUTH_CACHE_ENTRIES])
+    versions = tuple(
+        found[key] if key in found else cache.get_or_set(key, lambda: uuid4().hex, None) for key in version_keys)
+    entries = {}
+    for name in AUTH_CACHE_ENTRIES:
+        entry_versions, value = found.get(auth_cache_key(name, user_pk), (None, None))
+        if entry_versions == versions:
+            entries[name] = value
+    return versions, entries
+
+def get_auth_cache(user):
+    """
+    Returns load_auth_cache for the user, looked up at most once per user instance (i.e. once per request)
+    """
+    if not hasattr(user, '_auth_cache'):
+        user._auth_cache = load_auth_cache(user.pk)
+    return user._auth_cache
+
+def set_auth_cache(user_pk, versions, name, value):
+    """
+    Caches one of the AUTH_CACHE_ENTRIES of a user, valid for the versions it was loaded under
+    """
+    cache.set(auth_cache_key(name, user_pk), (versions, value), AUTH_CACHE_TIMEOUT)
+
+def is_cache_shared(alias='default'):
+    """
+    Returns false if the cache is kept in the memory of each process, where changes made by one web server
+    or worker process are never seen by the others
+    """
+    return not isinstance(caches[alias], LocMemCache)
+
+def get_user_group_names(user):
+    """
+    Returns the names of the groups a user belongs to. Resolved at most once per request (stored on the user
+    instance) and shared between requests through the cache until the user's groups change. They decide what
+    the user can see, so they are only shared through a cache every process sees the changes of.
+    """
+    if not user.is_authenticated:
+        return frozenset()
+    if not hasattr(user, '_group_names'):
+        if not is_cache_shared():
+            user._group_names = frozenset(user.groups.values_list('name', flat=True))
+            return user._group_names
+        versions, entries = get_auth_cache(user)
+        group_names = entries.get('user_groups')
+        if group_names is None:
+            group_names = frozenset(user.groups.values_list('name', flat=True))
+            set_auth_cache(user.pk, versions, 'user_groups', group_names)
+        user._group_names = group_names
+    return user._group_names
+
+def assign_role_to_users(users, role):
+    """
+    Gives every user the role and its matching group with a fixed number of queries: one UPDATE of user_role
+    and a bulk rewrite of the user/group table, instead of saving (and signalling) each user in turn
+    """
+    user_model = get_user_model()
+    user_ids = [user.pk if hasattr(user, 'pk') else user for user in users]
+    membership = user_model.groups.through
+    user_field = user_model.groups.field.m2m_field_name()
+    group_field = user_model.groups.field.m2m_reverse_field_name()
+
+    with transaction.atomic():
+        group = get_role_group(role)
+        user_model.objects.filter(pk__in=user_ids).update(user_role=role)
+        membership.objects.filter(**{'%s__in' % user_field: user_ids}).delete()
+        membership.objects.bulk_create([
+            membership(**{'%s_id' % user_field: user_id, '%s_id' % group_field: group.pk})
+            for user_id in user_ids
+        ])
+    invalidate_user_cache(*user_ids)
+    return len(user_ids)
+
+def invalidate_user_cache(*users):
+    """
+    Moves the given users (instances or primary keys) to a new cache version, dropping their cached user,
+    group names and permissions
+    """
+    for user in users:
+        if hasattr(user, 'pk'):
+            for attr in ('_auth_cache', '_group_names', '_perm_cache', '_user_perm_cache', '_group_perm_cache'):
+                user.__dict__.pop(attr, None)
+            user = user.pk
+        cache.set(user_version_key(user), uuid4().hex, None)
+
+def invalidate_groups_cache():
+    """
+    Moves every user to a new cache version, for changes to groups or their permissions
+    """
+    cache.set(GROUPS_VERSION_KEY, uuid4().hex, None)
+
+
+# Permissions given to the role groups, built on first use rather than when this module is imported
+# codename: (app label, model, name)
+PERMISSIONS = {
+    'add_project': ('pages', 'project', 'Can add project'),
+    'add_ticket': ('pages', 'ticket', 'Can add ticket'),
+    'add_history': ('pages', 'tickethistory', 'Can add history'),
+    'add_comment': ('pages', 'ticketcomment', 'Can add comment'),
+    'view_project': ('pages', 'project', 'Can view project'),
+    'view_ticket': ('pages', 'ticket', 'Can view ticket'),
+    'view_history': ('pages', 'tickethistory', 'Can view history'),
+    'view_comment': ('pages', 'ticketcomment', 'Can view comment'),
+    'add_ticketfiles': ('pages', 'ticketfiles', 'Can add ticket files'),
+    'change_ticketfiles': ('pages', 'ticketfiles', 'Can change ticket files'),
+    'delete_ticketfiles': ('pages', 'ticketfiles', 'Can delete ticket files'),
+    'view_ticketfiles': ('pages', 'ticketfiles', 'Can view ticket files'),
+    'change_user': ('accounts', 'customuser', 'Can change user'),
+    'view_user': ('accounts', 'customuser', 'Can view user'),
+    'change_project': ('pages', 'project', 'Can change project'),
+    'change_ticket': ('pages', 'ticket', 'Can change ticket'),
+    'delete_project': ('pages', 'project', 'Can delete project'),
+}
+
 # Assign Permissions
 admin_perms = [
-    change_user,
-    view_user,
-    add_project,
-    change_project,
-    view_project,
-    change_ticket,
-    view_ticket,
-    add_ticketfiles,
-    change_ticketfiles,
-    delete_ticketfiles,
-    view_ticketfiles,
-    add_comment,
-    view_comment
+    'change_user',
+    'view_user',
+    'add_project',
+    'change_project',
+    'view_project',
+    'change_ticket',
+    'view_ticket',
+    'add_ticketfiles',
+    'change_ticketfiles',
+    'delete_ticketfiles',
+    'view_ticketfiles',
+    'add_comment',
+    'view_comment'
     
 ]
 
 pm_perms = [
-    add_project,
-    change_project,
-    delete_project,
-    view_project,
-    change_ticket,
-    view_ticket,
-    add_comment,
-    view_comment,
-    add_ticketfiles,
-    view_ticketfiles,
-    change_ticketfiles
+    'add_project',
+    'change_project',
+    'delete_project',
+    'view_project',
+    'change_ticket',
+    'view_ticket',
+    'add_comment',
+    'view_comment',
+    'add_ticketfiles',
+    'view_ticketfiles',
+    'change_ticketfiles'
 ]
 
 dev_perms = [
-    view_project,
-    view_ticket,
-    add_ticketfiles,
-    view_ticketfiles,
-    add_comment,
-    view_comment
+    'view_project',
+    'view_ticket',
+    'add_ticketfiles',
+    'view_ticketfiles',
+    'add_comment',
+    'view_comment'
     
 ]
 
 sub_perms = [
-    view_project,
-    add_ticket,
-    view_ticket,
-    add_ticketfiles,
-    add_comment
+    'view_project',
+    'add_ticket',
+    'view_ticket',
+    'add_ticketfiles',
+    'add_comment'
 
 ]
 
@@ -153,8 +221,40 @@ name_to_perms = {
     'Submitter': sub_perms
 }
 
+def get_permissions(codenames):
+    """
+    Returns the permissions for codenames in PERMISSIONS with one query, creating any that don't exist yet
+    """
+    definitions = {codename: PERMISSIONS[codename] for codename in codenames}
+    # content types are served from ContentType's own cache after the first lookup
+    content_types = {
+        (app_label, model): ContentType.objects.get_by_natural_key(app_label, model)
+        for app_label, model, _ in definitions.values()
+    }
+    existing = {
+        (permission.content_type_id, permission.codename): permission
+        for permission in Permission.objects.filter(codename__in=definitions, content_type__in=content_types.values())
+    }
+
+    permissions = []
+    for codename, (app_label, model, name) in definitions.items():
+        content_type = content_types[(app_label, model)]
+        permission = existing.get((content_type.pk, codename))
+        if permission is None:
+            permission = Permission.objects.create(codename=codename, name=name, content_type=content_type)
+        permissions.append(permission)
+    return permissions
+
 def add_group_permissions(group):
-    name = group.name
-    
-    for perm in name_to_perms[name]:
-        group.permissions.add(perm)
+    group.permissions.add(*get_permissions(name_to_perms[group.name]))
+
+def bootstrap_roles():
+    """
+    Creates every role permission and group and gives each group its permissions. Safe to run repeatedly.
+    """
+    groups = []
+    for name in GROUP_NAMES.values():
+        group, _ = Group.objects.get_or_create(name=name)
+        add_group_permissions(group)
+        groups.append(group)
+    return groups
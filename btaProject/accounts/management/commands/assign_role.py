@@ -0,0 +1,22 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.helpers import assign_role_to_users
+
+
+class Command(BaseCommand):
+    help = 'Assigns a role (and its group) to the given users in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('role', choices=get_user_model().Roles.values)
+        parser.add_argument('usernames', nargs='+')
+
+    def handle(self, *args, **options):
+        usernames = set(options['usernames'])
+        user_ids = dict(get_user_model().objects.filter(username__in=usernames).values_list('username', 'pk'))
+        missing = usernames - set(user_ids)
+        if missing:
+            raise CommandError('Unknown users: %s' % ', '.join(sorted(missing)))
+
+        count = assign_role_to_users(user_ids.values(), options['role'])
+        self.stdout.write(self.style.SUCCESS('Assigned role %s to %d users' % (options['role'], count)))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from accounts.helpers import bootstrap_roles
+
+
+class Command(BaseCommand):
+    help = 'Creates the role groups and their permissions'
+
+    def handle(self, *args, **options):
+        groups = bootstrap_roles()
+        self.stdout.write(self.style.SUCCESS('Bootstrapped %d role groups' % len(groups)))
@@ -0,0 +1,22 @@
+from django.contrib.auth import BACKEND_SESSION_KEY
+
+# backends sessions may have been logged in with before the cached backends replaced them
+RENAMED_BACKENDS = {
+    'django.contrib.auth.backends.ModelBackend': 'accounts.backends.CachedModelBackend',
+    'allauth.account.auth_backends.AuthenticationBackend': 'accounts.backends.CachedAuthenticationBackend',
+}
+
+
+class RenamedBackendMiddleware:
+    """
+    Moves sessions logged in with a backend that has since been renamed onto its replacement. Django logs out
+    sessions whose backend is no longer in AUTHENTICATION_BACKENDS. Must come before AuthenticationMiddleware.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        backend = request.session.get(BACKEND_SESSION_KEY)
+        if backend in RENAMED_BACKENDS:
+            request.session[BACKEND_SESSION_KEY] = RENAMED_BACKENDS[backend]
+        return self.get_response(request)
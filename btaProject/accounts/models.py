@@ -16,4 +16,21 @@ class CustomUser(AbstractUser):
 
 
     def __str__(self):
-        return self.email
\ No newline at end of file
+        return self.email
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.snapshot_user_role()
+        return instance
+
+    def snapshot_user_role(self):
+        # role the user was loaded or last saved with, so saves can tell whether it changed
+        self._loaded_user_role = self.__dict__.get('user_role')
+
+    def user_role_changed(self):
+        """
+        Returns true unless the role is known to be the same as when the user was loaded or last saved
+        """
+        loaded_user_role = getattr(self, '_loaded_user_role', None)
+        return loaded_user_role is None or loaded_user_role != self.user_role
@@ -1,11 +1,50 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 
-from .helpers import set_user_group_from_role
+from .helpers import invalidate_groups_cache, invalidate_user_cache, set_user_group_from_role
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
-def assign_user_to_group(sender, instance, raw, **kwargs):
-    if not raw:
-        set_user_group_from_role(instance)
\ No newline at end of file
+def assign_user_to_group(sender, instance, created, raw, update_fields, **kwargs):
+    # only rewrite group membership for new users or when the role actually changed, so that saves such as
+    # the last_login update on every login leave the user's groups alone
+    if raw or (update_fields is not None and 'user_role' not in update_fields):
+        return
+    if created or instance.user_role_changed():
+        set_user_group_from_role(instance)
+    instance.snapshot_user_role()
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_user_cache(instance)
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+@receiver(m2m_changed, sender=get_user_model().user_permissions.through)
+def invalidate_cached_user_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    # groups and permissions can also be edited directly (e.g. admin site), so cached users are dropped on any change
+    if not reverse:
+        if action.startswith('post_'):
+            invalidate_user_cache(instance)
+    elif action == 'pre_clear':
+        # instance is a group or permission being emptied: its users are only known before the clear
+        invalidate_user_cache(*instance.user_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        invalidate_user_cache(*pk_set)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_cached_groups(sender, **kwargs):
+    invalidate_groups_cache()
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_cached_groups_on_permission_change(sender, action, **kwargs):
+    if action.startswith('post_'):
+        invalidate_groups_cache()
@@ -0,0 +1,76 @@
+from django.contrib.auth import BACKEND_SESSION_KEY
+from django.core.cache import cache
+from django.core.checks import run_checks
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from pages import factories
+from pages.tests.utils import MEMORY_CACHES
+from ..backends import CachedModelBackend
+
+
+class CachedModelBackendTests(TestCase):
+    fixtures = ['auth.json']
+    def setUp(self):
+        cache.clear()
+        self.user = factories.CustomUserFactory(username='test@_user')
+        self.backend = CachedModelBackend()
+        return super().setUp()
+
+    def test_steady_state_page_view_runs_no_auth_queries(self):
+        """Returns true if a repeated page view loads the user and their permissions with one cache lookup"""
+        project = factories.ProjectFactory(title='Test Project', description='Test')
+        ticket = factories.TicketFactory(title='Test Ticket', description='Test', project=project, submitter=self.user)
+        self.client.force_login(self.user)
+        self.client.get(reverse('ticket_details', args=[ticket.pk]))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('ticket_details', args=[ticket.pk]))
+        auth_queries = [
+            q['sql'] for q in queries if 'FROM "accounts_customuser"' in q['sql'] or 'FROM "auth_' in q['sql']]
+        self.assertEqual(auth_queries, [])
+        auth_cache_queries = [q['sql'] for q in queries if 'auth_user_version' in q['sql']]
+        self.assertEqual(len(auth_cache_queries), 1)
+
+    def test_cached_user_replaced_when_role_changes(self):
+        """Returns true if the user is loaded again after their role is saved"""
+        self.backend.get_user(self.user.pk)
+        self.user.user_role = 'DV'
+        self.user.save()
+        self.assertEqual(self.backend.get_user(self.user.pk).user_role, 'DV')
+
+    def test_cached_permissions_replaced_when_group_permissions_change(self):
+        """Returns true if permissions granted to the user's group are picked up"""
+        user = self.backend.get_user(self.user.pk)
+        self.assertFalse(self.backend.has_perm(user, 'pages.delete_project'))
+        group = self.user.groups.get()
+        group.permissions.add(factories.PermissionFactory(
+            codename='delete_project',
+            content_type=factories.ContentTypeFactory(app_label='pages', model='project')))
+        user = self.backend.get_user(self.user.pk)
+        self.assertTrue(self.backend.has_perm(user, 'pages.delete_project'))
+
+
+class AuthCacheCheckTests(TestCase):
+    def test_process_local_cache_is_an_error(self):
+        """Returns true if the cached backends are reported when the cache is local to each process"""
+        self.assertNotIn('accounts.E001', [error.id for error in run_checks()])
+        with override_settings(CACHES=MEMORY_CACHES):
+            self.assertIn('accounts.E001', [error.id for error in run_checks()])
+
+
+class RenamedBackendMiddlewareTests(TestCase):
+    fixtures = ['auth.json']
+
+    def test_sessions_of_renamed_backends_stay_logged_in(self):
+        """Returns true if a session logged in with ModelBackend is moved onto CachedModelBackend"""
+        user = factories.CustomUserFactory(username='test@_user')
+        self.client.force_login(user, backend='accounts.backends.CachedModelBackend')
+        session = self.client.session
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session.save()
+
+        response = self.client.get(reverse('about'))
+        self.assertEqual(response.context['user'], user)
+        self.assertEqual(self.client.session[BACKEND_SESSION_KEY], 'accounts.backends.CachedModelBackend')
@@ -0,0 +1,63 @@
+from io import StringIO
+
+from django.contrib.auth.models import Group, Permission
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from pages import factories
+from pages.tests.utils import MEMORY_CACHES
+from ..helpers import assign_role_to_users, bootstrap_roles, name_to_perms
+
+
+class AssignRoleToUsersTests(TestCase):
+    fixtures = ['auth.json']
+    def setUp(self):
+        self.users = [factories.CustomUserFactory(username='test@_user%d' % i) for i in range(3)]
+        return super().setUp()
+
+    def test_users_given_role_and_matching_group(self):
+        """Returns true if every user gets the new role and only its group"""
+        assign_role_to_users(self.users, 'DV')
+        for user in self.users:
+            user.refresh_from_db()
+            self.assertEqual(user.user_role, 'DV')
+            self.assertEqual(list(user.groups.values_list('name', flat=True)), ['Developer'])
+
+    @override_settings(CACHES=MEMORY_CACHES)
+    def test_query_count_does_not_grow_with_users(self):
+        """Returns true if assigning a role to more users runs the same number of queries"""
+        # first assignment creates the Developer group and its permissions
+        assign_role_to_users(self.users[:1], 'DV')
+        with CaptureQueriesContext(connection) as one_user:
+            assign_role_to_users(self.users[:1], 'DV')
+        with CaptureQueriesContext(connection) as all_users:
+            assign_role_to_users(self.users, 'DV')
+        self.assertEqual(len(all_users), len(one_user))
+
+    def test_assign_role_command(self):
+        """Returns true if the management command assigns the role to the named users"""
+        call_command('assign_role', 'AD', 'test@_user0', 'test@_user1', stdout=StringIO())
+        self.assertTrue(self.users[0].groups.filter(name='Administrator').exists())
+        self.assertTrue(self.users[1].groups.filter(name='Administrator').exists())
+        self.assertFalse(self.users[2].groups.filter(name='Administrator').exists())
+
+
+class BootstrapRolesTests(TestCase):
+    fixtures = ['auth.json']
+
+    def test_groups_created_with_role_permissions(self):
+        """Returns true if each role group is created with its permissions"""
+        call_command('bootstrap_roles', stdout=StringIO())
+        group = Group.objects.get(name='Developer')
+        self.assertEqual(
+            set(group.permissions.values_list('codename', flat=True)),
+            set(name_to_perms['Developer']))
+
+    def test_bootstrap_can_run_repeatedly(self):
+        """Returns true if running the bootstrap again creates no duplicate groups or permissions"""
+        bootstrap_roles()
+        group_count, permission_count = Group.objects.count(), Permission.objects.count()
+        bootstrap_roles()
+        self.assertEqual((Group.objects.count(), Permission.objects.count()), (group_count, permission_count))
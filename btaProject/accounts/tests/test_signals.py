@@ -1,6 +1,13 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import update_last_login
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from pages import factories
+from pages.tests.utils import MEMORY_CACHES
+from ..helpers import get_user_group_names
 
 
 class AssignUserToGroupReceiverTests(TestCase):
@@ -30,4 +37,69 @@ class AssignUserToGroupReceiverTests(TestCase):
         self.user.user_role = 'PM'
         self.user.save()
         self.assertTrue(self.user.groups.filter(name='Project Manager').exists())
-    
\ No newline at end of file
+
+    def get_group_queries(self, queries):
+        return [q['sql'] for q in queries if 'auth_group' in q['sql']]
+
+    def test_login_runs_no_group_queries(self):
+        """Returns true if the last_login update made on login leaves the user's groups alone"""
+        user = get_user_model().objects.get(pk=self.user.pk)
+        with CaptureQueriesContext(connection) as queries:
+            update_last_login(None, user)
+        self.assertEqual(self.get_group_queries(queries), [])
+
+    def test_save_without_role_change_runs_no_group_queries(self):
+        """Returns true if saving a user whose role did not change does not rewrite their groups"""
+        user = get_user_model().objects.get(pk=self.user.pk)
+        user.first_name = 'Test'
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        self.assertEqual(self.get_group_queries(queries), [])
+        self.assertTrue(user.groups.filter(name='Submitter').exists())
+
+
+class ClearGroupCacheReceiverTests(TestCase):
+    fixtures = ['auth.json']
+    def setUp(self):
+        cache.clear()
+        self.user = factories.CustomUserFactory(username='test@_user')
+        return super().setUp()
+
+    def test_group_names_are_resolved_once_per_request(self):
+        """Returns true if repeated lookups on the same user run no further queries"""
+        get_user_group_names(self.user)
+        with self.assertNumQueries(0):
+            self.assertIn('Submitter', get_user_group_names(self.user))
+
+    def count_group_queries(self, user):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIn('Submitter', get_user_group_names(user))
+        return len([q for q in queries if '"auth_group"' in q['sql']])
+
+    def test_group_names_are_cached_between_requests(self):
+        """Returns true if a fresh user instance reads group names from the cache"""
+        get_user_group_names(self.user)
+        user = get_user_model().objects.get(pk=self.user.pk)
+        self.assertEqual(self.count_group_queries(user), 0)
+
+    @override_settings(CACHES=MEMORY_CACHES)
+    def test_group_names_are_not_shared_through_a_process_local_cache(self):
+        """Returns true if group names are loaded for each user instance when other processes cannot see the cache"""
+        get_user_group_names(self.user)
+        user = get_user_model().objects.get(pk=self.user.pk)
+        self.assertEqual(self.count_group_queries(user), 1)
+
+    def test_cache_is_cleared_when_role_changes(self):
+        """Returns true if the new group is returned after the user's role changes"""
+        get_user_group_names(self.user)
+        self.user.user_role = 'AD'
+        self.user.save()
+        user = get_user_model().objects.get(pk=self.user.pk)
+        self.assertEqual(get_user_group_names(user), {'Administrator'})
+
+    def test_cache_is_cleared_when_groups_change_directly(self):
+        """Returns true if adding a user to a group outside of a role change is picked up"""
+        get_user_group_names(self.user)
+        factories.GroupFactory(name='Developer').user_set.add(self.user)
+        user = get_user_model().objects.get(pk=self.user.pk)
+        self.assertIn('Developer', get_user_group_names(user))
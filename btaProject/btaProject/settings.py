@@ -47,9 +47,11 @@ MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
+    'accounts.middleware.RenamedBackendMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'pages.routers.ReplicaPinMiddleware',
 ]
 
 ROOT_URLCONF = 'btaProject.urls'
@@ -93,6 +95,42 @@ DATABASES = {
     }
 }
 
+# Read replicas of the default database, e.g. PG_REPLICA_HOSTS=replica-1.example.com,replica-2.example.com.
+# Pages that only read (see pages.views.ReplicaReadMixin) are read from them, see pages.routers.
+DATABASE_REPLICAS = []
+for index, host in enumerate(filter(None, os.environ.get('PG_REPLICA_HOSTS', '').split(','))):
+    alias = 'replica%d' % (index + 1)
+    # tests read from the default database, as nothing replicates their data
+    DATABASES[alias] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['pages.routers.ReplicaRouter']
+# The cache is shared by every web server and worker process. It holds the users and permissions loaded by
+# accounts.backends and the version tokens that invalidate them, so role and permission changes must reach
+# every process through it (see accounts.checks). Redis when REDIS_URL is set (e.g. by Heroku's Redis add-on),
+# otherwise a database table, created by `python manage.py createcachetable`.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        }
+    }
+
+# Replicas further behind than this many seconds are not read from. Users who write are read from the
+# default database for this long plus REPLICA_LAG_CHECK_INTERVAL, so they see their own changes.
+REPLICA_MAX_LAG = 5
+# seconds between checks of how far behind each replica is
+REPLICA_LAG_CHECK_INTERVAL = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -141,10 +179,11 @@ ACCOUNT_LOGOUT_REDIRECT_URL = 'dashboard'
 
 AUTHENTICATION_BACKENDS = (
     # Needed to login by username in Django admin, regardless of `allauth`
-    "django.contrib.auth.backends.ModelBackend",
+    # (ModelBackend and the allauth backend, both with users and permissions loaded through the cache)
+    "accounts.backends.CachedModelBackend",
 
     # `allauth` specific authentication methods, such as login by e-mail
-    "allauth.account.auth_backends.AuthenticationBackend",
+    "accounts.backends.CachedAuthenticationBackend",
     
     # backend to allow users to login on demo account
     "accounts.backends.DemoUserAuthenticationBackend",
@@ -161,7 +200,9 @@ ACCOUNT_SESSION_REMEMBER = True
 ACCOUNT_AUTHENTICATION_METHOD = 'email'
 ACCOUNT_UNIQUE_EMAIL = True
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Emails are queued as jobs and sent by run_worker through QUEUED_EMAIL_BACKEND
+EMAIL_BACKEND = 'pages.mail.QueuedEmailBackend'
+QUEUED_EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = os.environ.get('EMAIL_HOST')
 EMAIL_PORT = os.environ.get('EMAIL_PORT')
 EMAIL_USE_TLS = True
@@ -185,3 +226,51 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/tickets/'
+
+# Uploaded files are hashed as they arrive, for the content-addressed ticket file storage
+FILE_UPLOAD_HANDLERS = [
+    'pages.blobs.HashingMemoryFileUploadHandler',
+    'pages.blobs.HashingTemporaryFileUploadHandler',
+]
+
+# Archiving a project with more open tickets than this closes them in a background job
+PROJECT_ARCHIVE_BACKGROUND_THRESHOLD = 1000
+# Ticket files uploaded to the admin import larger than this many bytes are imported by a background job
+TICKET_IMPORT_BACKGROUND_SIZE = 1024 * 1024
+
+# Size of each chunk of a resumable ticket file upload, at least 5MB as every part of an S3 multipart
+# upload but the last must be
+TICKET_FILE_CHUNK_SIZE = 8 * 1024 * 1024
+# Chunked uploads not sent a chunk for this many seconds are aborted by manage.py collect_file_uploads
+TICKET_FILE_UPLOAD_EXPIRY = 24 * 60 * 60
+
+# Signed file URLs are cached and stop being handed out this many seconds before they expire, so a link
+# followed from a page is still valid when the storage receives it
+FILE_URL_EXPIRY_MARGIN = 300
+
+# Ticket file previews (image thumbnails, first and last lines of text files) are generated by jobs (run_worker)
+PREVIEW_EXCERPT_BYTES = 4096
+PREVIEW_EXCERPT_LINES = 10
+# larger images are not thumbnailed
+PREVIEW_MAX_IMAGE_SIZE = 20 * 1024 * 1024
+
+# Seconds cached page fragments (see pages.templatetags.fragment_cache) are kept. Fragments follow changes
+# to their ticket or project straight away, but names of users and projects shown in them can lag this long.
+FRAGMENT_CACHE_TIMEOUT = 60 * 60
+# Seconds each process counts the hits and misses of those fragments in memory before adding them to the
+# counters in the cache, read by manage.py fragment_cache_stats
+FRAGMENT_STATS_FLUSH_INTERVAL = 60
+
+# Part of the ETag of pages (see pages.views.ConditionalGetMixin), so that browsers do not keep pages
+# rendered by an older release. Heroku sets SOURCE_VERSION to the commit being deployed.
+RELEASE_VERSION = os.environ.get('SOURCE_VERSION', '')
+
+# Background jobs (pages.jobs), run by manage.py run_worker
+JOB_WORKER_CONCURRENCY = 4
+# seconds an idle worker waits before looking for new jobs
+JOB_POLL_INTERVAL = 1
+# a job whose worker has not been heard from for this many seconds is run by another worker
+JOB_VISIBILITY_TIMEOUT = 300
+JOB_MAX_ATTEMPTS = 5
+# seconds before a failed job is retried, doubled after each attempt
+JOB_RETRY_DELAY = 30
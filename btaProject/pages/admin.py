@@ -1,8 +1,81 @@
-from django.contrib import admin
+import io
 
-from .models import Project, Ticket, TicketComment, TicketFiles
+from django.conf import settings
+from django.contrib import admin, messages
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
 
+from .forms import TicketImportForm
+from .imports import TicketImporter, queue_ticket_import
+from .models import Job, Project, Ticket, TicketComment, TicketFiles
+
+
+class TicketAdmin(admin.ModelAdmin):
+    change_list_template = 'admin/pages/ticket/change_list.html'
+    # number of rejected rows listed after an upload, the rest are only counted
+    import_errors_shown = 20
+
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='pages_ticket_import'),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        """
+        Imports an uploaded CSV or JSON lines file of tickets, rows without a submitter are submitted by the
+        current user. Files larger than TICKET_IMPORT_BACKGROUND_SIZE are imported by a job.
+        """
+        if not self.has_add_permission(request):
+            return redirect('admin:pages_ticket_changelist')
+
+        form = TicketImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            if upload.size > settings.TICKET_IMPORT_BACKGROUND_SIZE:
+                queue_ticket_import(upload, form.cleaned_data['format'], request.user)
+                self.message_user(
+                    request, 'The import of %s was queued, the result will be emailed to you' % upload.name,
+                    messages.SUCCESS)
+                return redirect('admin:pages_ticket_changelist')
+
+            # read the upload as text a line at a time rather than loading it all
+            stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+            result = TicketImporter(default_submitter=request.user).run(stream, form.cleaned_data['format'])
+
+            self.message_user(request, 'Imported %s' % result, messages.SUCCESS)
+            for line_number, message in result.errors[:self.import_errors_shown]:
+                self.message_user(request, 'Line %d: %s' % (line_number, message), messages.WARNING)
+            if len(result.errors) > self.import_errors_shown:
+                self.message_user(
+                    request, '%d more rows were rejected' % (len(result.errors) - self.import_errors_shown),
+                    messages.WARNING)
+            return redirect('admin:pages_ticket_changelist')
+
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Import tickets',
+            'opts': self.model._meta,
+            'form': form,
+        }
+        return TemplateResponse(request, 'admin/pages/ticket/import_tickets.html', context)
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('task', 'status', 'attempts', 'max_attempts', 'run_at', 'locked_by')
+    list_filter = ('status', 'task')
+    actions = ['retry']
+
+    @admin.action(description='Retry the selected jobs')
+    def retry(self, request, queryset):
+        count = queryset.filter(status=Job.Status.FAILED).update(
+            status=Job.Status.QUEUED, attempts=0, run_at=timezone.now(), last_error='')
+        self.message_user(request, '%d failed jobs queued again' % count, messages.SUCCESS)
+
+
+admin.site.register(Job, JobAdmin)
 admin.site.register(Project)
-admin.site.register(Ticket)
+admin.site.register(Ticket, TicketAdmin)
 admin.site.register(TicketComment)
-admin.site.register(TicketFiles)
\ No newline at end of file
+admin.site.register(TicketFiles)
@@ -0,0 +1,359 @@
+import json
+import re
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.db.models import Q
+from django.forms.models import model_to_dict
+from django.http import HttpResponse, JsonResponse
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+from django.views import View
+
+from .forms import ProjectCreateForm, ProjectUpdateForm, TicketCommentForm, TicketSubmitForm, TicketUpdateForm
+from .models import Project, Ticket, TicketComment, TicketFileUpload, TicketHistory
+from .uploads import OffsetConflict, abort_upload, complete_upload, start_upload, store_chunk
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, errors=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.errors = errors
+
+    def response(self):
+        body = {'error': self.message}
+        if self.errors is not None:
+            body['errors'] = self.errors
+        return JsonResponse(body, status=self.status)
+
+
+def encode_cursor(timestamp, pk):
+    return urlsafe_b64encode(json.dumps([timestamp.isoformat(), pk]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, pk = json.loads(urlsafe_b64decode(cursor.encode()))
+        timestamp = parse_datetime(timestamp)
+    except (TypeError, ValueError):
+        timestamp = pk = None
+    if timestamp is None or not isinstance(pk, int):
+        raise ApiError(400, 'Invalid cursor.')
+    return timestamp, pk
+
+
+class ApiView(View):
+    """
+    Base view of the JSON API. Requests are checked against the permission codename set for their method,
+    the same codenames UserAccessMixin checks for the HTML views, and failures are answered with JSON
+    rather than redirects.
+    """
+    http_method_names = ['get', 'post', 'patch']
+    # request method: permission codename
+    permissions = {}
+    model = None
+    # fields that can be requested with ?fields=a,b, all of them by default
+    fields = []
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return ApiError(401, 'Authentication required.').response()
+        permission = self.permissions.get(request.method)
+        if permission is not None and not request.user.has_perm(permission):
+            return ApiError(403, 'You do not have permission to perform this action.').response()
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except ApiError as error:
+            return error.response()
+
+    def get_queryset(self):
+        return self.model.objects.all()
+
+    def get_fields(self):
+        requested = self.request.GET.get('fields')
+        if not requested:
+            return list(self.fields)
+        fields = [field.strip() for field in requested.split(',') if field.strip()]
+        unknown = [field for field in fields if field not in self.fields]
+        if unknown:
+            raise ApiError(400, 'Unknown fields: %s.' % ', '.join(unknown), {'allowed': self.fields})
+        return fields
+
+    def get_json_body(self):
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            raise ApiError(400, 'Request body must be JSON.')
+        if not isinstance(data, dict):
+            raise ApiError(400, 'Request body must be a JSON object.')
+        return data
+
+    def get_form(self, form_class, instance=None, **kwargs):
+        data = self.get_json_body()
+        if instance is not None:
+            # partial updates: fields missing from the body keep their current values
+            data = {**model_to_dict(instance, fields=form_class._meta.fields), **data}
+        return form_class(data, instance=instance, **kwargs)
+
+    def validate(self, form):
+        if not form.is_valid():
+            raise ApiError(400, 'Invalid data.', form.errors.get_json_data())
+
+    def render_object(self, queryset, pk, status=200):
+        # only the requested columns are read, foreign keys are returned as ids
+        row = queryset.filter(pk=pk).values(*self.get_fields()).first()
+        if row is None:
+            raise ApiError(404, 'Not found.')
+        return JsonResponse(row, status=status)
+
+
+class KeysetListMixin:
+    """
+    Pages through a list in (ordering field, id) order. Each page carries a cursor to the next one, so any
+    page is read with an index range scan from the last row of the previous page instead of an OFFSET that
+    has to walk every row before it. Rows updated while a client pages through move to the end and are
+    returned again there.
+    """
+    ordering_field = 'date_updated'
+    page_size = 50
+    max_page_size = 200
+
+    def get_page_size(self):
+        try:
+            return min(max(int(self.request.GET.get('page_size', self.page_size)), 1), self.max_page_size)
+        except ValueError:
+            raise ApiError(400, 'page_size must be a number.')
+
+    def paginate(self, queryset):
+        fields = self.get_fields()
+        page_size = self.get_page_size()
+        cursor = self.request.GET.get('cursor')
+        if cursor:
+            timestamp, pk = decode_cursor(cursor)
+            # the leading range on the ordering field lets the database seek straight to the cursor
+            queryset = queryset.filter(**{self.ordering_field + '__gte': timestamp}).filter(
+                Q(**{self.ordering_field + '__gt': timestamp}) | Q(id__gt=pk))
+
+        columns = list(dict.fromkeys(fields + [self.ordering_field, 'id']))
+        # one row past the page tells whether there is a next page without counting
+        rows = list(queryset.order_by(self.ordering_field, 'id').values(*columns)[:page_size + 1])
+        next_url = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            params = self.request.GET.copy()
+            params['cursor'] = encode_cursor(rows[-1][self.ordering_field], rows[-1]['id'])
+            next_url = '%s?%s' % (self.request.path, params.urlencode())
+
+        return JsonResponse({
+            'results': [{field: row[field] for field in fields} for row in rows],
+            'next': next_url,
+        })
+
+
+class ProjectApiMixin:
+    model = Project
+    fields = ['id', 'title', 'description', 'project_manager', 'is_active', 'date_updated']
+
+    def get_queryset(self):
+        return self.model.objects.visible_to(self.request.user)
+
+
+class ProjectListApiView(ProjectApiMixin, KeysetListMixin, ApiView):
+    permissions = {'GET': 'pages.view_project', 'POST': 'pages.add_project'}
+
+    def get(self, request, *args, **kwargs):
+        return self.paginate(self.get_queryset())
+
+    def post(self, request, *args, **kwargs):
+        form = self.get_form(ProjectCreateForm, user=request.user)
+        self.validate(form)
+        project = form.save()
+        return self.render_object(self.model.objects.all(), project.pk, status=201)
+
+
+class ProjectApiView(ProjectApiMixin, ApiView):
+    permissions = {'GET': 'pages.view_project', 'PATCH': 'pages.change_project'}
+
+    def get(self, request, *args, **kwargs):
+        return self.render_object(self.get_queryset(), kwargs['pk'])
+
+    def patch(self, request, *args, **kwargs):
+        project = self.get_queryset().filter(pk=kwargs['pk']).first()
+        if project is None:
+            raise ApiError(404, 'Not found.')
+        if not project.is_active:
+            raise ApiError(409, 'Archived projects cannot be edited.')
+        form = self.get_form(ProjectUpdateForm, instance=project)
+        self.validate(form)
+        form.save()
+        return self.render_object(self.model.objects.all(), project.pk)
+
+
+class TicketApiMixin:
+    model = Ticket
+    fields = [
+        'id', 'title', 'description', 'priority', 'status', 'type', 'date_created', 'date_updated',
+        'assigned_developer', 'submitter', 'project',
+    ]
+
+    def get_queryset(self):
+        return self.model.objects.visible_to(self.request.user)
+
+    def get_ticket(self):
+        ticket = self.get_queryset().filter(pk=self.kwargs['pk']).first()
+        if ticket is None:
+            raise ApiError(404, 'Not found.')
+        return ticket
+
+
+class TicketListApiView(TicketApiMixin, KeysetListMixin, ApiView):
+    permissions = {'GET': 'pages.view_ticket', 'POST': 'pages.add_ticket'}
+
+    def get(self, request, *args, **kwargs):
+        return self.paginate(self.get_queryset())
+
+    def post(self, request, *args, **kwargs):
+        form = self.get_form(TicketSubmitForm)
+        self.validate(form)
+        ticket = form.save(commit=False)
+        ticket.submitter = request.user
+        ticket.save()
+        return self.render_object(self.model.objects.all(), ticket.pk, status=201)
+
+
+class TicketApiView(TicketApiMixin, ApiView):
+    permissions = {'GET': 'pages.view_ticket', 'PATCH': 'pages.change_ticket'}
+
+    def get(self, request, *args, **kwargs):
+        return self.render_object(self.get_queryset(), kwargs['pk'])
+
+    def patch(self, request, *args, **kwargs):
+        ticket = self.get_ticket()
+        if ticket.status == Ticket.Status.CLOSED:
+            raise ApiError(409, 'Closed tickets cannot be edited.')
+        form = self.get_form(TicketUpdateForm, instance=ticket)
+        self.validate(form)
+        form.save()
+        return self.render_object(self.model.objects.all(), ticket.pk)
+
+
+# comments and history are shown on the ticket detail page to everyone who can view the ticket
+class TicketCommentListApiView(TicketApiMixin, KeysetListMixin, ApiView):
+    permissions = {'GET': 'pages.view_ticket', 'POST': 'pages.add_comment'}
+    ordering_field = 'created'
+    fields = ['id', 'message', 'commenter', 'created']
+
+    def get(self, request, *args, **kwargs):
+        return self.paginate(TicketComment.objects.filter(ticket=self.get_ticket()))
+
+    def post(self, request, *args, **kwargs):
+        ticket = self.get_ticket()
+        form = self.get_form(TicketCommentForm)
+        self.validate(form)
+        comment = form.save(commit=False)
+        comment.commenter = request.user
+        comment.ticket = ticket
+        comment.save()
+        return self.render_object(TicketComment.objects.all(), comment.pk, status=201)
+
+
+class TicketHistoryListApiView(TicketApiMixin, KeysetListMixin, ApiView):
+    permissions = {'GET': 'pages.view_ticket'}
+    ordering_field = 'date_changed'
+    fields = ['id', 'action', 'prev_value', 'new_value', 'date_changed']
+
+    def get(self, request, *args, **kwargs):
+        return self.paginate(TicketHistory.objects.filter(ticket=self.get_ticket()))
+
+
+class TicketFileUploadListApiView(TicketApiMixin, ApiView):
+    """
+    Starts a chunked upload of a ticket file. The file is then sent a chunk at a time with
+    PUT <url> and a Content-Range header; GET <url> tells where to resume an interrupted upload.
+    If storing the last chunk fails after it was received, POST <url> completes the upload again.
+    """
+    http_method_names = ['post']
+    permissions = {'POST': 'pages.add_ticketfiles'}
+
+    def post(self, request, *args, **kwargs):
+        ticket = self.get_ticket()
+        data = self.get_json_body()
+        filename, size = str(data.get('filename') or '').strip(), data.get('size')
+        if not filename or not isinstance(size, int) or size < 1:
+            raise ApiError(400, 'A filename and a positive size in bytes are required.')
+        try:
+            upload = start_upload(ticket, request.user, filename, size)
+        except ValueError as error:
+            raise ApiError(400, str(error))
+        return JsonResponse(render_upload(upload), status=201)
+
+
+class TicketFileUploadApiView(ApiView):
+    http_method_names = ['get', 'put', 'post', 'delete']
+    permissions = {method: 'pages.add_ticketfiles' for method in ['GET', 'PUT', 'POST', 'DELETE']}
+    content_range = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+    def get_upload(self):
+        upload = TicketFileUpload.objects.filter(pk=self.kwargs['pk'], uploaded_by=self.request.user).first()
+        if upload is None:
+            raise ApiError(404, 'Not found.')
+        return upload
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(render_upload(self.get_upload()))
+
+    def put(self, request, *args, **kwargs):
+        upload = self.get_upload()
+        match = self.content_range.match(request.headers.get('Content-Range', ''))
+        if match is None:
+            raise ApiError(400, 'A Content-Range header of the form "bytes start-end/size" is required.')
+        start, end, size = (int(value) for value in match.groups())
+        length = end - start + 1
+        if size != upload.size or length < 1 or length != int(request.headers.get('Content-Length') or 0):
+            raise ApiError(400, 'The Content-Range does not match the upload or the request body.')
+
+        try:
+            # the body is read from the request stream as it is stored, never loaded through request.body
+            ticket_file = store_chunk(upload, start, length, request)
+        except OffsetConflict as error:
+            upload.refresh_from_db()
+            raise ApiError(409, str(error), {'received': upload.received})
+        except ValueError as error:
+            raise ApiError(400, str(error))
+
+        if ticket_file is None:
+            return JsonResponse(render_upload(upload))
+        return render_completed_upload(ticket_file)
+
+    def post(self, request, *args, **kwargs):
+        upload = self.get_upload()
+        try:
+            ticket_file = complete_upload(upload)
+        except OffsetConflict as error:
+            raise ApiError(409, str(error), {'received': upload.received})
+        except ValueError as error:
+            raise ApiError(400, str(error))
+        return render_completed_upload(ticket_file)
+
+    def delete(self, request, *args, **kwargs):
+        abort_upload(self.get_upload())
+        return HttpResponse(status=204)
+
+
+def render_upload(upload):
+    return {
+        'id': str(upload.pk),
+        'url': reverse('api_ticket_file_upload', args=[upload.pk]),
+        'size': upload.size,
+        'chunk_size': upload.chunk_size,
+        'received': upload.received,
+    }
+
+
+def render_completed_upload(ticket_file):
+    return JsonResponse({
+        'id': ticket_file.pk,
+        'name': ticket_file.original_name,
+        'ticket': ticket_file.ticket_id,
+    }, status=201)
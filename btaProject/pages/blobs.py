@@ -0,0 +1,157 @@
+import os
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.db import IntegrityError, transaction
+from django.db.models import F, ProtectedError
+
+from .models import FileBlob, TicketFiles
+
+
+class ContentDigest:
+    """
+    Content address of a file: the sha256 of the sha256 digests of its consecutive block_size blocks (as
+    Dropbox's content hash). Unlike a plain sha256 it can also be built from chunks hashed in separate
+    requests, so chunked uploads with chunk_size blocks get the same digest as whole uploads.
+    """
+    def __init__(self, block_size=None):
+        self.block_size = block_size or settings.TICKET_FILE_CHUNK_SIZE
+        self.block_digests = []
+        self.block = sha256()
+        self.block_length = 0
+
+    def update(self, data):
+        data = memoryview(data)
+        while data:
+            length = min(len(data), self.block_size - self.block_length)
+            self.block.update(data[:length])
+            self.block_length += length
+            data = data[length:]
+            if self.block_length == self.block_size:
+                self.block_digests.append(self.block.digest())
+                self.block = sha256()
+                self.block_length = 0
+
+    def hexdigest(self):
+        block_digests = self.block_digests + ([self.block.digest()] if self.block_length else [])
+        return combine_block_digests(block_digests)
+
+
+def combine_block_digests(block_digests):
+    return sha256(b''.join(block_digests)).hexdigest()
+
+
+def file_digest(file):
+    digest = ContentDigest()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentDigestMixin:
+    """
+    Upload handler mixin that hashes files as they are received, setting content_digest on the uploaded file
+    """
+    def new_file(self, *args, **kwargs):
+        # set first, the memory handler stops the other handlers by raising from new_file
+        self.content_digest = ContentDigest()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        # the memory handler passes files that are too big for it on to the next handler, which hashes them
+        if getattr(self, 'activated', True):
+            self.content_digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.content_digest = self.content_digest.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(ContentDigestMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(ContentDigestMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def get_or_create_blob(digest, size, write, discard):
+    """
+    Returns the blob with content digest, with a reference taken for the caller, and whether it was created.
+    Only when no blob has the content is write() called to store it, returning its storage name. discard(name)
+    removes the stored copy if a concurrent upload of the same content created the blob first.
+    """
+    while True:
+        if FileBlob.objects.filter(digest=digest).update(ref_count=F('ref_count') + 1):
+            return FileBlob.objects.get(digest=digest), False
+
+        name = write()
+        try:
+            with transaction.atomic():
+                return FileBlob.objects.create(digest=digest, name=name, size=size, ref_count=1), True
+        except IntegrityError:
+            discard(name)
+
+
+def create_ticket_file(ticket, user, uploaded_file):
+    """
+    Attaches an uploaded file to ticket, storing its content only if no other ticket file has the same content
+    """
+    file_field = TicketFiles._meta.get_field('file')
+    storage = file_field.storage
+    digest = getattr(uploaded_file, 'content_digest', None) or file_digest(uploaded_file)
+    with transaction.atomic():
+        blob, _ = get_or_create_blob(
+            digest, uploaded_file.size,
+            write=lambda: storage.save(file_field.generate_filename(None, uploaded_file.name), uploaded_file),
+            discard=storage.delete,
+        )
+        return create_blob_ticket_file(ticket, user, blob, os.path.basename(uploaded_file.name))
+
+
+def create_blob_ticket_file(ticket, user, blob, original_name):
+    ticket_file = TicketFiles(uploaded_by=user, ticket=ticket, blob=blob, original_name=original_name[:255])
+    # the content is already stored, only its name is saved: that of the first upload of the content
+    ticket_file.file.name = blob.name
+    ticket_file.save()
+    return ticket_file
+
+
+def thumbnail_name(name):
+    # previews are stored next to the file they are of
+    return name + '.thumb.jpg'
+
+
+def release_blob(blob_id):
+    FileBlob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - 1)
+
+
+def collect_blobs(dry_run=False):
+    """
+    Deletes the blobs no ticket file references, and their content. Returns the number of blobs and bytes
+    freed.
+    """
+    storage = TicketFiles._meta.get_field('file').storage
+    count = size = 0
+    for blob in FileBlob.objects.filter(ref_count__lte=0).iterator():
+        if dry_run:
+            deleted = not blob.ticket_files.exists()
+        else:
+            try:
+                # only while still unreferenced: an upload of the same content may have just taken a reference
+                deleted, _ = FileBlob.objects.filter(pk=blob.pk, ref_count__lte=0).delete()
+            except ProtectedError:
+                # the count was off, some ticket file still uses the blob
+                deleted = False
+            if deleted:
+                storage.delete(blob.name)
+                if blob.thumbnail:
+                    storage.delete(blob.thumbnail)
+        if deleted:
+            count += 1
+            size += blob.size
+    return count, size
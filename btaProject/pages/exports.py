@@ -0,0 +1,106 @@
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Ticket, TicketComment, TicketHistory
+
+EXPORT_FORMATS = ['csv', 'jsonl']
+# rows fetched from the database cursor at a time, the only rows held in memory while exporting
+EXPORT_CHUNK_SIZE = 2000
+
+# dataset: (model, timestamp filtered by the date range, path from the model to the ticket,
+#           column: field lookup)
+EXPORT_DATASETS = {
+    'tickets': (Ticket, 'date_created', '', {
+        'id': 'id',
+        'title': 'title',
+        'description': 'description',
+        'priority': 'priority',
+        'status': 'status',
+        'type': 'type',
+        'date_created': 'date_created',
+        'date_updated': 'date_updated',
+        'project_id': 'project_id',
+        'project_title': 'project__title',
+        'submitter_username': 'submitter__username',
+        'developer_username': 'assigned_developer__username',
+    }),
+    'history': (TicketHistory, 'date_changed', 'ticket__', {
+        'id': 'id',
+        'ticket_id': 'ticket_id',
+        'ticket_title': 'ticket__title',
+        'project_title': 'ticket__project__title',
+        'action': 'action',
+        'prev_value': 'prev_value',
+        'new_value': 'new_value',
+        'date_changed': 'date_changed',
+    }),
+    'comments': (TicketComment, 'created', 'ticket__', {
+        'id': 'id',
+        'ticket_id': 'ticket_id',
+        'ticket_title': 'ticket__title',
+        'project_title': 'ticket__project__title',
+        'commenter_username': 'commenter__username',
+        'message': 'message',
+        'created': 'created',
+    }),
+}
+
+
+def export_rows(dataset, tickets=None, project=None, status=None, date_from=None, date_to=None):
+    """
+    Returns the columns of dataset and an iterator over its rows as dicts. Tickets, history and comments
+    are joined with their ticket and filtered by the ticket's project and status, and by their own date
+    (creation for tickets and comments, change for history) from date_from to date_to inclusive.
+    tickets limits the rows to those of a ticket queryset, e.g. the tickets visible to a user.
+    """
+    model, date_field, ticket_path, columns = EXPORT_DATASETS[dataset]
+    queryset = model.objects.all()
+    if tickets is not None:
+        queryset = queryset.filter(**{ticket_path + 'pk__in': tickets.values('pk')})
+    if project is not None:
+        queryset = queryset.filter(**{ticket_path + 'project': project})
+    if status:
+        queryset = queryset.filter(**{ticket_path + 'status': status})
+    if date_from is not None:
+        queryset = queryset.filter(**{date_field + '__gte': start_of_day(date_from)})
+    if date_to is not None:
+        queryset = queryset.filter(**{date_field + '__lt': start_of_day(date_to + timedelta(days=1))})
+
+    # values() with a chunked iterator: rows are read through a server-side cursor (PostgreSQL) or
+    # fetched chunk by chunk (SQLite) and no model instances are built
+    fields = [name for name, lookup in columns.items() if name == lookup]
+    renamed = {name: F(lookup) for name, lookup in columns.items() if name != lookup}
+    rows = queryset.order_by('pk').values(*fields, **renamed).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    return list(columns), rows
+
+
+def start_of_day(date):
+    return timezone.make_aware(datetime.combine(date, time.min))
+
+
+class Echo:
+    """
+    File-like object whose write returns the written value, so csv.writer can produce lines one at a time
+    """
+    def write(self, value):
+        return value
+
+
+def export_lines(format, columns, rows):
+    """
+    Yields the export as text, one line per row
+    """
+    if format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(columns)
+        for row in rows:
+            values = [row[column] for column in columns]
+            yield writer.writerow([value.isoformat() if isinstance(value, datetime) else value for value in values])
+    else:
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
@@ -18,7 +18,7 @@ class ContentTypeFactory(DjangoModelFactory):
 class PermissionFactory(DjangoModelFactory):
     class Meta:
         model = Permission
-        django_get_or_create = ('name', 'codename')
+        django_get_or_create = ('content_type', 'codename')
 
     name = factory.Faker("name")
     codename = factory.Faker('codename')
@@ -4,6 +4,8 @@ from django.forms import ModelForm
 from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
 
+from .exports import EXPORT_DATASETS, EXPORT_FORMATS
+from .imports import guess_format
 from .models import Project, Ticket, TicketComment, TicketFiles
 from accounts.models import CustomUser
 
@@ -106,4 +108,41 @@ class ManageProjectUsersForm(ModelForm):
 class TicketFilesForm(ModelForm):
     class Meta:
         model = TicketFiles
-        fields = ['file']
\ No newline at end of file
+        fields = ['file']
+
+class TicketImportForm(forms.Form):
+    """
+    Upload of a CSV or JSON lines file of tickets for the admin import
+    """
+    file = forms.FileField()
+    format = forms.ChoiceField(
+        choices=[('', 'From file extension'), ('csv', 'CSV'), ('jsonl', 'JSON lines')], required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('file') and not cleaned_data.get('format'):
+            cleaned_data['format'] = guess_format(cleaned_data['file'].name)
+            if cleaned_data['format'] is None:
+                raise forms.ValidationError(_('Cannot tell the format of the file, please choose one.'))
+        return cleaned_data
+
+
+class TicketExportForm(forms.Form):
+    """
+    Filters of the ticket export, all optional
+    """
+    dataset = forms.ChoiceField(choices=[(name, name) for name in EXPORT_DATASETS], required=False)
+    format = forms.ChoiceField(choices=[(name, name) for name in EXPORT_FORMATS], required=False)
+    project = forms.IntegerField(required=False)
+    status = forms.ChoiceField(choices=Ticket.Status.choices, required=False)
+    date_from = forms.DateField(required=False)
+    date_to = forms.DateField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        cleaned_data['dataset'] = cleaned_data.get('dataset') or 'tickets'
+        cleaned_data['format'] = cleaned_data.get('format') or 'csv'
+        if cleaned_data.get('date_from') and cleaned_data.get('date_to') and \
+                cleaned_data['date_from'] > cleaned_data['date_to']:
+            raise forms.ValidationError(_('The date range ends before it starts.'))
+        return cleaned_data
@@ -1,6 +1,53 @@
-from .models import TicketHistory
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from hashlib import md5
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
 from django.utils import timezone
 
+from .jobs import enqueue, task
+from .models import Project, Ticket, TicketCounter, TicketHistory
+
+
+_history_batches = threading.local()
+
+
+@contextmanager
+def history_batch():
+    """
+    Runs the block in a transaction and collects the history entries added during it, which are then written
+    with a single bulk_create just before the transaction commits. Nested batches join the outermost one and
+    drop their entries if they exit with an error, so rolled back saves leave no history behind.
+    """
+    stack = _history_batches.__dict__.setdefault('stack', [])
+    if stack:
+        histories = stack[-1]
+        start = len(histories)
+        try:
+            with transaction.atomic():
+                yield
+        except BaseException:
+            del histories[start:]
+            raise
+        return
+
+    histories = []
+    stack.append(histories)
+    try:
+        with transaction.atomic():
+            yield
+            TicketHistory.objects.bulk_create(histories)
+            if histories:
+                touch_tickets({history.ticket_id for history in histories})
+    finally:
+        stack.pop()
+
 
 def add_history(action, prev_val, new_val, ticket):
     new_history = TicketHistory(
@@ -9,4 +56,235 @@ def add_history(action, prev_val, new_val, ticket):
         new_value=new_val,
         date_changed=timezone.now(), 
         ticket=ticket)
-    new_history.save()
+    stack = getattr(_history_batches, 'stack', None)
+    if stack:
+        stack[-1].append(new_history)
+    else:
+        new_history.save()
+        touch_tickets([ticket.pk])
+
+
+def touch_tickets(ticket_ids):
+    """
+    Bumps the child version of tickets, making the cached fragments listing their history, comments and files
+    stale, and sets the time of the change
+    """
+    Ticket.objects.filter(pk__in=ticket_ids).update(child_version=F('child_version') + 1, child_updated=timezone.now())
+
+
+def touch_projects(project_ids):
+    """
+    Bumps the child version of projects, making the cached fragments listing their tickets and personnel
+    stale. project_ids can also be a queryset of project ids.
+    """
+    Project.objects.filter(pk__in=project_ids).update(child_version=F('child_version') + 1, child_updated=timezone.now())
+
+
+def ticket_counter_values(status, type, project_id):
+    return [
+        (TicketCounter.Dimension.STATUS, status),
+        (TicketCounter.Dimension.TYPE, type),
+        (TicketCounter.Dimension.PROJECT, str(project_id)),
+    ]
+
+
+def adjust_ticket_counter(dimension, value, delta):
+    """
+    Atomically adds delta to a counter, creating the counter row the first time the value is seen
+    """
+    updated = TicketCounter.objects.filter(dimension=dimension, value=value).update(count=F('count') + delta)
+    if not updated:
+        try:
+            with transaction.atomic():
+                TicketCounter.objects.create(dimension=dimension, value=value, count=delta)
+        except IntegrityError:
+            # another request created the row first
+            TicketCounter.objects.filter(dimension=dimension, value=value).update(count=F('count') + delta)
+
+
+def adjust_ticket_counters(status, type, project_id, delta):
+    for dimension, value in ticket_counter_values(status, type, project_id):
+        adjust_ticket_counter(dimension, value, delta)
+
+
+def rebuild_ticket_counters():
+    """
+    Recounts every counter from the ticket table
+    """
+    counters = []
+    for dimension, field in [
+        (TicketCounter.Dimension.STATUS, 'status'),
+        (TicketCounter.Dimension.TYPE, 'type'),
+        (TicketCounter.Dimension.PROJECT, 'project_id'),
+    ]:
+        for row in Ticket.objects.order_by().values(field).annotate(total=Count('id')):
+            counters.append(TicketCounter(dimension=dimension, value=str(row[field]), count=row['total']))
+
+    with transaction.atomic():
+        TicketCounter.objects.all().delete()
+        TicketCounter.objects.bulk_create(counters)
+    return counters
+
+
+@task
+def archive_project_tickets(project_id):
+    """
+    Closes every open ticket of a project with a single UPDATE and records the status change of each ticket
+    with one bulk insert, rather than saving (and signalling) the tickets one at a time
+    """
+    with transaction.atomic():
+        open_tickets = Ticket.objects.select_for_update().filter(project_id=project_id).exclude(status=Ticket.Status.CLOSED)
+        previous_statuses = list(open_tickets.values_list('id', 'status'))
+        if not previous_statuses:
+            return 0
+
+        now = timezone.now()
+        open_tickets.update(
+            status=Ticket.Status.CLOSED, date_updated=now, child_version=F('child_version') + 1, child_updated=now)
+        touch_projects([project_id])
+        TicketHistory.objects.bulk_create([
+            TicketHistory(
+                action='Status Updated',
+                prev_value=status,
+                new_value=Ticket.Status.CLOSED,
+                date_changed=now,
+                ticket_id=id)
+            for id, status in previous_statuses
+        ])
+
+        # the UPDATE bypasses the ticket signals, so the status counters are adjusted here
+        closed_by_status = {}
+        for _, status in previous_statuses:
+            closed_by_status[status] = closed_by_status.get(status, 0) + 1
+        for status, closed in closed_by_status.items():
+            adjust_ticket_counter(TicketCounter.Dimension.STATUS, status, -closed)
+        adjust_ticket_counter(TicketCounter.Dimension.STATUS, Ticket.Status.CLOSED, len(previous_statuses))
+
+    return len(previous_statuses)
+
+
+def archive_project_tickets_in_background(project_id):
+    """
+    Queues archive_project_tickets for the job worker (run_worker). The job is saved with the project, so
+    it cannot be lost to a restart between the two.
+    """
+    enqueue(archive_project_tickets, project_id)
+
+
+def schedule_project_archive(project):
+    """
+    Closes the tickets of an archived project, in the background if the project has too many tickets to close
+    within the request
+    """
+    if project.tickets.exclude(status=Ticket.Status.CLOSED).count() > settings.PROJECT_ARCHIVE_BACKGROUND_THRESHOLD:
+        archive_project_tickets_in_background(project.pk)
+    else:
+        archive_project_tickets(project.pk)
+
+
+
+def content_disposition(filename):
+    """
+    Returns a Content-Disposition header value showing a file inline under filename, as FileResponse does
+    """
+    try:
+        filename.encode('ascii')
+        return 'inline; filename="%s"' % filename.replace('\\', '\\\\').replace('"', r'\"')
+    except UnicodeEncodeError:
+        return "inline; filename*=utf-8''%s" % quote(filename)
+
+
+def get_file_url(file, filename=None):
+    """
+    Returns the URL of a stored file. Signed URLs (S3 with querystring auth) are cached by file name and
+    reused until FILE_URL_EXPIRY_MARGIN seconds before they expire, rather than signed on every call. They
+    make the storage send the file under filename, if given, as files with the same content share a name.
+    """
+    storage = file.storage
+    if not getattr(storage, 'querystring_auth', False):
+        return file.url
+
+    key = 'file_url:%s' % md5(('%s:%s' % (file.name, filename or '')).encode()).hexdigest()
+    url = cache.get(key)
+    if url is None:
+        if filename:
+            url = storage.url(file.name, parameters={'ResponseContentDisposition': content_disposition(filename)})
+        else:
+            url = file.url
+        timeout = storage.querystring_expire - settings.FILE_URL_EXPIRY_MARGIN
+        if timeout > 0:
+            cache.set(key, url, timeout)
+    return url
+
+
+# names of the fragments cached with the cachefragment template tag, for the hit rates
+CACHED_FRAGMENTS = ['ticket_details', 'ticket_history', 'ticket_comments', 'ticket_files']
+
+
+def fragment_cache_key(name, vary_on):
+    """
+    Returns the cache key of a template fragment. vary_on are the versions of the data the fragment shows
+    (e.g. the ticket's date_updated and child_version), so fragments are never invalidated: a change to the
+    data makes them unreachable and the cache evicts them.
+    """
+    versions = md5(':'.join(str(value) for value in vary_on).encode()).hexdigest()
+    return 'fragment:%s:%s' % (name, versions)
+
+
+def fragment_stats_key(name, outcome):
+    return 'fragment_stats:%s:%s' % (name, outcome)
+
+
+# lookups counted by this process since its counts were last added to the cache
+_fragment_lookups = Counter()
+_fragment_lookups_lock = threading.Lock()
+_fragment_lookups_flushed = time.monotonic()
+
+
+def record_fragment_lookup(name, hit):
+    """
+    Counts a lookup of a cached fragment in memory, adding the counts to the cache at most once every
+    FRAGMENT_STATS_FLUSH_INTERVAL seconds rather than writing to the cache on every lookup
+    """
+    global _fragment_lookups_flushed
+    with _fragment_lookups_lock:
+        _fragment_lookups[fragment_stats_key(name, 'hits' if hit else 'misses')] += 1
+        if time.monotonic() - _fragment_lookups_flushed < settings.FRAGMENT_STATS_FLUSH_INTERVAL:
+            return
+    flush_fragment_lookups()
+
+
+def flush_fragment_lookups():
+    """
+    Adds the lookups counted by this process to the counters in the cache. incr is atomic with Redis. With
+    the database cache it is a read then a write, so a flush racing another process's can lose its counts.
+    """
+    global _fragment_lookups_flushed
+    with _fragment_lookups_lock:
+        counts = dict(_fragment_lookups)
+        _fragment_lookups.clear()
+        _fragment_lookups_flushed = time.monotonic()
+    for key, count in counts.items():
+        try:
+            cache.incr(key, count)
+        except ValueError:
+            # first flush since the counters were reset, unless another process just created the counter
+            if not cache.add(key, count, None):
+                cache.incr(key, count)
+
+
+def fragment_cache_stats(reset=False):
+    """
+    Returns the hits and misses of each cached fragment since the counters were last reset. The counters
+    are kept in the cache, so they only add up every process's lookups with a cache shared between them,
+    and each process's latest lookups are only added after FRAGMENT_STATS_FLUSH_INTERVAL seconds.
+    """
+    flush_fragment_lookups()
+    keys = [fragment_stats_key(name, outcome) for name in CACHED_FRAGMENTS for outcome in ('hits', 'misses')]
+    counts = cache.get_many(keys)
+    if reset:
+        cache.delete_many(keys)
+    return {
+        name: (counts.get(fragment_stats_key(name, 'hits'), 0), counts.get(fragment_stats_key(name, 'misses'), 0))
+        for name in CACHED_FRAGMENTS
+    }
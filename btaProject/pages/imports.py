@@ -0,0 +1,250 @@
+import csv
+import io
+import json
+import logging
+import time
+from collections import Counter
+from itertools import islice
+from uuid import uuid4
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.mail import send_mail
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .helpers import adjust_ticket_counter, ticket_counter_values, touch_projects
+from .jobs import enqueue, task
+from .models import Project, Ticket
+from .search import index_new_tickets
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ['csv', 'jsonl']
+# number of rejected rows listed in the email sent after a background import, the rest are only counted
+IMPORT_ERRORS_REPORTED = 100
+
+
+class RowError(ValueError):
+    pass
+
+
+class ImportResult:
+    """
+    Running totals of an import. errors holds a (line number, message) pair for every rejected row.
+    """
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.errors = []
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return '%d rows, %d created, %d errors (%.0f rows/s)' % (
+            self.rows, self.created, len(self.errors), self.rows_per_second)
+
+
+def guess_format(filename):
+    if filename.endswith('.csv'):
+        return 'csv'
+    if filename.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return None
+
+
+def read_rows(stream, format):
+    """
+    Yields (line number, row) pairs from a CSV or JSON lines text stream one row at a time. JSON lines
+    that cannot be parsed are yielded as the raw line and rejected when the row is built.
+    """
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError:
+            yield line_number, line
+
+
+class TicketImporter:
+    """
+    Imports tickets from rows with the fields of the ticket submit form plus submitter, assigned_developer
+    and date_created. Projects are referenced by id or title and users by username, resolved from lookup
+    maps loaded once per import. Valid rows are inserted with bulk_create, batch_size at a time, each batch
+    in its own transaction; invalid rows are recorded in the result and skipped.
+    """
+    def __init__(self, batch_size=1000, default_submitter=None, progress=None):
+        self.batch_size = batch_size
+        self.default_submitter = default_submitter
+        # called with the result after every batch
+        self.progress = progress
+
+        self.project_ids = set()
+        self.projects_by_title = {}
+        ambiguous_titles = set()
+        for pk, title in Project.objects.values_list('pk', 'title').iterator():
+            self.project_ids.add(pk)
+            if title in self.projects_by_title:
+                ambiguous_titles.add(title)
+            self.projects_by_title[title] = pk
+        for title in ambiguous_titles:
+            self.projects_by_title[title] = None
+        self.users = dict(get_user_model().objects.values_list('username', 'pk').iterator())
+
+    def run(self, stream, format):
+        result = ImportResult()
+        rows = read_rows(stream, format)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            built = []
+            for line_number, row in batch:
+                try:
+                    built.append((line_number, self.build_ticket(row)))
+                except RowError as error:
+                    result.errors.append((line_number, str(error)))
+            result.rows += len(batch)
+
+            if built:
+                try:
+                    self.save_batch([ticket for line_number, ticket in built])
+                    result.created += len(built)
+                except DatabaseError as error:
+                    # the whole batch is rolled back, carry on with the next one
+                    result.errors.extend((line_number, 'Batch not saved: %s' % error) for line_number, ticket in built)
+            if self.progress is not None:
+                self.progress(result)
+        return result
+
+    def save_batch(self, tickets):
+        # bulk_create skips the save signals, so the counters, search index and project versions are updated
+        # here, per batch
+        with transaction.atomic():
+            Ticket.objects.bulk_create(tickets)
+            counts = Counter(
+                counter for ticket in tickets
+                for counter in ticket_counter_values(ticket.status, ticket.type, ticket.project_id))
+            for (dimension, value), delta in counts.items():
+                adjust_ticket_counter(dimension, value, delta)
+            index_new_tickets(tickets)
+            touch_projects({ticket.project_id for ticket in tickets})
+
+    def build_ticket(self, row):
+        if not isinstance(row, dict):
+            raise RowError('Row is not a JSON object')
+
+        def value(field):
+            return str(row.get(field) or '').strip()
+
+        title = value('title')
+        if not title:
+            raise RowError('Missing title')
+        if len(title) > Ticket._meta.get_field('title').max_length:
+            raise RowError('Title is too long')
+        description = value('description')
+        if not description:
+            raise RowError('Missing description')
+
+        ticket = Ticket(
+            title=title,
+            description=description,
+            priority=self.choice(value('priority'), Ticket.Priority, 'priority'),
+            status=self.choice(value('status') or Ticket.Status.OPEN, Ticket.Status, 'status'),
+            type=self.choice(value('type'), Ticket.Type, 'type'),
+            project_id=self.project(value('project')),
+            submitter_id=self.submitter(value('submitter')),
+            assigned_developer_id=self.user(value('assigned_developer'), 'assigned_developer'),
+        )
+        if value('date_created'):
+            ticket.date_created = self.date(value('date_created'))
+        return ticket
+
+    def choice(self, value, choices, field):
+        value = value.upper()
+        if value not in choices.values:
+            raise RowError('Invalid %s %r' % (field, value))
+        return value
+
+    def project(self, reference):
+        if not reference:
+            raise RowError('Missing project')
+        if reference.isdigit() and int(reference) in self.project_ids:
+            return int(reference)
+        if reference not in self.projects_by_title:
+            raise RowError('Unknown project %r' % reference)
+        if self.projects_by_title[reference] is None:
+            raise RowError('More than one project is titled %r, use its id' % reference)
+        return self.projects_by_title[reference]
+
+    def submitter(self, username):
+        if username:
+            return self.user(username, 'submitter')
+        if self.default_submitter is None:
+            raise RowError('Missing submitter')
+        return self.default_submitter.pk
+
+    def user(self, username, field):
+        if not username:
+            return None
+        if username not in self.users:
+            raise RowError('Unknown %s %r' % (field, username))
+        return self.users[username]
+
+    def date(self, value):
+        try:
+            date = parse_datetime(value)
+        except ValueError:
+            date = None
+        if date is None:
+            raise RowError('Invalid date_created %r' % value)
+        if timezone.is_naive(date):
+            date = timezone.make_aware(date)
+        return date
+
+
+def queue_ticket_import(file, format, user):
+    """
+    Saves an uploaded file of tickets to the default storage, where the job worker can read it, and queues
+    its import. Rows without a submitter are submitted by user, who is emailed the result.
+    """
+    name = default_storage.save('imports/%s.%s' % (uuid4().hex, format), file)
+    return enqueue(import_stored_tickets, name, format, user.pk)
+
+
+@task(max_attempts=1)
+def import_stored_tickets(name, format, user_id):
+    """
+    Imports a file saved by queue_ticket_import and deletes it. Not retried: the batches saved before a
+    failure would be imported twice. The file is kept if the import fails, for the job to be retried from
+    the admin site once the cause is fixed.
+    """
+    user = get_user_model().objects.filter(pk=user_id).first()
+    with default_storage.open(name, 'rb') as file:
+        stream = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+        result = TicketImporter(default_submitter=user).run(stream, format)
+    default_storage.delete(name)
+    logger.info('Imported %s from %s', result, name)
+
+    if user is not None and user.email:
+        lines = ['Imported %s' % result]
+        lines += ['Line %d: %s' % error for error in result.errors[:IMPORT_ERRORS_REPORTED]]
+        if len(result.errors) > IMPORT_ERRORS_REPORTED:
+            lines.append('%d more rows were rejected' % (len(result.errors) - IMPORT_ERRORS_REPORTED))
+        send_mail('Ticket import finished', '\n'.join(lines), None, [user.email])
+    return result
@@ -0,0 +1,159 @@
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# registered tasks by name, with their number of attempts (None for JOB_MAX_ATTEMPTS)
+TASKS = {}
+
+
+def task_name(function):
+    return '%s.%s' % (function.__module__, function.__qualname__)
+
+
+def task(function=None, *, max_attempts=None):
+    """
+    Registers a function that can be queued with enqueue. Its arguments must be JSON serialisable, and as a
+    job can run more than once (e.g. when its worker is stopped part way through) it should be safe to repeat.
+    """
+    def register(function):
+        TASKS[task_name(function)] = (function, max_attempts)
+        return function
+    return register(function) if function is not None else register
+
+
+def get_task(name):
+    if name not in TASKS:
+        # tasks are registered when their module is imported, which the worker may not have done yet
+        module, _, _ = name.rpartition('.')
+        try:
+            import_module(module)
+        except ImportError:
+            pass
+    if name not in TASKS:
+        raise LookupError('%s is not a registered task' % name)
+    return TASKS[name]
+
+
+def enqueue(function, *args, delay=0):
+    """
+    Queues a call of the task function with args, to run at least delay seconds from now. The job is saved
+    in the current transaction, so it only runs if the transaction commits.
+    """
+    name = task_name(function)
+    _, max_attempts = get_task(name)
+    return Job.objects.create(
+        task=name, args=list(args), max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+        run_at=timezone.now() + timedelta(seconds=delay))
+
+
+def claim_jobs(worker, limit):
+    """
+    Locks up to limit jobs that are due, or whose worker stopped extending their lock, for worker and
+    returns them
+    """
+    now = timezone.now()
+    due = Job.objects.filter(
+        Q(status=Job.Status.QUEUED, run_at__lte=now) | Q(status=Job.Status.RUNNING, locked_until__lt=now),
+    ).order_by('run_at').values_list('pk', 'status', 'locked_until')[:limit * 2]
+    claimed = []
+    for pk, status, locked_until in due:
+        # another worker may have claimed the job since it was listed, only one of the updates goes through
+        if Job.objects.filter(pk=pk, status=status, locked_until=locked_until).update(
+                status=Job.Status.RUNNING, locked_by=worker, attempts=F('attempts') + 1,
+                locked_until=now + timedelta(seconds=settings.JOB_VISIBILITY_TIMEOUT)):
+            claimed.append(pk)
+            if len(claimed) == limit:
+                break
+    return list(Job.objects.filter(pk__in=claimed).order_by('run_at'))
+
+
+def extend_locks(worker, job_ids):
+    # keeps the jobs worker is still running from being taken by other workers
+    Job.objects.filter(pk__in=job_ids, locked_by=worker).update(
+        locked_until=timezone.now() + timedelta(seconds=settings.JOB_VISIBILITY_TIMEOUT))
+
+
+def run_job(job, worker):
+    """
+    Runs a claimed job. It is deleted if it succeeds, otherwise queued again after JOB_RETRY_DELAY seconds,
+    doubled on each attempt, until it has used all its attempts.
+    """
+    owned = Job.objects.filter(pk=job.pk, locked_by=worker)
+    try:
+        if job.attempts > job.max_attempts:
+            # claimed again after its workers stopped while running it
+            raise RuntimeError('The job was not finished by its workers')
+        function, _ = get_task(job.task)
+        function(*job.args)
+    except Exception:
+        logger.exception('Job %s (%s) failed', job.pk, job.task)
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+            owned.update(
+                status=Job.Status.QUEUED, run_at=timezone.now() + timedelta(seconds=delay), locked_until=None,
+                locked_by='', last_error=error)
+        else:
+            owned.update(status=Job.Status.FAILED, locked_until=None, last_error=error)
+    else:
+        owned.delete()
+
+
+def default_worker_name():
+    return '%s:%s' % (socket.gethostname(), os.getpid())
+
+
+def run_worker(concurrency, poll_interval, once=False, stop=None, name=None):
+    """
+    Runs queued jobs in a pool of concurrency threads until stop (a threading.Event) is set, or once no job
+    is due if once is true. Jobs still running when it stops are finished first.
+    """
+    name = name or default_worker_name()
+    stop = stop or threading.Event()
+
+    def run(job):
+        try:
+            run_job(job, name)
+        except Exception:
+            # the job's row could not be updated, it is run again once its lock expires
+            logger.exception('Job %s (%s) could not be finished', job.pk, job.task)
+        finally:
+            connection.close()
+
+    running = {}
+    locks_extended = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='jobs') as pool:
+        while not stop.is_set():
+            for future in [future for future in running if future.done()]:
+                del running[future]
+            # well before the locks expire, claimed jobs are locked for the whole timeout anyway
+            if running and time.monotonic() - locks_extended > settings.JOB_VISIBILITY_TIMEOUT / 3:
+                extend_locks(name, running.values())
+                locks_extended = time.monotonic()
+
+            jobs = claim_jobs(name, concurrency - len(running)) if len(running) < concurrency else []
+            for job in jobs:
+                running[pool.submit(run, job)] = job.pk
+            if once and not running:
+                break
+            if not jobs:
+                # wakes up as soon as a job finishes, to claim the next one
+                if running:
+                    wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                else:
+                    stop.wait(poll_interval)
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+
+from .jobs import enqueue, task
+
+
+def serialize_message(message):
+    """
+    Returns an email message as JSON serialisable data, or None if it has attachments other than text
+    """
+    attachments = []
+    for attachment in message.attachments:
+        if not isinstance(attachment, tuple) or not isinstance(attachment[1], str):
+            return None
+        attachments.append(list(attachment))
+    return {
+        'subject': message.subject,
+        'body': message.body,
+        'from_email': message.from_email,
+        'to': message.to,
+        'cc': message.cc,
+        'bcc': message.bcc,
+        'reply_to': message.reply_to,
+        'headers': message.extra_headers,
+        'alternatives': [list(alternative) for alternative in getattr(message, 'alternatives', [])],
+        'attachments': attachments,
+        'content_subtype': message.content_subtype,
+    }
+
+
+def deserialize_message(data):
+    message = EmailMultiAlternatives(
+        subject=data['subject'], body=data['body'], from_email=data['from_email'], to=data['to'], cc=data['cc'],
+        bcc=data['bcc'], reply_to=data['reply_to'], headers=data['headers'],
+        alternatives=[tuple(alternative) for alternative in data['alternatives']],
+        attachments=[tuple(attachment) for attachment in data['attachments']],
+    )
+    message.content_subtype = data['content_subtype']
+    return message
+
+
+@task
+def send_queued_email(data):
+    get_connection(settings.QUEUED_EMAIL_BACKEND).send_messages([deserialize_message(data)])
+
+
+class QueuedEmailBackend(BaseEmailBackend):
+    """
+    Email backend that queues each message as a job, sent by run_worker through QUEUED_EMAIL_BACKEND, so that
+    requests (e.g. sign up and its confirmation email) do not wait on the mail server
+    """
+    def send_messages(self, email_messages):
+        sent = 0
+        unqueued = []
+        for message in email_messages:
+            if not message.recipients():
+                continue
+            data = serialize_message(message)
+            if data is None:
+                unqueued.append(message)
+                continue
+            enqueue(send_queued_email, data)
+            sent += 1
+        if unqueued:
+            # binary attachments are not stored in jobs, those messages are sent straight away
+            connection = get_connection(settings.QUEUED_EMAIL_BACKEND, fail_silently=self.fail_silently)
+            sent += connection.send_messages(unqueued) or 0
+        return sent
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from pages.blobs import collect_blobs
+
+
+class Command(BaseCommand):
+    help = 'Deletes stored ticket file content that no ticket file references any more'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+
+    def handle(self, *args, **options):
+        count, size = collect_blobs(dry_run=options['dry_run'])
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS('%s %d unreferenced blobs (%d bytes)' % (verb, count, size)))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from pages.uploads import collect_uploads
+
+
+class Command(BaseCommand):
+    help = 'Aborts chunked ticket file uploads that have not been sent a chunk for TICKET_FILE_UPLOAD_EXPIRY seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be aborted')
+
+    def handle(self, *args, **options):
+        count, size = collect_uploads(dry_run=options['dry_run'])
+        verb = 'Would abort' if options['dry_run'] else 'Aborted'
+        self.stdout.write(self.style.SUCCESS('%s %d abandoned uploads (%d bytes received)' % (verb, count, size)))
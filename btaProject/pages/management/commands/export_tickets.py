@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pages.exports import EXPORT_DATASETS, EXPORT_FORMATS, export_lines, export_rows
+from pages.forms import TicketExportForm
+
+
+class Command(BaseCommand):
+    help = 'Streams tickets, their history or their comments to a CSV or JSON lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', choices=list(EXPORT_DATASETS), default='tickets')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--project', type=int, help='Project id')
+        parser.add_argument('--status')
+        parser.add_argument('--from', dest='date_from', help='First date included, YYYY-MM-DD')
+        parser.add_argument('--to', dest='date_to', help='Last date included, YYYY-MM-DD')
+        parser.add_argument('--output', help='File to write, defaults to standard output')
+
+    def handle(self, *args, **options):
+        # validated with the same form as the export view
+        form = TicketExportForm({
+            name: options[name] for name in ['dataset', 'format', 'project', 'status', 'date_from', 'date_to']
+            if options[name] is not None
+        })
+        if not form.is_valid():
+            raise CommandError('; '.join(
+                '%s: %s' % (field, ' '.join(errors)) for field, errors in form.errors.items()))
+
+        filters = form.cleaned_data
+        dataset, format = filters.pop('dataset'), filters.pop('format')
+        columns, rows = export_rows(dataset, **filters)
+
+        lines = export_lines(format, columns, rows)
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                count = self.write_lines(lines, output.write)
+        else:
+            count = self.write_lines(lines, lambda line: self.stdout.write(line, ending=''))
+        # the CSV header is not a row
+        if format == 'csv':
+            count -= 1
+        self.stderr.write('Exported %d %s rows' % (count, dataset))
+
+    def write_lines(self, lines, write):
+        count = 0
+        for line in lines:
+            write(line)
+            count += 1
+        return count
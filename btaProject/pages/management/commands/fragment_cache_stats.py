@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.helpers import is_cache_shared
+from pages.helpers import fragment_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Reports the hit rate of each cached page fragment since the counters were last reset'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Start counting again after the report')
+
+    def handle(self, *args, **options):
+        if not is_cache_shared():
+            # the counters are in the memory of each web server process, none of them in this one
+            raise CommandError(
+                'The fragment cache counters cannot be read from another process with a local-memory cache. '
+                'Configure a shared cache in CACHES.')
+        total_hits = total_lookups = 0
+        for name, (hits, misses) in fragment_cache_stats(reset=options['reset']).items():
+            lookups = hits + misses
+            total_hits += hits
+            total_lookups += lookups
+            self.stdout.write('%-20s %8d hits %8d misses %s' % (name, hits, misses, hit_rate(hits, lookups)))
+        self.stdout.write(self.style.SUCCESS('Overall hit rate: %s' % hit_rate(total_hits, total_lookups)))
+
+
+def hit_rate(hits, lookups):
+    return '%.1f%%' % (100 * hits / lookups) if lookups else 'n/a'
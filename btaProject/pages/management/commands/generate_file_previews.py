@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from pages.models import TicketFiles
+from pages.previews import generate_preview
+
+
+class Command(BaseCommand):
+    help = 'Generates the previews of ticket files still waiting for one, such as files uploaded before previews existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true', help='Also retry the files whose preview failed')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            TicketFiles.objects.filter(preview_status=TicketFiles.PreviewStatus.FAILED).update(
+                preview_status=TicketFiles.PreviewStatus.PENDING)
+
+        pending = TicketFiles.objects.filter(preview_status=TicketFiles.PreviewStatus.PENDING)
+        count = 0
+        for ticket_file_id in pending.values_list('pk', flat=True).iterator():
+            generate_preview(ticket_file_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS('Generated the previews of %d ticket files' % count))
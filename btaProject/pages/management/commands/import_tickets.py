@@ -0,0 +1,42 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from pages.imports import IMPORT_FORMATS, TicketImporter, guess_format
+
+
+class Command(BaseCommand):
+    help = 'Imports tickets from a CSV or JSON lines file, reporting throughput and the rows that were rejected'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--submitter', help='Username used for rows without a submitter')
+
+    def handle(self, *args, **options):
+        format = options['format'] or guess_format(options['path'])
+        if format is None:
+            raise CommandError('Cannot tell the format of %s, use --format' % options['path'])
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        default_submitter = None
+        if options['submitter']:
+            default_submitter = get_user_model().objects.filter(username=options['submitter']).first()
+            if default_submitter is None:
+                raise CommandError('Unknown user: %s' % options['submitter'])
+
+        importer = TicketImporter(
+            batch_size=options['batch_size'],
+            default_submitter=default_submitter,
+            progress=lambda result: self.stdout.write(str(result)),
+        )
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as stream:
+                result = importer.run(stream, format)
+        except OSError as error:
+            raise CommandError(error)
+
+        for line_number, message in result.errors:
+            self.stderr.write('Line %d: %s' % (line_number, message))
+        self.stdout.write(self.style.SUCCESS('Imported %s in %.1fs' % (result, result.elapsed)))
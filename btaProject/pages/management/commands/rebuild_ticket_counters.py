@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from pages.helpers import rebuild_ticket_counters
+
+
+class Command(BaseCommand):
+    help = 'Recounts the dashboard ticket counters from the ticket table'
+
+    def handle(self, *args, **options):
+        counters = rebuild_ticket_counters()
+        self.stdout.write(self.style.SUCCESS('Rebuilt %d ticket counters' % len(counters)))
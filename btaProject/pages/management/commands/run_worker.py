@@ -0,0 +1,42 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from pages.jobs import default_worker_name, run_worker
+
+
+class Command(BaseCommand):
+    help = 'Runs the jobs queued in the database (see pages.jobs), until stopped with SIGTERM or Ctrl-C'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.JOB_WORKER_CONCURRENCY,
+                            help='Number of jobs run at the same time')
+        parser.add_argument('--poll-interval', type=float, default=settings.JOB_POLL_INTERVAL,
+                            help='Seconds between checks for new jobs when idle')
+        parser.add_argument('--once', action='store_true', help='Stop once no job is due')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+
+        stop = threading.Event()
+
+        def shut_down(signum, frame):
+            # running jobs are finished, no new ones are claimed
+            stop.set()
+
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                previous_handlers[signum] = signal.signal(signum, shut_down)
+
+        name = default_worker_name()
+        self.stdout.write('Worker %s running up to %d jobs at a time' % (name, options['concurrency']))
+        try:
+            run_worker(options['concurrency'], options['poll_interval'], once=options['once'], stop=stop, name=name)
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS('Worker %s stopped' % name))
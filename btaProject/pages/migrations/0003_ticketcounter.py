@@ -0,0 +1,38 @@
+# Generated by Django 4.1.1 on 2026-10-17 23:17
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_existing_tickets(apps, schema_editor):
+    Ticket = apps.get_model('pages', 'Ticket')
+    TicketCounter = apps.get_model('pages', 'TicketCounter')
+    counters = []
+    for dimension, field in [('STATUS', 'status'), ('TYPE', 'type'), ('PROJECT', 'project_id')]:
+        for row in Ticket.objects.order_by().values(field).annotate(total=Count('id')):
+            counters.append(TicketCounter(dimension=dimension, value=str(row[field]), count=row['total']))
+    TicketCounter.objects.bulk_create(counters)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0002_ticket_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('STATUS', 'Status'), ('TYPE', 'Type'), ('PROJECT', 'Project')], max_length=10)),
+                ('value', models.CharField(max_length=50)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='ticketcounter',
+            constraint=models.UniqueConstraint(fields=('dimension', 'value'), name='unique_ticket_counter'),
+        ),
+        migrations.RunPython(count_existing_tickets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.1.1 on 2026-10-17 23:26
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # PostgreSQL searches the stored vector through a GIN index, SQLite through an FTS5 shadow table
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "UPDATE pages_ticket t SET search_vector = "
+            "setweight(to_tsvector(COALESCE(t.title, '')), 'A') || "
+            "setweight(to_tsvector(COALESCE(t.description, '')), 'B') || "
+            "setweight(to_tsvector(COALESCE((SELECT string_agg(c.message, ' ') FROM pages_ticketcomment c WHERE c.ticket_id = t.id), '')), 'C')")
+        schema_editor.execute('CREATE INDEX ticket_search_vector_idx ON pages_ticket USING gin (search_vector)')
+    elif vendor == 'sqlite':
+        schema_editor.execute('CREATE VIRTUAL TABLE pages_ticket_fts USING fts5(title, description, comments)')
+        schema_editor.execute(
+            "INSERT INTO pages_ticket_fts (rowid, title, description, comments) "
+            "SELECT t.id, t.title, t.description, "
+            "COALESCE((SELECT group_concat(c.message, ' ') FROM pages_ticketcomment c WHERE c.ticket_id = t.id), '') "
+            "FROM pages_ticket t")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS ticket_search_vector_idx')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS pages_ticket_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0003_ticketcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
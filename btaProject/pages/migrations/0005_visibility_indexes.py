@@ -0,0 +1,25 @@
+# Generated by Django 4.1.1 on 2026-10-17 23:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0004_ticket_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['project_manager', 'is_active'], name='project_manager_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['is_active', 'title'], name='project_active_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['project', 'status'], name='ticket_project_status_idx'),
+        ),
+    ]
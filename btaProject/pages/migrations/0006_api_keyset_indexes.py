@@ -0,0 +1,42 @@
+# Generated by Django 4.1.1 on 2026-10-17 23:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0005_visibility_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='date_updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['date_updated', 'id'], name='project_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['date_updated', 'id'], name='ticket_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['assigned_developer', 'date_updated', 'id'], name='ticket_dev_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['submitter', 'date_updated', 'id'], name='ticket_submitter_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticketcomment',
+            index=models.Index(fields=['ticket', 'created', 'id'], name='comment_ticket_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tickethistory',
+            index=models.Index(fields=['ticket', 'date_changed', 'id'], name='history_ticket_changed_idx'),
+        ),
+    ]
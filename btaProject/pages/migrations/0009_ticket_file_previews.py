@@ -0,0 +1,28 @@
+# Generated by Django 4.1.1 on 2026-10-17 23:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0008_file_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticketfiles',
+            name='excerpt',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='ticketfiles',
+            name='preview_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('READY', 'Ready'), ('UNAVAILABLE', 'Unavailable'), ('FAILED', 'Failed')], default='PENDING', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='ticketfiles',
+            name='thumbnail',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
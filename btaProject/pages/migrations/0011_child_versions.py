@@ -0,0 +1,23 @@
+# Generated by Django 4.1.1 on 2026-10-17 23:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0010_job_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='child_version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='child_version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
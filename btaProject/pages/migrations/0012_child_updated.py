@@ -0,0 +1,23 @@
+# Generated by Django 4.1.1 on 2026-10-17 23:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0011_child_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='child_updated',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='child_updated',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
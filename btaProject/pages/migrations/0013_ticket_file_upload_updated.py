@@ -0,0 +1,19 @@
+# Generated by Django 4.1.1 on 2026-10-18 00:13
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0012_child_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticketfileupload',
+            name='updated',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.1.1 on 2026-10-18 00:14
+
+import os
+
+from django.db import migrations, models
+
+
+def name_existing_files(apps, schema_editor):
+    # the storage names of files stored before are the best record of their original names
+    for model in ('TicketFiles', 'TicketFileUpload'):
+        Model = apps.get_model('pages', model)
+        field = 'file' if model == 'TicketFiles' else 'name'
+        rows = []
+        for pk, name in Model.objects.values_list('pk', field).iterator():
+            rows.append(Model(pk=pk, original_name=os.path.basename(name)[:255]))
+        Model.objects.bulk_update(rows, ['original_name'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0013_ticket_file_upload_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticketfiles',
+            name='original_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='ticketfileupload',
+            name='original_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.RunPython(name_existing_files, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.1 on 2026-10-18 00:34
+
+from django.db import migrations, models
+
+
+def record_existing_thumbnails(apps, schema_editor):
+    # the thumbnails already made were saved on the ticket files sharing the blob
+    FileBlob = apps.get_model('pages', 'FileBlob')
+    TicketFiles = apps.get_model('pages', 'TicketFiles')
+    thumbnails = dict(
+        TicketFiles.objects.filter(blob__isnull=False).exclude(thumbnail='').values_list('blob_id', 'thumbnail').iterator())
+    FileBlob.objects.bulk_update(
+        [FileBlob(pk=pk, thumbnail=thumbnail) for pk, thumbnail in thumbnails.items()], ['thumbnail'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0014_ticket_file_original_names'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileblob',
+            name='thumbnail',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.RunPython(record_existing_thumbnails, migrations.RunPython.noop),
+    ]
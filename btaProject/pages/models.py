@@ -1,17 +1,66 @@
+from uuid import uuid4
+
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from django.conf import settings
 
+from accounts.helpers import get_user_group_names
+
+
+class ProjectQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        """
+        Projects a user can open: every project for administrators, otherwise those they manage or are assigned to
+        """
+        if 'Administrator' in get_user_group_names(user):
+            return self
+        if not user.is_authenticated:
+            return self.none()
+        assignments = Project.assigned_personnel.through.objects.filter(customuser=user, project=models.OuterRef('pk'))
+        return self.filter(models.Q(project_manager=user) | models.Exists(assignments))
+
+
+class TicketQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        """
+        Tickets a user can open: every ticket for administrators, tickets assigned to developers and project
+        managers, and tickets submitted by everyone else
+        """
+        group_names = get_user_group_names(user)
+        if 'Administrator' in group_names:
+            return self
+        if not user.is_authenticated:
+            return self.none()
+        if group_names & {'Developer', 'Project Manager'}:
+            return self.filter(assigned_developer=user)
+        return self.filter(submitter=user)
+
+
 class Project(models.Model):
     title = models.CharField(max_length=50)
     description = models.TextField(max_length=200)
     project_manager = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, blank=True, null=True, related_name='managed_projects')
 
     is_active = models.BooleanField(default=True)
+    date_updated = models.DateTimeField(auto_now=True)
+    # bumped when the project's tickets or personnel change, so that cached fragments listing them are stale
+    child_version = models.IntegerField(default=0, editable=False)
+    child_updated = models.DateTimeField(blank=True, null=True, editable=False)
 
     assigned_personnel = models.ManyToManyField(settings.AUTH_USER_MODEL)
+
+    objects = ProjectQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project_manager', 'is_active'], name='project_manager_active_idx'),
+            models.Index(fields=['is_active', 'title'], name='project_active_title_idx'),
+            # keyset pagination of the API
+            models.Index(fields=['date_updated', 'id'], name='project_updated_idx'),
+        ]
     
     def __str__(self):
         return self.title
@@ -46,6 +95,29 @@ class Ticket(models.Model):
     assigned_developer= models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, blank=True, null=True, related_name='assigned_tickets')
     submitter = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, blank=False, related_name='submissions')
     project = models.ForeignKey(Project, on_delete=models.CASCADE, blank=False, related_name='tickets')
+    # full-text search vector over title, description and comments (PostgreSQL only, see pages.search)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # bumped when history, comments or files are added to the ticket, so that cached fragments listing them are stale
+    child_version = models.IntegerField(default=0, editable=False)
+    child_updated = models.DateTimeField(blank=True, null=True, editable=False)
+
+    objects = TicketQuerySet.as_manager()
+
+    # fields whose loaded values are kept so that saves can be diffed without reading the row again
+    TRACKED_FIELDS = ['assigned_developer_id', 'status', 'priority', 'type', 'project_id', 'title', 'description']
+
+    class Meta:
+        # match the open ticket lookups made by the tickets table for each role, and per project lookups
+        indexes = [
+            models.Index(fields=['status', 'title'], name='ticket_status_title_idx'),
+            models.Index(fields=['status', 'assigned_developer'], name='ticket_status_dev_idx'),
+            models.Index(fields=['status', 'submitter'], name='ticket_status_submitter_idx'),
+            models.Index(fields=['project', 'status'], name='ticket_project_status_idx'),
+            # keyset pagination of the API, for all tickets and for each role's tickets
+            models.Index(fields=['date_updated', 'id'], name='ticket_updated_idx'),
+            models.Index(fields=['assigned_developer', 'date_updated', 'id'], name='ticket_dev_updated_idx'),
+            models.Index(fields=['submitter', 'date_updated', 'id'], name='ticket_submitter_updated_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -53,6 +125,41 @@ class Ticket(models.Model):
     def get_absolute_url(self):
         return reverse('ticket_details', args=[str(self.id)])
 
+    def save(self, *args, **kwargs):
+        # history entries recorded by the pre_save signal are inserted together when the save commits
+        from .helpers import history_batch
+        with history_batch():
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.snapshot_tracked_fields()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        self.snapshot_tracked_fields()
+
+    def snapshot_tracked_fields(self):
+        deferred = self.get_deferred_fields()
+        self._loaded_values = {field: getattr(self, field) for field in self.TRACKED_FIELDS if field not in deferred}
+
+    def get_loaded_values(self):
+        """
+        Returns the tracked field values as they were last loaded or saved. Fields that were never loaded
+        (deferred, or the instance was not built from the database) are read from the stored row instead.
+        Returns None if the ticket has no stored row.
+        """
+        loaded_values = dict(getattr(self, '_loaded_values', {}))
+        missing = [field for field in self.TRACKED_FIELDS if field not in loaded_values]
+        if missing:
+            stored_values = Ticket.objects.filter(pk=self.pk).values(*missing).first()
+            if stored_values is None:
+                return None
+            loaded_values.update(stored_values)
+        return loaded_values
+
 
 class TicketComment(models.Model):
     """
@@ -63,6 +170,11 @@ class TicketComment(models.Model):
     created = models.DateTimeField(default=timezone.now)
     ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='comments')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['ticket', 'created', 'id'], name='comment_ticket_created_idx'),
+        ]
+
     def __str__(self):
         return self.message
 
@@ -81,6 +193,34 @@ class TicketHistory(models.Model):
     date_changed = models.DateTimeField(default=timezone.now)
     ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='histories')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['ticket', 'date_changed', 'id'], name='history_ticket_changed_idx'),
+        ]
+
+
+class FileBlob(models.Model):
+    """
+    Stored file content shared by every ticket file with the same content digest (see pages.blobs).
+    ref_count is the number of ticket files using it; unreferenced blobs are removed by collect_file_blobs.
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    # storage name of the content
+    name = models.CharField(max_length=255)
+    # storage name of the thumbnail shared by its ticket files, deleted with the content
+    thumbnail = models.CharField(max_length=255, blank=True)
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ref_count'], condition=models.Q(ref_count__lte=0), name='fileblob_unreferenced_idx'),
+        ]
+
+    def __str__(self):
+        return self.digest
+
 
 class TicketFiles(models.Model):
     """
@@ -90,6 +230,108 @@ class TicketFiles(models.Model):
     uploaded_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='files')
     file = models.FileField()
+    # name of the file as uploaded, files with the same content share the storage name of the first upload
+    original_name = models.CharField(max_length=255, blank=True)
+    # shared content of the file, files stored before deduplication have none
+    blob = models.ForeignKey(FileBlob, on_delete=models.PROTECT, blank=True, null=True, related_name='ticket_files')
+
+    class PreviewStatus(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        READY = 'READY', 'Ready'
+        UNAVAILABLE = 'UNAVAILABLE', 'Unavailable'
+        FAILED = 'FAILED', 'Failed'
+
+    # generated in the background after upload, see pages.previews
+    preview_status = models.CharField(max_length=20, choices=PreviewStatus.choices, default=PreviewStatus.PENDING)
+    # storage name of the thumbnail of an image, stored next to the file
+    thumbnail = models.CharField(max_length=255, blank=True)
+    # first and last lines of a text file
+    excerpt = models.TextField(blank=True)
     
     def __str__(self):
         return self.file.name
+
+
+
+class TicketFileUpload(models.Model):
+    """
+    A ticket file being uploaded in chunks. The chunks are written straight into a multipart upload at the
+    file storage, and the TicketFiles row is only created once every chunk has arrived.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='uploads')
+    uploaded_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # storage name of the assembled file
+    name = models.CharField(max_length=255)
+    # name of the file as uploaded
+    original_name = models.CharField(max_length=255, blank=True)
+    size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    # bytes stored so far, the offset of the next chunk
+    received = models.BigIntegerField(default=0)
+    # id of the multipart upload at the storage, if it has one
+    storage_upload_id = models.CharField(max_length=255, blank=True)
+    # hex sha256 digest of every chunk stored so far, in order, for the content digest of the file
+    chunk_digests = models.TextField(blank=True, default='')
+    created = models.DateTimeField(default=timezone.now)
+    # when the last chunk was stored, uploads left alone for too long are aborted by collect_file_uploads
+    updated = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.name
+
+class TicketCounter(models.Model):
+    """
+    Running number of tickets per status, type and project, kept up to date by the ticket signals so that
+    the dashboard does not have to aggregate the whole ticket table
+    """
+    class Dimension(models.TextChoices):
+        STATUS = 'STATUS', _('Status')
+        TYPE = 'TYPE', _('Type')
+        PROJECT = 'PROJECT', _('Project')
+
+    dimension = models.CharField(max_length=10, choices=Dimension.choices)
+    value = models.CharField(max_length=50)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'value'], name='unique_ticket_counter'),
+        ]
+
+    def __str__(self):
+        return '%s %s: %s' % (self.dimension, self.value, self.count)
+
+
+
+class Job(models.Model):
+    """
+    A call of a background task queued by pages.jobs.enqueue and run by the run_worker command. Jobs are
+    deleted once they succeed; failed jobs are retried until max_attempts and then kept as FAILED.
+    """
+    class Status(models.TextChoices):
+        QUEUED = 'QUEUED', _('Queued')
+        RUNNING = 'RUNNING', _('Running')
+        FAILED = 'FAILED', _('Failed')
+
+    # name of a function registered with pages.jobs.task
+    task = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=1)
+    # not run before, moved on after each failed attempt
+    run_at = models.DateTimeField(default=timezone.now)
+    # a running job is run again by another worker if the worker running it stops extending this
+    locked_until = models.DateTimeField(blank=True, null=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s' % (self.task, self.status)
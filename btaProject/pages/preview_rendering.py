@@ -0,0 +1,43 @@
+"""
+Rendering of ticket file previews from the bytes of the file, which pages.previews reads from the storage
+"""
+import io
+
+THUMBNAIL_SIZE = (320, 320)
+# stands for the lines left out of an excerpt
+OMISSION = '…'
+
+
+def make_thumbnail(data, size=THUMBNAIL_SIZE):
+    """
+    Returns a JPEG of the image in data scaled down to fit size. Requires Pillow.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail(size)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=80)
+    return output.getvalue()
+
+
+def make_excerpt(head, tail, lines):
+    """
+    Returns the first and last lines of a text file from its first bytes, head, and last bytes, tail. tail
+    is None when head is the whole file. Returns None for binary content.
+    """
+    if b'\0' in head or (tail and b'\0' in tail):
+        return None
+    head_lines = head.decode('utf-8', 'replace').splitlines()
+    if tail is None:
+        if len(head_lines) <= 2 * lines:
+            return '\n'.join(head_lines)
+        return '\n'.join(head_lines[:lines] + [OMISSION] + head_lines[-lines:])
+
+    # the head stops and the tail starts part way through a line, those partial lines are left out
+    head_lines = head_lines[:-1] or head_lines
+    tail_lines = tail.decode('utf-8', 'replace').splitlines()
+    tail_lines = tail_lines[1:] or tail_lines
+    return '\n'.join(head_lines[:lines] + [OMISSION] + tail_lines[-lines:])
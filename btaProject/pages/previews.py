@@ -0,0 +1,130 @@
+import importlib.util
+import logging
+import mimetypes
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .blobs import thumbnail_name
+from .helpers import touch_tickets
+from .jobs import enqueue, task
+from .models import FileBlob, TicketFiles
+from .preview_rendering import make_excerpt, make_thumbnail
+from .uploads import is_s3_storage
+
+logger = logging.getLogger(__name__)
+
+# image types Pillow reads, only thumbnailed if it is installed
+THUMBNAIL_TYPES = {'image/bmp', 'image/gif', 'image/jpeg', 'image/png', 'image/webp'}
+PILLOW_INSTALLED = importlib.util.find_spec('PIL') is not None
+# text files mimetypes does not know about
+TEXT_EXTENSIONS = {'.log', '.out', '.err', '.trace', '.ini', '.cfg', '.yaml', '.yml', '.toml'}
+
+
+def preview_kind(name):
+    """
+    Returns 'image', 'text' or None, the kind of preview a file named name gets
+    """
+    content_type, _ = mimetypes.guess_type(name)
+    if content_type in THUMBNAIL_TYPES:
+        return 'image' if PILLOW_INSTALLED else None
+    if (content_type or '').startswith('text/') or content_type == 'application/json' \
+            or os.path.splitext(name)[1].lower() in TEXT_EXTENSIONS:
+        return 'text'
+    return None
+
+
+def read_head_and_tail(storage, name, size, length):
+    """
+    Returns the first and last length bytes of a stored file, or the whole file and None if it is no longer
+    than both. S3 objects are read with range requests rather than downloaded whole.
+    """
+    if size <= 2 * length:
+        with storage.open(name, 'rb') as file:
+            return file.read(), None
+    if is_s3_storage(storage):
+        client = storage.connection.meta.client
+        params = {'Bucket': storage.bucket_name, 'Key': storage._normalize_name(name)}
+        head = client.get_object(Range='bytes=0-%d' % (length - 1), **params)['Body'].read()
+        tail = client.get_object(Range='bytes=-%d' % length, **params)['Body'].read()
+        return head, tail
+    with storage.open(name, 'rb') as file:
+        head = file.read(length)
+        file.seek(-length, os.SEEK_END)
+        return head, file.read()
+
+
+def build_preview(ticket_file):
+    """
+    Returns the preview fields of ticket_file
+    """
+    storage = ticket_file.file.storage
+    name = ticket_file.file.name
+    kind = preview_kind(name)
+    if kind is None:
+        return {'preview_status': TicketFiles.PreviewStatus.UNAVAILABLE}
+
+    size = ticket_file.blob.size if ticket_file.blob_id else storage.size(name)
+    if kind == 'image':
+        if size > settings.PREVIEW_MAX_IMAGE_SIZE:
+            return {'preview_status': TicketFiles.PreviewStatus.UNAVAILABLE}
+        with storage.open(name, 'rb') as file:
+            thumbnail = make_thumbnail(file.read())
+        return {
+            'preview_status': TicketFiles.PreviewStatus.READY,
+            'thumbnail': storage.save(thumbnail_name(name), ContentFile(thumbnail)),
+        }
+
+    head, tail = read_head_and_tail(storage, name, size, settings.PREVIEW_EXCERPT_BYTES)
+    excerpt = make_excerpt(head, tail, settings.PREVIEW_EXCERPT_LINES)
+    if excerpt is None:
+        return {'preview_status': TicketFiles.PreviewStatus.UNAVAILABLE}
+    return {'preview_status': TicketFiles.PreviewStatus.READY, 'excerpt': excerpt}
+
+
+def record_blob_thumbnail(ticket_file, preview):
+    """
+    Records the thumbnail in preview on the blob of ticket_file, for collect_file_blobs to delete with it,
+    under the name the storage saved it as. If a copy of the file got its thumbnail first, that one is used.
+    """
+    if not FileBlob.objects.filter(pk=ticket_file.blob_id, thumbnail='').update(thumbnail=preview['thumbnail']):
+        ticket_file.file.storage.delete(preview['thumbnail'])
+        preview['thumbnail'] = FileBlob.objects.values_list('thumbnail', flat=True).get(pk=ticket_file.blob_id)
+
+
+@task
+def generate_preview(ticket_file_id):
+    """
+    Generates the preview of a ticket file that is still pending. Files sharing their content with a ticket
+    file that already has a preview reuse it.
+    """
+    ticket_file = TicketFiles.objects.select_related('blob').filter(
+        pk=ticket_file_id, preview_status=TicketFiles.PreviewStatus.PENDING).first()
+    if ticket_file is None:
+        return
+
+    preview = None
+    if ticket_file.blob_id is not None:
+        preview = TicketFiles.objects.filter(
+            blob_id=ticket_file.blob_id,
+            preview_status__in=[TicketFiles.PreviewStatus.READY, TicketFiles.PreviewStatus.UNAVAILABLE],
+        ).values('preview_status', 'thumbnail', 'excerpt').first()
+    if preview is None:
+        try:
+            preview = build_preview(ticket_file)
+        except Exception:
+            logger.exception('Could not generate the preview of ticket file %s', ticket_file_id)
+            preview = {'preview_status': TicketFiles.PreviewStatus.FAILED}
+        if preview.get('thumbnail') and ticket_file.blob_id is not None:
+            record_blob_thumbnail(ticket_file, preview)
+    TicketFiles.objects.filter(pk=ticket_file_id).update(**preview)
+    touch_tickets([ticket_file.ticket_id])
+
+
+def schedule_preview(ticket_file):
+    """
+    Queues the preview of a new ticket file for the job worker (run_worker), rather than rendering it in the
+    web server. The job is saved with the ticket file, so it cannot be lost to a restart.
+    """
+    enqueue(generate_preview, ticket_file.pk)
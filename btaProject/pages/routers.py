@@ -0,0 +1,172 @@
+"""
+Routing of reads to the read replicas in DATABASE_REPLICAS. Everything is written to and, by default, read
+from the default database. Only code run within reading_from a replica (see pages.views.ReplicaReadMixin) reads
+from a replica, and only from one that is no more than REPLICA_MAX_LAG seconds behind.
+
+Users who have just written are pinned to the default database by a signed cookie, so they read their own
+writes. A replica's lag is checked every REPLICA_LAG_CHECK_INTERVAL seconds, so a replica read from was, at
+most that long ago, no more than REPLICA_MAX_LAG seconds behind. The pin lasts the two added together: by the
+time it expires, any replica read from has the user's writes.
+"""
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signing import BadSignature
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'db_pinned'
+PIN_SALT = 'pages.routers.pin'
+# seconds behind the default database, of the replicas. A replica that reports no replay since it started
+# (it is caught up, or has never received anything) counts as up to date.
+POSTGRESQL_LAG_QUERY = """
+    SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+           ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END
+"""
+
+# the replica read from and whether anything was written, in the current request
+_state = threading.local()
+# replica alias: (time checked, seconds of lag or None if it could not be reached)
+_lags = {}
+
+
+def replica_lag(alias):
+    """
+    Returns how many seconds the replica alias is behind, or None if it cannot be reached. The lag is
+    checked at most once every REPLICA_LAG_CHECK_INTERVAL seconds.
+    """
+    checked, lag = _lags.get(alias, (None, None))
+    now = time.monotonic()
+    if checked is not None and now - checked < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return lag
+
+    connection = connections[alias]
+    try:
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(POSTGRESQL_LAG_QUERY)
+                lag = float(cursor.fetchone()[0])
+        else:
+            # e.g. a second SQLite database in development, which is never behind as nothing replicates to it
+            connection.ensure_connection()
+            lag = 0
+    except DatabaseError:
+        logger.warning('Could not check the lag of the %s database', alias, exc_info=True)
+        lag = None
+    _lags[alias] = (now, lag)
+    return lag
+
+
+def choose_replica():
+    """
+    Returns one of the replicas no more than REPLICA_MAX_LAG seconds behind, or None if there are none
+    """
+    replicas = [
+        alias for alias in settings.DATABASE_REPLICAS
+        if (lag := replica_lag(alias)) is not None and lag <= settings.REPLICA_MAX_LAG
+    ]
+    return random.choice(replicas) if replicas else None
+
+
+def pin_duration():
+    # seconds until every replica read from has a write: it can be as far behind as when its lag was last checked
+    return settings.REPLICA_MAX_LAG + settings.REPLICA_LAG_CHECK_INTERVAL
+
+
+def is_pinned(request):
+    """
+    Returns true if the user wrote less than pin_duration() seconds ago, in this request or an earlier one
+    """
+    if getattr(_state, 'wrote', False):
+        return True
+    try:
+        return request.get_signed_cookie(
+            PIN_COOKIE, default=None, salt=PIN_SALT, max_age=pin_duration()) is not None
+    except BadSignature:
+        return False
+
+
+def get_read_database(request):
+    """
+    Returns the replica the views reading from replicas should read from, or None for the default database
+    when the user is pinned to it or no replica is close enough behind it
+    """
+    if not settings.DATABASE_REPLICAS or is_pinned(request):
+        return None
+    return choose_replica()
+
+
+@contextmanager
+def reading_from(alias):
+    """
+    Reads from the database alias within the block (the default database if it is None)
+    """
+    previous = getattr(_state, 'alias', None)
+    _state.alias = alias
+    try:
+        yield
+    finally:
+        _state.alias = previous
+
+
+def iterate_reading_from(alias, iterable):
+    """
+    Wraps the content of a streaming response, which is read after the view returns, to read from alias.
+    Each item is read in its own reading_from, as the server may read them from different threads.
+    """
+    iterator = iter(iterable)
+    while True:
+        with reading_from(alias):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class ReplicaRouter:
+    """
+    Sends writes to the default database, and reads to the replica of the current reading_from if any
+    """
+    def db_for_read(self, model, **hints):
+        # the database cache (see CACHES) must never be read stale
+        if getattr(_state, 'wrote', False) or model._meta.app_label == 'django_cache':
+            return DEFAULT_DB_ALIAS
+        return getattr(_state, 'alias', None)
+
+    def db_for_write(self, model, **hints):
+        # sessions and cache entries are saved on most requests, they do not pin the user
+        if model._meta.app_label not in ('sessions', 'django_cache'):
+            _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaPinMiddleware:
+    """
+    Pins users who wrote during a request to the default database for the next pin_duration() seconds
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+            if _state.wrote and settings.DATABASE_REPLICAS:
+                response.set_signed_cookie(
+                    PIN_COOKIE, '1', salt=PIN_SALT, max_age=pin_duration(), httponly=True,
+                    secure=request.is_secure(), samesite='Lax')
+            return response
+        finally:
+            _state.wrote = False
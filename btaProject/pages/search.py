@@ -0,0 +1,102 @@
+from django.db import connection
+from django.db.models import F, Q, TextField, Value
+
+from .models import Ticket, TicketComment
+
+# SQLite keeps the searchable text in an FTS5 table whose rowid is the ticket id
+SQLITE_FTS_TABLE = 'pages_ticket_fts'
+
+
+def index_ticket(ticket):
+    """
+    Rebuilds the search entry of one ticket from its title, description and comments
+    """
+    comments = ' '.join(TicketComment.objects.filter(ticket_id=ticket.pk).values_list('message', flat=True))
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchVector
+        Ticket.objects.filter(pk=ticket.pk).update(search_vector=(
+            SearchVector('title', weight='A') +
+            SearchVector('description', weight='B') +
+            SearchVector(Value(comments, output_field=TextField()), weight='C')
+        ))
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE rowid = %%s' % SQLITE_FTS_TABLE, [ticket.pk])
+            cursor.execute(
+                'INSERT INTO %s (rowid, title, description, comments) VALUES (%%s, %%s, %%s, %%s)' % SQLITE_FTS_TABLE,
+                [ticket.pk, ticket.title, ticket.description, comments])
+
+
+def remove_ticket_from_index(ticket_id):
+    # the PostgreSQL search vector is stored on the ticket row and goes with it
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE rowid = %%s' % SQLITE_FTS_TABLE, [ticket_id])
+
+
+def index_new_tickets(tickets):
+    """
+    Adds tickets that have no comments yet to the search index in one statement, for tickets created with
+    bulk_create which skips the save signals
+    """
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchVector
+        Ticket.objects.filter(pk__in=[ticket.pk for ticket in tickets]).update(search_vector=(
+            SearchVector('title', weight='A') + SearchVector('description', weight='B')
+        ))
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO %s (rowid, title, description, comments) VALUES (%%s, %%s, %%s, %%s)' % SQLITE_FTS_TABLE,
+                [(ticket.pk, ticket.title, ticket.description, '') for ticket in tickets])
+
+
+def search_tickets(queryset, query, offset, limit):
+    """
+    Returns the number of tickets in queryset matching query and the requested slice of them, best match
+    first. Each returned ticket has a rank attribute.
+    """
+    if connection.vendor == 'postgresql':
+        return _search_postgresql(queryset, query, offset, limit)
+    if connection.vendor == 'sqlite':
+        return _search_sqlite(queryset, query, offset, limit)
+
+    # no search index on other databases: plain substring matching, unranked
+    matches = queryset.filter(
+        Q(title__icontains=query) | Q(description__icontains=query) | Q(comments__message__icontains=query)
+    ).distinct().annotate(rank=Value(0.0)).order_by('-id')
+    return matches.count(), list(matches[offset:offset + limit])
+
+
+def _search_postgresql(queryset, query, offset, limit):
+    from django.contrib.postgres.search import SearchQuery, SearchRank
+    search_query = SearchQuery(query, search_type='websearch')
+    matches = queryset.filter(search_vector=search_query).annotate(rank=SearchRank(F('search_vector'), search_query))
+    return matches.count(), list(matches.order_by('-rank', '-id')[offset:offset + limit])
+
+
+def _search_sqlite(queryset, query, offset, limit):
+    # quote every term so user input cannot be read as FTS5 query syntax
+    terms = ' '.join('"%s"' % term.replace('"', '""') for term in query.split())
+    if not terms:
+        return 0, []
+    # the matches are restricted to the visible tickets and paged by the database
+    visible_sql, visible_params = queryset.order_by().values('pk').query.sql_with_params()
+    matches = '%s WHERE %s MATCH %%s AND %s.rowid IN (%s)' % (SQLITE_FTS_TABLE, SQLITE_FTS_TABLE, SQLITE_FTS_TABLE, visible_sql)
+    params = [terms, *visible_params]
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM %s' % matches, params)
+        count = cursor.fetchone()[0]
+        cursor.execute(
+            'SELECT %s.rowid, bm25(%s) FROM %s ORDER BY bm25(%s), %s.rowid DESC LIMIT %%s OFFSET %%s' % (
+                SQLITE_FTS_TABLE, SQLITE_FTS_TABLE, matches, SQLITE_FTS_TABLE, SQLITE_FTS_TABLE),
+            [*params, limit, offset])
+        # bm25 scores are lower for better matches
+        ranks = {ticket_id: -score for ticket_id, score in cursor.fetchall()}
+
+    tickets = Ticket.objects.in_bulk(list(ranks))
+    for ticket_id, rank in ranks.items():
+        tickets[ticket_id].rank = rank
+    return count, [tickets[ticket_id] for ticket_id in ranks]
+
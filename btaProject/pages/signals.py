@@ -1,8 +1,16 @@
-from django.db.models.signals import pre_save, post_save
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, pre_save, post_save
 from django.dispatch import receiver
 
-from .helpers import add_history
-from .models import Project, Ticket
+from .blobs import release_blob
+from .helpers import (
+    add_history, adjust_ticket_counter, adjust_ticket_counters, schedule_project_archive, ticket_counter_values,
+    touch_projects, touch_tickets,
+)
+from .models import Project, Ticket, TicketComment, TicketFiles
+from .previews import schedule_preview
+from .search import index_ticket, remove_ticket_from_index
 
 
 
@@ -10,42 +18,155 @@ from .models import Project, Ticket
 def close_project_tickets_if_archived(sender, instance, created, **kwargs):
     # runs only if project is being updated
     if not created and not instance.is_active:
-        for ticket in instance.tickets.all():
-            ticket.status = 'CLOSED'
-            ticket.save()
+        schedule_project_archive(instance)
 
 
 @receiver(pre_save, sender=Ticket)
 def record_ticket_history(sender, instance, raw, **kwargs):
     # do nothing if ticket instance is being created
     if not raw and instance.id:
-        previous_state = Ticket.objects.get(id=instance.id)
+        previous_state = instance.get_loaded_values()
+        if previous_state is None:
+            return
+        # kept for update_ticket_counters once the save has gone through
+        instance._previous_state = previous_state
         
-        if previous_state.assigned_developer != instance.assigned_developer:
+        if previous_state['assigned_developer_id'] != instance.assigned_developer_id:
+            previous_developer = None
+            if previous_state['assigned_developer_id'] is not None:
+                previous_developer = get_user_model().objects.filter(pk=previous_state['assigned_developer_id']).first()
             add_history(
                 action='Assigned to User', 
-                prev_val=previous_state.assigned_developer,
+                prev_val=previous_developer,
                 new_val=instance.assigned_developer,
                 ticket=instance)
 
-        if previous_state.status != instance.status:
+        if previous_state['status'] != instance.status:
             add_history(
                 action='Status Updated', 
-                prev_val=previous_state.status,
+                prev_val=previous_state['status'],
                 new_val=instance.status,
                 ticket=instance)
 
-        if previous_state.priority != instance.priority:
+        if previous_state['priority'] != instance.priority:
             add_history(
                 action='Priority Changed', 
-                prev_val=previous_state.priority,
+                prev_val=previous_state['priority'],
                 new_val=instance.priority,
                 ticket=instance)
             
-        if previous_state.type != instance.type:
+        if previous_state['type'] != instance.type:
             add_history(
                 action='Type Changed',
-                prev_val=previous_state.type,
+                prev_val=previous_state['type'],
                 new_val=instance.type,
                 ticket=instance
-            )
\ No newline at end of file
+            )
+
+
+@receiver(post_save, sender=Ticket)
+def touch_ticket_projects(sender, instance, raw, **kwargs):
+    # before update_ticket_counters, which consumes the previous state
+    if raw:
+        return
+    project_ids = {instance.project_id}
+    previous_state = instance.__dict__.get('_previous_state')
+    if previous_state is not None:
+        project_ids.add(previous_state['project_id'])
+    touch_projects(project_ids)
+
+
+@receiver(post_save, sender=Ticket)
+def update_ticket_search_index(sender, instance, raw, update_fields, **kwargs):
+    # before update_ticket_counters, which consumes the previous state. The indexed text only changes with the
+    # title or description, so other saves leave the index alone.
+    if raw or (update_fields is not None and not {'title', 'description'} & set(update_fields)):
+        return
+    previous_state = instance.__dict__.get('_previous_state')
+    if previous_state is not None and (previous_state['title'], previous_state['description']) == (
+            instance.title, instance.description):
+        return
+    index_ticket(instance)
+
+
+@receiver(post_save, sender=Ticket)
+def update_ticket_counters(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    previous_state = instance.__dict__.pop('_previous_state', None)
+    # the saved values are what the next save of this instance is compared against
+    instance.snapshot_tracked_fields()
+    if created:
+        adjust_ticket_counters(instance.status, instance.type, instance.project_id, 1)
+        return
+
+    if previous_state is None:
+        return
+    previous_values = ticket_counter_values(previous_state['status'], previous_state['type'], previous_state['project_id'])
+    current_values = ticket_counter_values(instance.status, instance.type, instance.project_id)
+    for (dimension, previous_value), (_, current_value) in zip(previous_values, current_values):
+        if previous_value != current_value:
+            adjust_ticket_counter(dimension, previous_value, -1)
+            adjust_ticket_counter(dimension, current_value, 1)
+
+
+@receiver(post_delete, sender=Ticket)
+def remove_ticket_from_counters(sender, instance, **kwargs):
+    adjust_ticket_counters(instance.status, instance.type, instance.project_id, -1)
+    touch_projects([instance.project_id])
+
+
+@receiver(post_delete, sender=Ticket)
+def remove_ticket_from_search_index(sender, instance, **kwargs):
+    remove_ticket_from_index(instance.pk)
+
+
+@receiver(post_save, sender=TicketComment)
+@receiver(post_delete, sender=TicketComment)
+def update_commented_ticket_search_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_ticket(instance.ticket)
+
+
+@receiver(post_delete, sender=TicketFiles)
+def release_ticket_file_blob(sender, instance, **kwargs):
+    # the blob itself is removed by collect_file_blobs once nothing references it
+    if instance.blob_id is not None:
+        release_blob(instance.blob_id)
+
+
+@receiver(post_save, sender=TicketFiles)
+def generate_ticket_file_preview(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        schedule_preview(instance)
+
+
+@receiver(post_save, sender=TicketComment)
+@receiver(post_delete, sender=TicketComment)
+@receiver(post_save, sender=TicketFiles)
+@receiver(post_delete, sender=TicketFiles)
+def touch_ticket_of_child(sender, instance, raw=False, **kwargs):
+    if not raw:
+        touch_tickets([instance.ticket_id])
+
+
+@receiver(m2m_changed, sender=Project.assigned_personnel.through)
+def touch_projects_on_personnel_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            touch_projects([instance.pk])
+    elif action == 'pre_clear':
+        # instance is a user being removed from every project: the projects are only known before the clear
+        instance._cleared_project_ids = list(instance.project_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        touch_projects(instance.__dict__.pop('_cleared_project_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        touch_projects(pk_set)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def touch_projects_of_user(sender, instance, created, raw, update_fields, **kwargs):
+    # project personnel tables list the email, username and role of users
+    if raw or created or (update_fields is not None and not {'email', 'username', 'user_role'} & set(update_fields)):
+        return
+    touch_projects(Project.objects.filter(assigned_personnel=instance).values('pk'))
@@ -0,0 +1,64 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+
+from pages.helpers import CACHED_FRAGMENTS, fragment_cache_key, record_fragment_lookup
+
+register = template.Library()
+
+
+class FragmentCacheNode(template.Node):
+    def __init__(self, nodelist, name, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+
+    def get_key(self, context):
+        return fragment_cache_key(self.name, [value.resolve(context) for value in self.vary_on])
+
+    def get_cached(self, context, key):
+        """
+        Returns the cached content of the fragment, or None. The first fragment rendered looks up every
+        fragment of the template with one get_many, with the values they vary on at that point. The others
+        take their content from it, unless their values have changed since.
+        """
+        lookup = context.render_context.get(self)
+        if lookup is None:
+            nodes = context.template.nodelist.get_nodes_by_type(FragmentCacheNode)
+            keys = {node.get_key(context) for node in nodes} | {key}
+            lookup = (keys, cache.get_many(keys))
+            for node in nodes:
+                context.render_context[node] = lookup
+        keys, found = lookup
+        return found.get(key) if key in keys else cache.get(key)
+
+    def render(self, context):
+        key = self.get_key(context)
+        content = self.get_cached(context, key)
+        record_fragment_lookup(self.name, hit=content is not None)
+        if content is None:
+            content = self.nodelist.render(context)
+            cache.set(key, content, settings.FRAGMENT_CACHE_TIMEOUT)
+        return content
+
+
+@register.tag
+def cachefragment(parser, token):
+    """
+    Caches the enclosed fragment under its name and the versions it varies on, counting hits and misses:
+
+        {% cachefragment 'ticket_comments' ticket.pk ticket.date_updated ticket.child_version %}
+            ...
+        {% endcachefragment %}
+
+    The fragment must not depend on the user viewing it, beyond the values it varies on.
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError('%r takes a fragment name and at least one value to vary on' % bits[0])
+    name = bits[1].strip('\'"')
+    if name not in CACHED_FRAGMENTS:
+        raise template.TemplateSyntaxError('%r is not listed in pages.helpers.CACHED_FRAGMENTS' % name)
+    nodelist = parser.parse(('endcachefragment',))
+    parser.delete_first_token()
+    return FragmentCacheNode(nodelist, name, [parser.compile_filter(bit) for bit in bits[2:]])
@@ -0,0 +1,207 @@
+import json
+from unittest import skipUnless
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from accounts.helpers import get_permissions
+from .. import factories
+from .. import models
+from ..api import TicketListApiView
+from .test_views import ValidUserTestCase
+
+
+class ApiTestCase(ValidUserTestCase):
+    codenames = []
+
+    def setUp(self):
+        self.user.user_permissions.add(*get_permissions(self.codenames))
+        self.project = factories.ProjectFactory(title='Test Project', description='Test Project Description')
+        return super().setUp()
+
+    def get_json(self, url, **params):
+        response = self.client.get(url, data=params)
+        return response.status_code, json.loads(response.content)
+
+    def send_json(self, method, url, data):
+        response = getattr(self.client, method)(url, data=json.dumps(data), content_type='application/json')
+        return response.status_code, json.loads(response.content)
+
+
+class TicketListApiTests(ApiTestCase):
+    codenames = ['view_ticket', 'add_ticket']
+
+    def setUp(self):
+        super().setUp()
+        self.tickets = [
+            factories.TicketFactory(title='Ticket %d' % i, description='Test', project=self.project, submitter=self.user)
+            for i in range(7)
+        ]
+
+    def collect_pages(self, **params):
+        ids, url, pages = [], reverse('api_tickets'), 0
+        while url:
+            status, data = self.get_json(url, **params)
+            self.assertEqual(status, 200)
+            ids += [row['id'] for row in data['results']]
+            url, params, pages = data['next'], {}, pages + 1
+        return ids, pages
+
+    def test_requires_login(self):
+        """Returns true if anonymous requests get a JSON 401 rather than a redirect"""
+        self.client.logout()
+        status, data = self.get_json(reverse('api_tickets'))
+        self.assertEqual(status, 401)
+        self.assertIn('error', data)
+
+    def test_requires_permission(self):
+        """Returns true if users without the view_ticket permission are refused"""
+        self.user.groups.clear()
+        self.user.user_permissions.clear()
+        status, _ = self.get_json(reverse('api_tickets'))
+        self.assertEqual(status, 403)
+
+    def test_cursor_walks_every_ticket_once_in_update_order(self):
+        """Returns true if following the next links returns every ticket once, oldest update first"""
+        self.tickets[0].title = 'Updated Ticket'
+        self.tickets[0].save()
+        ids, pages = self.collect_pages(page_size=3)
+        self.assertEqual(pages, 3)
+        self.assertEqual(ids, [ticket.pk for ticket in self.tickets[1:]] + [self.tickets[0].pk])
+
+    def test_excludes_tickets_user_cannot_see(self):
+        """Returns true if tickets submitted by other users are not listed to a submitter"""
+        other = factories.CustomUserFactory(username='test_submitter')
+        hidden = factories.TicketFactory(title='Other Ticket', description='Test', project=self.project, submitter=other)
+        ids, _ = self.collect_pages()
+        self.assertNotIn(hidden.pk, ids)
+
+    def test_sparse_fieldsets(self):
+        """Returns true if only the requested fields are returned"""
+        status, data = self.get_json(reverse('api_tickets'), fields='id,status')
+        self.assertEqual(status, 200)
+        self.assertEqual(set(data['results'][0]), {'id', 'status'})
+
+    def test_unknown_fields_are_rejected(self):
+        """Returns true if requesting a field that is not exposed is an error"""
+        status, data = self.get_json(reverse('api_tickets'), fields='id,search_vector')
+        self.assertEqual(status, 400)
+        self.assertIn('search_vector', data['error'])
+
+    def test_invalid_cursor_is_rejected(self):
+        """Returns true if a malformed cursor is an error rather than a server error"""
+        status, _ = self.get_json(reverse('api_tickets'), cursor='not-a-cursor')
+        self.assertEqual(status, 400)
+
+    def test_deep_pages_do_not_use_offset(self):
+        """Returns true if later pages seek from the cursor instead of skipping rows with OFFSET"""
+        _, data = self.get_json(reverse('api_tickets'), page_size=3)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(data['next'])
+        ticket_queries = [query['sql'] for query in queries if 'FROM "pages_ticket"' in query['sql']]
+        self.assertEqual(len(ticket_queries), 1)
+        self.assertNotIn('OFFSET', ticket_queries[0])
+
+    @skipUnless(connection.vendor == 'sqlite', 'query plans are checked against SQLite')
+    def test_cursor_page_uses_keyset_index(self):
+        """Returns true if a submitter's page after a cursor is read through the submitter/update index"""
+        last = self.tickets[3]
+        queryset = models.Ticket.objects.visible_to(self.user).filter(date_updated__gte=last.date_updated)
+        plan = queryset.order_by('date_updated', 'id')[:TicketListApiView.page_size].explain()
+        self.assertIn('ticket_submitter_updated_idx', plan)
+
+    def test_create_ticket(self):
+        """Returns true if a posted ticket is created with the requesting user as submitter"""
+        status, data = self.send_json('post', reverse('api_tickets'), {
+            'title': 'New Ticket', 'description': 'Test', 'project': self.project.pk,
+            'priority': 'HIGH', 'status': 'OPEN', 'type': 'CHANGE',
+        })
+        self.assertEqual(status, 201)
+        self.assertEqual(data['submitter'], self.user.pk)
+        self.assertTrue(models.Ticket.objects.filter(pk=data['id'], title='New Ticket').exists())
+
+    def test_create_ticket_validates_data(self):
+        """Returns true if invalid tickets are refused with the form errors"""
+        status, data = self.send_json('post', reverse('api_tickets'), {'title': 'New Ticket', 'priority': 'URGENT'})
+        self.assertEqual(status, 400)
+        self.assertIn('priority', data['errors'])
+        self.assertIn('project', data['errors'])
+
+
+class TicketApiTests(ApiTestCase):
+    codenames = ['view_ticket', 'change_ticket', 'add_comment']
+
+    def setUp(self):
+        super().setUp()
+        self.ticket = factories.TicketFactory(
+            title='Test Ticket', description='Test', project=self.project, submitter=self.user, priority='LOW')
+
+    def test_patch_updates_only_given_fields(self):
+        """Returns true if a partial update leaves the other fields as they were"""
+        status, data = self.send_json('patch', reverse('api_ticket', args=[self.ticket.pk]), {'priority': 'HIGH'})
+        self.assertEqual(status, 200)
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.priority, 'HIGH')
+        self.assertEqual(self.ticket.title, 'Test Ticket')
+        self.assertEqual(data['priority'], 'HIGH')
+
+    def test_patch_closed_ticket_is_refused(self):
+        """Returns true if closed tickets cannot be edited, as in the HTML views"""
+        self.ticket.status = 'CLOSED'
+        self.ticket.save()
+        status, _ = self.send_json('patch', reverse('api_ticket', args=[self.ticket.pk]), {'priority': 'HIGH'})
+        self.assertEqual(status, 409)
+
+    def test_ticket_user_cannot_see_is_not_found(self):
+        """Returns true if tickets outside the user's visible tickets are answered with 404"""
+        other = factories.CustomUserFactory(username='test_submitter')
+        hidden = factories.TicketFactory(title='Other Ticket', description='Test', project=self.project, submitter=other)
+        status, _ = self.get_json(reverse('api_ticket', args=[hidden.pk]))
+        self.assertEqual(status, 404)
+
+    def test_comments_are_listed_and_created(self):
+        """Returns true if a posted comment is listed on the ticket's comments"""
+        url = reverse('api_ticket_comments', args=[self.ticket.pk])
+        status, data = self.send_json('post', url, {'message': 'First comment'})
+        self.assertEqual(status, 201)
+        self.assertEqual(data['commenter'], self.user.pk)
+        status, data = self.get_json(url, fields='message')
+        self.assertEqual(data['results'], [{'message': 'First comment'}])
+
+    def test_history_is_listed(self):
+        """Returns true if the history recorded by ticket updates is listed"""
+        self.send_json('patch', reverse('api_ticket', args=[self.ticket.pk]), {'priority': 'HIGH'})
+        status, data = self.get_json(reverse('api_ticket_history', args=[self.ticket.pk]), fields='new_value')
+        self.assertEqual(status, 200)
+        self.assertEqual(data['results'], [{'new_value': 'HIGH'}])
+
+
+class ProjectApiTests(ApiTestCase):
+    codenames = ['view_project', 'change_project']
+
+    def setUp(self):
+        super().setUp()
+        self.project.project_manager = self.user
+        self.project.save()
+
+    def test_lists_visible_projects(self):
+        """Returns true if only the projects the user manages or is assigned to are listed"""
+        factories.ProjectFactory(title='Other Project', description='Test Project Description')
+        status, data = self.get_json(reverse('api_projects'), fields='id')
+        self.assertEqual(status, 200)
+        self.assertEqual(data['results'], [{'id': self.project.pk}])
+
+    def test_patch_archived_project_is_refused(self):
+        """Returns true if archived projects cannot be edited, as in the HTML views"""
+        self.project.is_active = False
+        self.project.save()
+        status, _ = self.send_json('patch', reverse('api_project', args=[self.project.pk]), {'title': 'Renamed'})
+        self.assertEqual(status, 409)
+
+    def test_patch_updates_project(self):
+        """Returns true if a project's title can be changed"""
+        status, data = self.send_json('patch', reverse('api_project', args=[self.project.pk]), {'title': 'Renamed'})
+        self.assertEqual(status, 200)
+        self.assertEqual(data['title'], 'Renamed')
+        self.assertTrue(data['is_active'])
@@ -0,0 +1,131 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+from hashlib import sha256
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+
+from accounts.helpers import get_permissions
+from .. import factories, models
+from ..blobs import ContentDigest
+from .test_views import ValidUserTestCase
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+class ContentDigestTests(SimpleTestCase):
+    def test_digest_does_not_depend_on_how_data_arrives(self):
+        """Returns true if feeding the content in any pieces gives the digest of its blocks"""
+        content = bytes(range(256)) * 10
+        whole, pieces = ContentDigest(block_size=100), ContentDigest(block_size=100)
+        whole.update(content)
+        for start in range(0, len(content), 37):
+            pieces.update(content[start:start + 37])
+
+        blocks = [sha256(content[start:start + 100]).digest() for start in range(0, len(content), 100)]
+        self.assertEqual(whole.hexdigest(), sha256(b''.join(blocks)).hexdigest())
+        self.assertEqual(pieces.hexdigest(), whole.hexdigest())
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT=MEDIA_ROOT,
+    TICKET_FILE_CHUNK_SIZE=4,
+)
+class FileBlobTests(ValidUserTestCase):
+    content = b'0123456789'
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        return super().tearDownClass()
+
+    def setUp(self):
+        # every test starts from an empty storage
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        os.makedirs(MEDIA_ROOT)
+        self.user.user_permissions.add(*get_permissions(['view_ticket', 'add_ticketfiles']))
+        self.project = factories.ProjectFactory(title='Test Project', description='Test Project Description')
+        self.ticket = factories.TicketFactory(
+            title='Test Ticket', description='Test', project=self.project, submitter=self.user)
+        self.other_ticket = factories.TicketFactory(
+            title='Other Ticket', description='Test', project=self.project, submitter=self.user)
+        return super().setUp()
+
+    def upload(self, ticket, name='crash.log', content=None):
+        self.client.post(reverse('upload_ticket_file', args=[ticket.pk]), {
+            'file': SimpleUploadedFile(name, self.content if content is None else content),
+        })
+        return models.TicketFiles.objects.filter(ticket=ticket).latest('pk')
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(directory, name), MEDIA_ROOT)
+            for directory, _, names in os.walk(MEDIA_ROOT) for name in names)
+
+    def test_same_content_is_stored_once(self):
+        """Returns true if uploading the same content to two tickets stores it once with two references"""
+        first = self.upload(self.ticket)
+        second = self.upload(self.other_ticket, name='copy.log')
+        self.assertEqual(first.blob, second.blob)
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(models.FileBlob.objects.get().ref_count, 2)
+        self.assertEqual(self.stored_files(), [first.file.name])
+
+    def test_copies_keep_their_own_names(self):
+        """Returns true if files sharing stored content are listed and served under the names they were uploaded with"""
+        self.upload(self.ticket)
+        second = self.upload(self.other_ticket, name='copy.log')
+        self.assertEqual(second.original_name, 'copy.log')
+        self.assertContains(self.client.get(reverse('ticket_details', args=[self.other_ticket.pk])), 'copy.log')
+        response = self.client.get(reverse('ticket_file', args=[second.pk]))
+        self.assertEqual(response['Content-Disposition'], 'inline; filename="copy.log"')
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_different_content_is_stored_separately(self):
+        """Returns true if files with different content get blobs of their own"""
+        first = self.upload(self.ticket)
+        second = self.upload(self.ticket, content=b'9876543210')
+        self.assertNotEqual(first.blob, second.blob)
+        self.assertEqual(len(self.stored_files()), 2)
+
+    def test_chunked_upload_reuses_stored_content(self):
+        """Returns true if a chunked upload of stored content references it and drops its own copy"""
+        first = self.upload(self.ticket)
+        response = self.client.post(
+            reverse('api_ticket_file_uploads', args=[self.other_ticket.pk]),
+            data=json.dumps({'filename': 'again.log', 'size': len(self.content)}), content_type='application/json')
+        upload = json.loads(response.content)
+        for start in range(0, len(self.content), 4):
+            end = min(start + 4, len(self.content))
+            response = self.client.put(
+                upload['url'], data=self.content[start:end], content_type='application/octet-stream',
+                HTTP_CONTENT_RANGE='bytes %d-%d/%d' % (start, end - 1, len(self.content)))
+
+        self.assertEqual(json.loads(response.content)['name'], 'again.log')
+        second = models.TicketFiles.objects.get(pk=json.loads(response.content)['id'])
+        self.assertEqual((second.blob, second.original_name), (first.blob, 'again.log'))
+        self.assertEqual(models.FileBlob.objects.get().ref_count, 2)
+        self.assertEqual(self.stored_files(), [first.file.name])
+
+    def test_unreferenced_blobs_are_collected(self):
+        """Returns true if a blob is only deleted, with its content, once no ticket file uses it"""
+        first = self.upload(self.ticket)
+        second = self.upload(self.other_ticket)
+
+        first.delete()
+        call_command('collect_file_blobs', stdout=io.StringIO())
+        self.assertEqual(models.FileBlob.objects.get().ref_count, 1)
+        self.assertEqual(self.stored_files(), [second.file.name])
+
+        second.delete()
+        stdout = io.StringIO()
+        call_command('collect_file_blobs', stdout=stdout)
+        self.assertIn('Deleted 1 unreferenced blobs', stdout.getvalue())
+        self.assertFalse(models.FileBlob.objects.exists())
+        self.assertEqual(self.stored_files(), [])
@@ -0,0 +1,122 @@
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import datetime, timezone
+
+from django.core.management import call_command
+from django.http import StreamingHttpResponse
+from django.test import TestCase
+from django.urls import reverse
+
+from .. import factories, models
+from ..exports import export_rows
+from .test_views import ValidUserTestCase
+
+
+class ExportTestMixin:
+    def create_tickets(self, submitter):
+        self.project = factories.ProjectFactory(title='Test Project', description='Test Description')
+        self.other_project = factories.ProjectFactory(title='Other Project', description='Test Description')
+        self.ticket = factories.TicketFactory(
+            title='Open Ticket', description='Test', project=self.project, submitter=submitter,
+            date_created=datetime(2024, 1, 10, 12, tzinfo=timezone.utc))
+        self.closed_ticket = factories.TicketFactory(
+            title='Closed Ticket', description='Test', project=self.project, submitter=submitter, status='CLOSED',
+            date_created=datetime(2024, 2, 10, 12, tzinfo=timezone.utc))
+        self.other_ticket = factories.TicketFactory(
+            title='Other Ticket', description='Test', project=self.other_project, submitter=submitter,
+            date_created=datetime(2024, 3, 10, 12, tzinfo=timezone.utc))
+        models.TicketComment.objects.create(commenter=submitter, message='First comment', ticket=self.ticket)
+
+
+class ExportRowsTests(ExportTestMixin, TestCase):
+    fixtures = ['auth.json']
+    def setUp(self):
+        self.create_tickets(factories.CustomUserFactory(username='test_@submitter'))
+        return super().setUp()
+
+    def titles(self, **filters):
+        columns, rows = export_rows('tickets', **filters)
+        return {row['title'] for row in rows}
+
+    def test_filters_by_project_and_status(self):
+        """Returns true if only tickets of the given project and status are exported"""
+        self.assertEqual(self.titles(project=self.project.pk), {'Open Ticket', 'Closed Ticket'})
+        self.assertEqual(self.titles(project=self.project.pk, status='CLOSED'), {'Closed Ticket'})
+
+    def test_filters_by_inclusive_date_range(self):
+        """Returns true if tickets created on both ends of the date range are exported"""
+        self.assertEqual(
+            self.titles(date_from=datetime(2024, 1, 10).date(), date_to=datetime(2024, 2, 10).date()),
+            {'Open Ticket', 'Closed Ticket'})
+
+    def test_joined_datasets_include_ticket_columns(self):
+        """Returns true if comment rows carry the title of their ticket and project"""
+        columns, rows = export_rows('comments', project=self.project.pk)
+        self.assertEqual([(row['ticket_title'], row['project_title'], row['message']) for row in rows],
+                         [('Open Ticket', 'Test Project', 'First comment')])
+
+    def test_rows_are_not_loaded_until_iterated(self):
+        """Returns true if export_rows returns a lazy iterator rather than a list of rows"""
+        columns, rows = export_rows('tickets')
+        self.assertNotIsInstance(rows, (list, tuple))
+        self.assertEqual(len(list(rows)), 3)
+
+
+class TicketExportViewTests(ExportTestMixin, ValidUserTestCase):
+    def setUp(self):
+        self.create_tickets(self.user)
+        return super().setUp()
+
+    def test_streams_csv(self):
+        """Returns true if the export is streamed as CSV with a header row"""
+        response = self.client.get(reverse('export_tickets'), {'project': self.project.pk, 'status': 'OPEN'})
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([row['title'] for row in rows], ['Open Ticket'])
+
+    def test_streams_history_as_json_lines(self):
+        """Returns true if history rows are streamed one JSON object per line"""
+        self.ticket.priority = 'HIGH'
+        self.ticket.save()
+        response = self.client.get(reverse('export_tickets'), {'dataset': 'history', 'format': 'jsonl'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['new_value'] for line in lines], ['HIGH'])
+
+    def test_excludes_tickets_user_cannot_see(self):
+        """Returns true if tickets submitted by other users are not exported"""
+        other = factories.CustomUserFactory(username='test_submitter')
+        factories.TicketFactory(title='Hidden Ticket', description='Test', project=self.project, submitter=other)
+        response = self.client.get(reverse('export_tickets'), {'format': 'jsonl'})
+        titles = [json.loads(line)['title'] for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertNotIn('Hidden Ticket', titles)
+        self.assertEqual(len(titles), 3)
+
+    def test_invalid_filters_are_rejected(self):
+        """Returns true if an unknown status or a reversed date range is an error"""
+        response = self.client.get(reverse('export_tickets'), {'status': 'PENDING'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('export_tickets'), {'date_from': '2024-02-01', 'date_to': '2024-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportTicketsCommandTests(ExportTestMixin, TestCase):
+    fixtures = ['auth.json']
+    def setUp(self):
+        self.create_tickets(factories.CustomUserFactory(username='test_@submitter'))
+        return super().setUp()
+
+    def test_command_writes_filtered_export(self):
+        """Returns true if the command writes the filtered rows to the output file"""
+        with tempfile.NamedTemporaryFile(suffix='.csv', delete=False) as file:
+            path = file.name
+        self.addCleanup(os.remove, path)
+
+        stderr = io.StringIO()
+        call_command('export_tickets', '--status', 'CLOSED', '--output', path, stderr=stderr)
+        with open(path, newline='') as file:
+            self.assertEqual([row['title'] for row in csv.DictReader(file)], ['Closed Ticket'])
+        self.assertIn('Exported 1 tickets rows', stderr.getvalue())
@@ -0,0 +1,74 @@
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.db.models.fields.files import FieldFile
+from django.test import SimpleTestCase, override_settings
+
+from .. import models
+from ..helpers import get_file_url
+from .utils import MEMORY_CACHES
+
+
+class SigningStorage(FileSystemStorage):
+    """
+    Stand-in for S3Boto3Storage with querystring auth, every URL is signed afresh
+    """
+    querystring_auth = True
+    querystring_expire = 3600
+
+    def __init__(self):
+        super().__init__(base_url='https://bucket.example.com/')
+        self.signed = 0
+
+    def url(self, name, parameters=None):
+        self.signed += 1
+        url = '%s?Signature=%d' % (super().url(name), self.signed)
+        if parameters:
+            url += '&' + urlencode(parameters)
+        return url
+
+
+@override_settings(FILE_URL_EXPIRY_MARGIN=300, CACHES=MEMORY_CACHES)
+class GetFileUrlTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.storage = SigningStorage()
+        self.field = models.TicketFiles._meta.get_field('file')
+        return super().setUp()
+
+    def get_file(self, name):
+        return FieldFile(None, self.field, name)
+
+    def test_signed_urls_are_reused(self):
+        """Returns true if a file's URL is signed once and then served from the cache"""
+        with mock.patch.object(self.field, 'storage', self.storage):
+            first = get_file_url(self.get_file('log.txt'))
+            second = get_file_url(self.get_file('log.txt'))
+            other = get_file_url(self.get_file('other.txt'))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(self.storage.signed, 2)
+
+    def test_urls_carry_the_filename(self):
+        """Returns true if the storage is asked to send the file under filename, with a URL of its own"""
+        with mock.patch.object(self.field, 'storage', self.storage):
+            named = get_file_url(self.get_file('log.txt'), 'crash "1".log')
+            unnamed = get_file_url(self.get_file('log.txt'))
+            renamed = get_file_url(self.get_file('log.txt'), 'journal.log')
+        self.assertIn(urlencode({'ResponseContentDisposition': 'inline; filename="crash \\"1\\".log"'}), named)
+        self.assertEqual(len({named, unnamed, renamed}), 3)
+
+    def test_urls_are_cached_until_shortly_before_expiry(self):
+        """Returns true if the cached URL expires the margin before the signature does"""
+        with mock.patch.object(self.field, 'storage', self.storage), mock.patch.object(cache, 'set') as cache_set:
+            get_file_url(self.get_file('log.txt'))
+        self.assertEqual(cache_set.call_args.args[2], 3300)
+
+    def test_unsigned_urls_are_not_cached(self):
+        """Returns true if storages that do not sign URLs are not cached"""
+        storage = FileSystemStorage(base_url='/tickets/')
+        with mock.patch.object(self.field, 'storage', storage), mock.patch.object(cache, 'set') as cache_set:
+            self.assertEqual(get_file_url(self.get_file('log.txt')), '/tickets/log.txt')
+        cache_set.assert_not_called()
@@ -0,0 +1,152 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .. import factories, models
+from ..imports import TicketImporter
+from ..jobs import claim_jobs, run_job
+from ..search import search_tickets
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+class TicketImportTestCase(TestCase):
+    fixtures = ['auth.json']
+    def setUp(self):
+        self.submitter = factories.CustomUserFactory(username='test_@submitter')
+        self.developer = factories.CustomUserFactory(username='test_@dev')
+        self.project = factories.ProjectFactory(title='Test Project', description='Test Description')
+        return super().setUp()
+
+    def csv_stream(self, *rows):
+        lines = ['title,description,project,priority,type,status,submitter,assigned_developer']
+        lines += [','.join(row) for row in rows]
+        return io.StringIO('\n'.join(lines) + '\n')
+
+    def valid_row(self, title='Imported Ticket', project='Test Project'):
+        return [title, 'Imported description', project, 'high', 'BUG/ERROR', '', 'test_@submitter', 'test_@dev']
+
+
+class TicketImporterTests(TicketImportTestCase):
+    def test_imports_csv_rows(self):
+        """Returns true if CSV rows are imported with projects and users resolved by title and username"""
+        result = TicketImporter().run(self.csv_stream(self.valid_row()), 'csv')
+        self.assertEqual((result.rows, result.created, result.errors), (1, 1, []))
+        ticket = models.Ticket.objects.get(title='Imported Ticket')
+        self.assertEqual(ticket.project, self.project)
+        self.assertEqual(ticket.submitter, self.submitter)
+        self.assertEqual(ticket.assigned_developer, self.developer)
+        self.assertEqual((ticket.priority, ticket.status), ('HIGH', 'OPEN'))
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        """Returns true if invalid rows are reported by line number without stopping the import"""
+        stream = self.csv_stream(
+            self.valid_row('First Ticket'),
+            self.valid_row('Second Ticket', project='Missing Project'),
+            ['', 'No title', 'Test Project', 'LOW', 'CHANGE', '', 'test_@submitter', ''],
+            self.valid_row('Third Ticket', project=str(self.project.pk)),
+        )
+        result = TicketImporter(batch_size=2).run(stream, 'csv')
+        self.assertEqual((result.rows, result.created), (4, 2))
+        self.assertEqual([line for line, message in result.errors], [3, 4])
+        self.assertIn('Missing Project', result.errors[0][1])
+        self.assertEqual(
+            set(models.Ticket.objects.values_list('title', flat=True)), {'First Ticket', 'Third Ticket'})
+
+    def test_inserts_in_batches(self):
+        """Returns true if tickets are inserted with one INSERT per batch"""
+        stream = self.csv_stream(*[self.valid_row('Ticket %d' % i) for i in range(7)])
+        importer = TicketImporter(batch_size=3)
+        with CaptureQueriesContext(connection) as queries:
+            result = importer.run(stream, 'csv')
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "pages_ticket"')]
+        self.assertEqual(result.created, 7)
+        self.assertEqual(len(inserts), 3)
+
+    def test_updates_counters_and_search_index(self):
+        """Returns true if imported tickets are counted on the dashboard and can be searched"""
+        TicketImporter().run(self.csv_stream(self.valid_row('Searchable import')), 'csv')
+        counter = models.TicketCounter.objects.get(dimension='TYPE', value='BUG/ERROR')
+        self.assertEqual(counter.count, 1)
+        count, tickets = search_tickets(models.Ticket.objects.all(), 'searchable', 0, 10)
+        self.assertEqual(count, 1)
+
+    def test_imports_json_lines(self):
+        """Returns true if JSON lines are imported and unparsable lines are reported"""
+        stream = io.StringIO('\n'.join([
+            json.dumps({'title': 'JSON Ticket', 'description': 'Test', 'project': self.project.pk,
+                        'priority': 'LOW', 'type': 'CHANGE'}),
+            '{not json',
+        ]))
+        result = TicketImporter(default_submitter=self.submitter).run(stream, 'jsonl')
+        self.assertEqual(result.created, 1)
+        self.assertEqual(result.errors, [(2, 'Row is not a JSON object')])
+        self.assertEqual(models.Ticket.objects.get(title='JSON Ticket').submitter, self.submitter)
+
+
+class ImportTicketsCommandTests(TicketImportTestCase):
+    def test_command_reports_throughput_and_errors(self):
+        """Returns true if the command imports a file and reports rows/s and the rejected rows"""
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write(self.csv_stream(self.valid_row(), self.valid_row(project='Missing Project')).getvalue())
+        self.addCleanup(os.remove, file.name)
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_tickets', file.name, stdout=stdout, stderr=stderr)
+        self.assertIn('rows/s', stdout.getvalue())
+        self.assertIn('Line 3', stderr.getvalue())
+        self.assertEqual(models.Ticket.objects.count(), 1)
+
+
+@override_settings(DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage', MEDIA_ROOT=MEDIA_ROOT)
+class TicketImportAdminTests(TicketImportTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        return super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.admin_user = get_user_model().objects.create_superuser('test_@admin', 'admin@example.com', 'Testing123%')
+        self.client.force_login(self.admin_user)
+
+    def test_admin_upload_imports_tickets(self):
+        """Returns true if an uploaded file is imported, with the uploading user as default submitter"""
+        changelist = self.client.get(reverse('admin:pages_ticket_changelist'))
+        self.assertContains(changelist, reverse('admin:pages_ticket_import'))
+        content = json.dumps({'title': 'Uploaded Ticket', 'description': 'Test', 'project': 'Test Project',
+                              'priority': 'LOW', 'type': 'CHANGE'})
+        response = self.client.post(reverse('admin:pages_ticket_import'), {
+            'file': SimpleUploadedFile('tickets.jsonl', content.encode()),
+        })
+        self.assertRedirects(response, reverse('admin:pages_ticket_changelist'))
+        self.assertEqual(models.Ticket.objects.get(title='Uploaded Ticket').submitter, self.admin_user)
+
+    @override_settings(TICKET_IMPORT_BACKGROUND_SIZE=0)
+    def test_large_upload_is_imported_by_a_job(self):
+        """Returns true if a large file is imported by a job, which deletes it and emails the result"""
+        content = self.csv_stream(self.valid_row('Queued Ticket'), self.valid_row(project='Missing Project'))
+        response = self.client.post(reverse('admin:pages_ticket_import'), {
+            'file': SimpleUploadedFile('tickets.csv', content.getvalue().encode()),
+        })
+        self.assertRedirects(response, reverse('admin:pages_ticket_changelist'))
+        self.assertFalse(models.Ticket.objects.exists())
+
+        run_job(claim_jobs('worker', 10)[0], 'worker')
+        self.assertEqual(list(models.Ticket.objects.values_list('title', flat=True)), ['Queued Ticket'])
+        self.assertFalse(models.Job.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(MEDIA_ROOT, 'imports')), [])
+        sent, = mail.outbox
+        self.assertEqual(sent.to, ['admin@example.com'])
+        self.assertIn('Line 3', sent.body)
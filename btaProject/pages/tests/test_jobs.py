@@ -0,0 +1,120 @@
+import io
+from datetime import timedelta
+
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .. import factories, models
+from ..jobs import claim_jobs, enqueue, run_job, task
+
+calls = []
+
+
+@task(max_attempts=2)
+def record_call(value):
+    if value == 'fail':
+        raise ValueError('Failed on purpose')
+    calls.append(value)
+
+
+def unregistered(value):
+    pass
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+        return super().setUp()
+
+    def test_job_runs_once_and_is_deleted(self):
+        """Returns true if a claimed job runs its task with its arguments and is removed once it succeeds"""
+        enqueue(record_call, 'done')
+        job, = claim_jobs('worker', 10)
+        self.assertEqual((job.status, job.attempts), (models.Job.Status.RUNNING, 1))
+        run_job(job, 'worker')
+        self.assertEqual(calls, ['done'])
+        self.assertFalse(models.Job.objects.exists())
+
+    def test_claimed_job_is_hidden_until_its_lock_expires(self):
+        """Returns true if other workers only get a running job once its worker stopped extending its lock"""
+        enqueue(record_call, 'done')
+        claim_jobs('worker', 10)
+        self.assertEqual(claim_jobs('other worker', 10), [])
+
+        models.Job.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        job, = claim_jobs('other worker', 10)
+        self.assertEqual((job.locked_by, job.attempts), ('other worker', 2))
+
+    def test_delayed_job_is_not_claimed_early(self):
+        """Returns true if a job is not run before its delay"""
+        enqueue(record_call, 'later', delay=60)
+        self.assertEqual(claim_jobs('worker', 10), [])
+
+    @override_settings(JOB_RETRY_DELAY=60)
+    def test_failed_job_is_retried_then_kept(self):
+        """Returns true if a failing job is queued again later, and marked failed after its last attempt"""
+        enqueue(record_call, 'fail')
+        with self.assertLogs('pages.jobs', 'ERROR'):
+            run_job(claim_jobs('worker', 10)[0], 'worker')
+        job = models.Job.objects.get()
+        self.assertEqual(job.status, models.Job.Status.QUEUED)
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=50))
+        self.assertIn('Failed on purpose', job.last_error)
+
+        models.Job.objects.update(run_at=timezone.now())
+        with self.assertLogs('pages.jobs', 'ERROR'):
+            run_job(claim_jobs('worker', 10)[0], 'worker')
+        self.assertEqual(models.Job.objects.get().status, models.Job.Status.FAILED)
+
+    def test_only_registered_tasks_are_queued(self):
+        """Returns true if functions that are not registered tasks cannot be queued"""
+        with self.assertRaises(LookupError):
+            enqueue(unregistered, 'value')
+
+    @override_settings(PROJECT_ARCHIVE_BACKGROUND_THRESHOLD=1)
+    def test_large_project_archive_is_queued(self):
+        """Returns true if archiving a project with many open tickets closes them in a job"""
+        submitter = factories.CustomUserFactory(username='test_submitter')
+        project = factories.ProjectFactory(title='Test Project', description='Test Project Description')
+        for i in range(2):
+            factories.TicketFactory(title='Ticket %d' % i, description='Test', project=project, submitter=submitter)
+
+        project.is_active = False
+        project.save()
+        self.assertEqual(project.tickets.filter(status=models.Ticket.Status.CLOSED).count(), 0)
+        run_job(claim_jobs('worker', 10)[0], 'worker')
+        self.assertEqual(project.tickets.filter(status=models.Ticket.Status.CLOSED).count(), 2)
+
+    @override_settings(
+        EMAIL_BACKEND='pages.mail.QueuedEmailBackend',
+        QUEUED_EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    )
+    def test_emails_are_sent_by_jobs(self):
+        """Returns true if emails are only sent, whole, when their job runs"""
+        message = mail.EmailMultiAlternatives('Confirm', 'Text', 'from@example.com', ['to@example.com'])
+        message.attach_alternative('<p>Html</p>', 'text/html')
+        self.assertEqual(message.send(), 1)
+        self.assertEqual(mail.outbox, [])
+
+        run_job(claim_jobs('worker', 10)[0], 'worker')
+        sent, = mail.outbox
+        self.assertEqual((sent.subject, sent.to, sent.alternatives), ('Confirm', ['to@example.com'], [('<p>Html</p>', 'text/html')]))
+
+
+class RunWorkerCommandTests(TransactionTestCase):
+    def setUp(self):
+        calls.clear()
+        return super().setUp()
+
+    def test_worker_runs_due_jobs(self):
+        """Returns true if the worker runs every job that is due and leaves the others"""
+        for value in ('first', 'second', 'third'):
+            enqueue(record_call, value)
+        enqueue(record_call, 'later', delay=60)
+
+        # one job at a time, SQLite's in-memory test database does not take concurrent writes
+        call_command('run_worker', '--once', '--concurrency', '1', stdout=io.StringIO())
+        self.assertEqual(sorted(calls), ['first', 'second', 'third'])
+        self.assertEqual(list(models.Job.objects.values_list('args', flat=True)), [['later']])
@@ -0,0 +1,99 @@
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+
+from accounts.helpers import assign_role_to_users
+
+from .. import factories, models
+
+
+class VisibleToTestCase(TestCase):
+    fixtures = ['auth.json']
+    def setUp(self):
+        self.submitter = factories.CustomUserFactory(username='test_@submitter')
+        self.developer = self.create_user('test_@dev', 'DV')
+        self.manager = self.create_user('test_@pm', 'PM')
+        self.admin = self.create_user('test_@admin', 'AD')
+        self.project = factories.ProjectFactory(title='Test Project', description='Test Description')
+        self.other_project = factories.ProjectFactory(title='Other Project', description='Test Description')
+        self.ticket = factories.TicketFactory(
+            title='Test Ticket', description='ticket desc.', project=self.project, submitter=self.submitter)
+        self.other_ticket = factories.TicketFactory(
+            title='Other Ticket', description='ticket desc.', project=self.other_project, submitter=self.admin)
+        return super().setUp()
+
+    def create_user(self, username, role):
+        user = factories.CustomUserFactory(username=username)
+        user.user_role = role
+        user.save()
+        # reload so that group lookups are not served from the instance
+        return get_user_model().objects.get(pk=user.pk)
+
+
+class TicketVisibleToTests(VisibleToTestCase):
+    def test_administrator_sees_all_tickets(self):
+        """Returns true if administrators can see every ticket"""
+        self.assertEqual(set(models.Ticket.objects.visible_to(self.admin)), {self.ticket, self.other_ticket})
+
+    def test_developer_sees_assigned_tickets(self):
+        """Returns true if developers only see tickets assigned to them"""
+        self.ticket.assigned_developer = self.developer
+        self.ticket.save()
+        self.assertEqual(list(models.Ticket.objects.visible_to(self.developer)), [self.ticket])
+
+    def test_submitter_sees_submitted_tickets(self):
+        """Returns true if submitters only see tickets they submitted"""
+        self.assertEqual(list(models.Ticket.objects.visible_to(self.submitter)), [self.ticket])
+
+
+class ProjectVisibleToTests(VisibleToTestCase):
+    def test_administrator_sees_all_projects(self):
+        """Returns true if administrators can see every project"""
+        self.assertEqual(set(models.Project.objects.visible_to(self.admin)), {self.project, self.other_project})
+
+    def test_demoted_administrator_loses_access(self):
+        """Returns true if an administrator whose role was changed through another instance no longer sees every project"""
+        self.assertEqual(len(models.Project.objects.visible_to(self.admin)), 2)
+        assign_role_to_users([self.admin.pk], 'SM')
+        admin = get_user_model().objects.get(pk=self.admin.pk)
+        self.assertEqual(list(models.Project.objects.visible_to(admin)), [])
+
+    def test_project_manager_sees_managed_projects(self):
+        """Returns true if project managers see the projects they manage"""
+        self.project.project_manager = self.manager
+        self.project.save()
+        self.assertEqual(list(models.Project.objects.visible_to(self.manager)), [self.project])
+
+    def test_personnel_see_assigned_projects_once(self):
+        """Returns true if assigned users see their projects, without duplicates from other assignments"""
+        self.project.assigned_personnel.add(self.developer, self.submitter)
+        self.assertEqual(list(models.Project.objects.visible_to(self.developer)), [self.project])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'query plans are checked against SQLite')
+class VisibleToQueryPlanTests(VisibleToTestCase):
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_open_tickets_of_developer_use_index(self):
+        """Returns true if a developer's open tickets are looked up through the status/developer index"""
+        queryset = models.Ticket.objects.visible_to(self.developer).filter(status='OPEN')
+        self.assertUsesIndex(queryset, 'ticket_status_dev_idx')
+
+    def test_open_tickets_of_submitter_use_index(self):
+        """Returns true if a submitter's open tickets are looked up through the status/submitter index"""
+        queryset = models.Ticket.objects.visible_to(self.submitter).filter(status='OPEN')
+        self.assertUsesIndex(queryset, 'ticket_status_submitter_idx')
+
+    def test_project_tickets_by_status_use_index(self):
+        """Returns true if a project's tickets are filtered by status through the project/status index"""
+        queryset = models.Ticket.objects.filter(project=self.project, status='OPEN')
+        self.assertUsesIndex(queryset, 'ticket_project_status_idx')
+
+    def test_active_projects_of_manager_use_index(self):
+        """Returns true if managed active projects are looked up through the manager/active index"""
+        queryset = models.Project.objects.filter(project_manager=self.manager, is_active=True)
+        self.assertUsesIndex(queryset, 'project_manager_active_idx')
@@ -0,0 +1,144 @@
+import io
+import os
+import shutil
+import tempfile
+from unittest import skipUnless
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+
+from accounts.helpers import get_permissions
+from .. import factories, models
+from ..jobs import claim_jobs, run_job
+from ..preview_rendering import OMISSION, make_excerpt
+from ..previews import PILLOW_INSTALLED
+from .test_views import ValidUserTestCase
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+class ExcerptTests(SimpleTestCase):
+    def test_short_file_is_shown_whole(self):
+        """Returns true if a file with few lines is its own excerpt"""
+        self.assertEqual(make_excerpt(b'one\ntwo\n', None, 2), 'one\ntwo')
+
+    def test_long_file_shows_first_and_last_lines(self):
+        """Returns true if the excerpt leaves out the middle of the file and the partial lines at its edges"""
+        head = b'1\n2\n3\npart'
+        tail = b'ial\n8\n9\n10\n'
+        self.assertEqual(make_excerpt(head, tail, 2), '\n'.join(['1', '2', OMISSION, '9', '10']))
+
+    def test_binary_file_has_no_excerpt(self):
+        """Returns true if content with NUL bytes is not shown as text"""
+        self.assertIsNone(make_excerpt(b'\x00\x01\x02', None, 10))
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT=MEDIA_ROOT,
+    PREVIEW_EXCERPT_BYTES=16,
+    PREVIEW_EXCERPT_LINES=2,
+)
+class TicketFilePreviewTests(ValidUserTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        return super().tearDownClass()
+
+    def setUp(self):
+        self.user.user_permissions.add(*get_permissions(['view_ticket', 'add_ticketfiles']))
+        self.project = factories.ProjectFactory(title='Test Project', description='Test Project Description')
+        self.ticket = factories.TicketFactory(
+            title='Test Ticket', description='Test', project=self.project, submitter=self.user)
+        return super().setUp()
+
+    def upload(self, name, content, run_jobs=True):
+        self.client.post(reverse('upload_ticket_file', args=[self.ticket.pk]), {
+            'file': SimpleUploadedFile(name, content),
+        })
+        # previews are generated by the job queued with the upload
+        if run_jobs:
+            for job in claim_jobs('worker', 10):
+                run_job(job, 'worker')
+        return models.TicketFiles.objects.filter(ticket=self.ticket).latest('pk')
+
+    def test_text_file_gets_excerpt(self):
+        """Returns true if a log gets its first and last lines as preview, shown on the ticket page"""
+        content = b''.join(b'line %d\n' % number for number in range(1, 21))
+        ticket_file = self.upload('crash.log', content)
+        self.assertEqual(ticket_file.preview_status, models.TicketFiles.PreviewStatus.READY)
+        self.assertEqual(ticket_file.excerpt, '\n'.join(['line 1', 'line 2', OMISSION, 'line 20']))
+
+        response = self.client.get(reverse('ticket_details', args=[self.ticket.pk]))
+        self.assertContains(response, 'line 20')
+
+    def test_preview_is_generated_by_a_job(self):
+        """Returns true if the upload only queues the preview, for the job worker to generate"""
+        ticket_file = self.upload('crash.log', b'one\ntwo\n', run_jobs=False)
+        self.assertEqual(ticket_file.preview_status, models.TicketFiles.PreviewStatus.PENDING)
+        job, = models.Job.objects.all()
+        self.assertEqual((job.task, job.args), ('pages.previews.generate_preview', [ticket_file.pk]))
+
+    def test_same_content_reuses_preview(self):
+        """Returns true if a second copy of a file takes the preview of the first"""
+        first = self.upload('crash.log', b'one\ntwo\n')
+        second = self.upload('copy.log', b'one\ntwo\n')
+        self.assertEqual((second.preview_status, second.excerpt), (first.preview_status, first.excerpt))
+
+    def test_other_files_have_no_preview(self):
+        """Returns true if files that are neither text nor images are marked as having no preview"""
+        ticket_file = self.upload('archive.zip', b'PK\x03\x04')
+        self.assertEqual(ticket_file.preview_status, models.TicketFiles.PreviewStatus.UNAVAILABLE)
+        response = self.client.get(reverse('ticket_file_thumbnail', args=[ticket_file.pk]))
+        self.assertEqual(response.status_code, 404)
+
+    @skipUnless(PILLOW_INSTALLED, 'Pillow is not installed')
+    def test_image_gets_thumbnail(self):
+        """Returns true if an image gets a thumbnail stored next to it"""
+        from PIL import Image
+
+        image = io.BytesIO()
+        Image.new('RGB', (1000, 500), 'red').save(image, 'PNG')
+        ticket_file = self.upload('screenshot.png', image.getvalue())
+        self.assertEqual(ticket_file.thumbnail, ticket_file.file.name + '.thumb.jpg')
+        with Image.open(os.path.join(MEDIA_ROOT, ticket_file.thumbnail)) as thumbnail:
+            self.assertEqual(thumbnail.size, (320, 160))
+
+        response = self.client.get(reverse('ticket_file_thumbnail', args=[ticket_file.pk]))
+        self.assertRedirects(response, settings.MEDIA_URL + ticket_file.thumbnail, fetch_redirect_response=False)
+
+    @skipUnless(PILLOW_INSTALLED, 'Pillow is not installed')
+    def test_renamed_thumbnail_is_collected_with_its_blob(self):
+        """Returns true if a thumbnail the storage saved under another name is deleted with the file's blob"""
+        from PIL import Image
+
+        image = io.BytesIO()
+        Image.new('RGB', (10, 10), 'red').save(image, 'PNG')
+        ticket_file = self.upload('screenshot.png', image.getvalue(), run_jobs=False)
+        # taken, so the storage saves the thumbnail under another name
+        taken = os.path.join(MEDIA_ROOT, ticket_file.file.name + '.thumb.jpg')
+        with open(taken, 'wb') as file:
+            file.write(b'other')
+        for job in claim_jobs('worker', 10):
+            run_job(job, 'worker')
+        ticket_file.refresh_from_db()
+        self.assertNotEqual(ticket_file.thumbnail, ticket_file.file.name + '.thumb.jpg')
+
+        ticket_file.delete()
+        call_command('collect_file_blobs', stdout=io.StringIO())
+        self.assertFalse(os.path.exists(os.path.join(MEDIA_ROOT, ticket_file.thumbnail)))
+        self.assertTrue(os.path.exists(taken))
+
+    def test_command_generates_pending_previews(self):
+        """Returns true if the command generates the previews still pending"""
+        ticket_file = self.upload('notes.txt', b'notes\n')
+        models.TicketFiles.objects.filter(pk=ticket_file.pk).update(
+            preview_status=models.TicketFiles.PreviewStatus.PENDING, excerpt='')
+        stdout = io.StringIO()
+        call_command('generate_file_previews', stdout=stdout)
+        self.assertIn('Generated the previews of 1 ticket files', stdout.getvalue())
+        ticket_file.refresh_from_db()
+        self.assertEqual(ticket_file.excerpt, 'notes')
@@ -0,0 +1,138 @@
+import time
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+
+from .. import factories, models, routers
+from .test_views import ValidUserTestCase
+
+# replicas that are databases of their own in the tests, e.g. a second SQLite database. Nothing replicates
+# to them, so they have none of the data the tests create in the default database.
+SEPARATE_REPLICAS = [
+    alias for alias in settings.DATABASE_REPLICAS if not connections.settings[alias]['TEST'].get('MIRROR')]
+
+
+class RouterStateMixin:
+    def setUp(self):
+        routers._state.wrote = False
+        routers._lags.clear()
+        return super().setUp()
+
+    def tearDown(self):
+        routers._state.wrote = False
+        routers._lags.clear()
+        return super().tearDown()
+
+    def set_lags(self, **lags):
+        # as if each replica had just been checked
+        for alias, lag in lags.items():
+            routers._lags[alias] = (time.monotonic(), lag)
+
+
+@override_settings(
+    DATABASE_REPLICAS=['replica1', 'replica2', 'replica3'], REPLICA_MAX_LAG=5, REPLICA_LAG_CHECK_INTERVAL=5)
+class ReplicaRouterTests(RouterStateMixin, SimpleTestCase):
+    def get_request(self, pin=None, age=0):
+        request = RequestFactory().get('/')
+        if pin is not None:
+            response = HttpResponse()
+            # signed age seconds ago
+            with mock.patch('django.core.signing.time.time', return_value=time.time() - age):
+                response.set_signed_cookie(routers.PIN_COOKIE, '1', salt=routers.PIN_SALT)
+            request.COOKIES[routers.PIN_COOKIE] = response.cookies[routers.PIN_COOKIE].value + pin
+        return request
+
+    def test_reads_replicas_close_enough_behind(self):
+        """Returns true if only replicas that can be reached and are less than REPLICA_MAX_LAG behind are read"""
+        self.set_lags(replica1=60, replica2=1, replica3=None)
+        self.assertEqual({routers.get_read_database(self.get_request()) for _ in range(20)}, {'replica2'})
+
+        self.set_lags(replica2=6)
+        self.assertIsNone(routers.get_read_database(self.get_request()))
+
+    def test_pinned_users_read_the_default_database(self):
+        """Returns true if users with a valid pin cookie read from the default database"""
+        self.set_lags(replica1=0, replica2=0, replica3=0)
+        self.assertIsNone(routers.get_read_database(self.get_request(pin='')))
+        self.assertIsNotNone(routers.get_read_database(self.get_request(pin='tampered')))
+
+    def test_pin_outlasts_a_stale_lag_check(self):
+        """Returns true if users stay pinned while a replica's last lag check could be REPLICA_LAG_CHECK_INTERVAL old"""
+        # checked at 5 seconds behind 4 seconds ago, the replicas can be 9 seconds behind now and are still read
+        for alias in settings.DATABASE_REPLICAS:
+            routers._lags[alias] = (time.monotonic() - 4, 5)
+        self.assertIsNotNone(routers.get_read_database(self.get_request()))
+        self.assertIsNone(routers.get_read_database(self.get_request(pin='', age=9)))
+        self.assertIsNotNone(routers.get_read_database(self.get_request(pin='', age=11)))
+
+    def test_reads_follow_reading_from_until_a_write(self):
+        """Returns true if reads go to the replica read from, and to the default database once anything is written"""
+        router = routers.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(models.Ticket))
+        with routers.reading_from('replica1'):
+            self.assertEqual(router.db_for_read(models.Ticket), 'replica1')
+            self.assertEqual(router.db_for_write(Session), 'default')
+            self.assertEqual(router.db_for_read(models.Ticket), 'replica1')
+            self.assertEqual(router.db_for_write(models.Ticket), 'default')
+            self.assertEqual(router.db_for_read(models.Ticket), 'default')
+
+    def test_streamed_content_is_read_from_the_replica(self):
+        """Returns true if each item of streamed content is read within reading_from"""
+        router = routers.ReplicaRouter()
+        content = (router.db_for_read(models.Ticket) for _ in range(2))
+        self.assertEqual(list(routers.iterate_reading_from('replica1', content)), ['replica1', 'replica1'])
+        self.assertIsNone(router.db_for_read(models.Ticket))
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaPinMiddlewareTests(RouterStateMixin, ValidUserTestCase):
+    def setUp(self):
+        super().setUp()
+        project = factories.ProjectFactory(title='Test Project', description='Test')
+        self.ticket = factories.TicketFactory(title='Test Ticket', description='Test', project=project, submitter=self.user)
+        # the replica is never read, users are pinned before reading
+        self.set_lags(replica1=None)
+
+    def test_writes_pin_the_user(self):
+        """Returns true if a request that writes sets the pin cookie and one that only reads does not"""
+        response = self.client.get(reverse('about'))
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+        response = self.client.post(reverse('ticket_details', args=[self.ticket.pk]), {'message': 'Test comment'})
+        self.assertEqual(
+            response.cookies[routers.PIN_COOKIE]['max-age'], settings.REPLICA_MAX_LAG + settings.REPLICA_LAG_CHECK_INTERVAL)
+        self.assertTrue(response.cookies[routers.PIN_COOKIE]['httponly'])
+
+
+@skipUnless(SEPARATE_REPLICAS, 'needs a replica that is a separate database in the tests')
+class ReplicaReadTests(RouterStateMixin, ValidUserTestCase):
+    """
+    Run with a replica configured as a second database, e.g. a second SQLite file, to check that pages read
+    from it until the user writes
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        project = factories.ProjectFactory(title='Test Project', description='Test')
+        self.ticket = factories.TicketFactory(title='Test Ticket', description='Test', project=project, submitter=self.user)
+
+    def get_titles(self):
+        response = self.client.get(reverse('my_tickets_data'), {'draw': 1, 'start': 0, 'length': 10})
+        tickets = [row[0] for row in response.json()['data']]
+        response = self.client.get(reverse('export_tickets'), {'format': 'jsonl'})
+        exported = b''.join(response.streaming_content).decode().splitlines()
+        return tickets, len(exported)
+
+    @override_settings(DATABASE_REPLICAS=SEPARATE_REPLICAS[:1])
+    def test_pages_read_the_replica_until_the_user_writes(self):
+        """Returns true if the tickets table and export miss the ticket the replica lacks, until the user writes"""
+        self.assertEqual(self.get_titles(), ([], 0))
+
+        self.client.post(reverse('ticket_details', args=[self.ticket.pk]), {'message': 'Test comment'})
+        self.assertEqual(self.get_titles(), (['Test Ticket'], 1))
@@ -1,5 +1,11 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.test import TestCase
 from .. import factories, models
+from ..helpers import history_batch
 
 
 class CloseTicketsOnProjectArchiveReceiverTests(TestCase):
@@ -28,6 +34,37 @@ class CloseTicketsOnProjectArchiveReceiverTests(TestCase):
             self.assertEqual(ticket.status, 'CLOSED')
         
 
+    def test_status_change_recorded_for_each_ticket_on_project_archive(self):
+        """Returns true if closing the tickets of an archived project is recorded in their history"""
+        self.project.is_active = False
+        self.project.save()
+        for ticket in self.project.tickets.all():
+            history = ticket.histories.get()
+            self.assertEqual((history.prev_value, history.new_value), ('OPEN', 'CLOSED'))
+
+    def test_archive_query_count_does_not_grow_with_tickets(self):
+        """Returns true if archiving a project runs the same number of queries regardless of ticket count"""
+        submitter = factories.CustomUserFactory(username='test_@submitter')
+        project = factories.ProjectFactory(title='Large Project', description='Test Description')
+        for i in range(10):
+            factories.TicketFactory(title='Ticket %d' % i, description='ticket desc.', project=project, submitter=submitter)
+        # both archives then update the existing closed counter rather than the first one creating it
+        models.TicketCounter.objects.create(dimension='STATUS', value='CLOSED')
+
+        self.project.is_active = False
+        with CaptureQueriesContext(connection) as small_archive:
+            self.project.save()
+
+        project.is_active = False
+        with CaptureQueriesContext(connection) as large_archive:
+            project.save()
+        self.assertEqual(len(large_archive), len(small_archive))
+        # the tickets are closed by project, not by listing their ids
+        ticket_update = [
+            query['sql'] for query in large_archive.captured_queries if query['sql'].startswith('UPDATE "pages_ticket"')]
+        self.assertEqual(len(ticket_update), 1)
+        self.assertNotIn(' IN (', ticket_update[0])
+
     def test_tickets_dont_change_if_project_is_not_archived(self):
         """Returns true if tickets remain open if project is saved but not archived"""
         self.project.title = 'Updated Test Project Title'
@@ -90,6 +127,95 @@ class RecordTicketHistoryReceiverTests(TestCase):
         self.ticket.save()
         self.assertTrue(self.ticket.histories.all().exists())
 
+    def test_ticket_row_not_read_again_when_saved(self):
+        """Returns true if saving a loaded ticket diffs against its loaded values rather than selecting the row"""
+        ticket = models.Ticket.objects.get(pk=self.ticket.pk)
+        ticket.priority = models.Ticket.Priority.HIGH
+        with CaptureQueriesContext(connection) as queries:
+            ticket.save()
+        selects = [q['sql'] for q in queries if q['sql'].startswith('SELECT') and '"pages_ticket"' in q['sql']]
+        self.assertEqual(selects, [])
+        self.assertEqual(ticket.histories.get().prev_value, 'MEDIUM')
+
+    def test_history_added_when_ticket_not_loaded_from_database(self):
+        """Returns true if history is recorded for an instance built by hand for an existing ticket"""
+        ticket = models.Ticket(
+            id=self.ticket.id,
+            title=self.ticket.title,
+            description=self.ticket.description,
+            priority=models.Ticket.Priority.LOW,
+            type=self.ticket.type,
+            submitter=self.ticket.submitter,
+            project=self.ticket.project)
+        ticket.save()
+        self.assertEqual(ticket.histories.get().prev_value, 'MEDIUM')
+
+    def test_histories_inserted_together_when_several_fields_change(self):
+        """Returns true if a multi-field edit writes all of its history with one insert"""
+        self.ticket.assigned_developer = factories.CustomUserFactory(username='test_@dev')
+        self.ticket.status = models.Ticket.Status.CLOSED
+        self.ticket.priority = models.Ticket.Priority.HIGH
+        self.ticket.type = models.Ticket.Type.BUG_ERROR
+        with CaptureQueriesContext(connection) as queries:
+            self.ticket.save()
+        inserts = [q['sql'] for q in queries if q['sql'].startswith('INSERT INTO "pages_tickethistory"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(self.ticket.histories.count(), 4)
+
+    def test_no_history_left_if_batch_rolled_back(self):
+        """Returns true if history collected in a batch that fails is discarded"""
+        with self.assertRaises(ValueError):
+            with history_batch():
+                self.ticket.status = models.Ticket.Status.CLOSED
+                self.ticket.save()
+                raise ValueError
+        self.assertFalse(self.ticket.histories.all().exists())
+
     def test_history_added_when_type_changed(self):
         """Returns true if history is recorded when ticket type changes"""
-        self.ticket.type = models.Ticket.Type.CHANGE
\ No newline at end of file
+        self.ticket.type = models.Ticket.Type.CHANGE
+
+
+class TicketCounterReceiverTests(TestCase):
+    fixtures = ['auth.json']
+    def setUp(self):
+        self.submitter = factories.CustomUserFactory(username='test_@submitter')
+        self.project = factories.ProjectFactory(title='Test Project', description='Test Description')
+        self.ticket = factories.TicketFactory(
+            title='Test Ticket', 
+            description='ticket desc.', 
+            project=self.project, 
+            submitter=self.submitter)
+        return super().setUp()
+
+    def get_count(self, dimension, value):
+        counter = models.TicketCounter.objects.filter(dimension=dimension, value=value).first()
+        return counter.count if counter else 0
+
+    def test_counters_incremented_when_ticket_created(self):
+        """Returns true if status, type and project counters include a new ticket"""
+        self.assertEqual(self.get_count('STATUS', 'OPEN'), 1)
+        self.assertEqual(self.get_count('TYPE', 'CHANGE'), 1)
+        self.assertEqual(self.get_count('PROJECT', str(self.project.pk)), 1)
+
+    def test_counters_move_when_status_updated(self):
+        """Returns true if a closed ticket is counted under its new status only"""
+        self.ticket.status = models.Ticket.Status.CLOSED
+        self.ticket.save()
+        self.assertEqual(self.get_count('STATUS', 'OPEN'), 0)
+        self.assertEqual(self.get_count('STATUS', 'CLOSED'), 1)
+        self.assertEqual(self.get_count('TYPE', 'CHANGE'), 1)
+
+    def test_counters_decremented_when_ticket_deleted(self):
+        """Returns true if a deleted ticket is no longer counted"""
+        self.ticket.delete()
+        self.assertEqual(self.get_count('STATUS', 'OPEN'), 0)
+        self.assertEqual(self.get_count('PROJECT', str(self.project.pk)), 0)
+
+    def test_rebuild_command_recounts_tickets(self):
+        """Returns true if the rebuild command repairs counters that drifted from the ticket table"""
+        models.TicketCounter.objects.all().delete()
+        call_command('rebuild_ticket_counters', stdout=StringIO())
+        self.assertEqual(self.get_count('STATUS', 'OPEN'), 1)
+        self.assertEqual(self.get_count('TYPE', 'CHANGE'), 1)
+
@@ -0,0 +1,159 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.helpers import get_permissions
+from .. import factories, models
+from .test_views import ValidUserTestCase
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT=MEDIA_ROOT,
+    TICKET_FILE_CHUNK_SIZE=4,
+)
+class TicketFileUploadTests(ValidUserTestCase):
+    content = b'0123456789'
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        return super().tearDownClass()
+
+    def setUp(self):
+        self.user.user_permissions.add(*get_permissions(['view_ticket', 'add_ticketfiles']))
+        self.project = factories.ProjectFactory(title='Test Project', description='Test Project Description')
+        self.ticket = factories.TicketFactory(
+            title='Test Ticket', description='Test', project=self.project, submitter=self.user)
+        return super().setUp()
+
+    def start(self, filename='log.txt', size=None):
+        response = self.client.post(
+            reverse('api_ticket_file_uploads', args=[self.ticket.pk]),
+            data=json.dumps({'filename': filename, 'size': len(self.content) if size is None else size}),
+            content_type='application/json')
+        return response.status_code, json.loads(response.content)
+
+    def send(self, upload, start, end):
+        response = self.client.put(
+            upload['url'], data=self.content[start:end], content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE='bytes %d-%d/%d' % (start, end - 1, len(self.content)))
+        return response.status_code, json.loads(response.content)
+
+    def test_chunks_are_assembled_into_ticket_file(self):
+        """Returns true if the ticket file is only created, with the whole content, after the last chunk"""
+        status, upload = self.start()
+        self.assertEqual((status, upload['chunk_size'], upload['received']), (201, 4, 0))
+
+        self.assertEqual(self.send(upload, 0, 4), (200, {**upload, 'received': 4}))
+        self.send(upload, 4, 8)
+        self.assertFalse(models.TicketFiles.objects.exists())
+
+        status, data = self.send(upload, 8, 10)
+        self.assertEqual(status, 201)
+        ticket_file = models.TicketFiles.objects.get(pk=data['id'])
+        self.assertEqual((ticket_file.ticket, ticket_file.uploaded_by), (self.ticket, self.user))
+        self.assertTrue(ticket_file.file.name.endswith('/log.txt'))
+        with ticket_file.file.open('rb') as file:
+            self.assertEqual(file.read(), self.content)
+        self.assertFalse(models.TicketFileUpload.objects.exists())
+
+    def test_upload_resumes_from_stored_offset(self):
+        """Returns true if an upload reports how much was received and refuses chunks out of order"""
+        status, upload = self.start()
+        self.send(upload, 0, 4)
+
+        data = json.loads(self.client.get(upload['url']).content)
+        self.assertEqual(data['received'], 4)
+        # resending the first chunk, as after a lost response, tells the client where to carry on
+        status, data = self.send(upload, 0, 4)
+        self.assertEqual((status, data['errors']['received']), (409, 4))
+
+        self.send(upload, 4, 8)
+        status, _ = self.send(upload, 8, 10)
+        self.assertEqual(status, 201)
+
+    def test_failed_completion_can_be_retried(self):
+        """Returns true if an upload whose completion failed is completed by resending the last chunk or a POST"""
+        status, upload = self.start()
+        self.send(upload, 0, 4)
+        self.send(upload, 4, 8)
+        with mock.patch('pages.uploads.create_blob_ticket_file', side_effect=RuntimeError('Database unavailable')):
+            with self.assertRaises(RuntimeError):
+                self.send(upload, 8, 10)
+        self.assertFalse(models.TicketFiles.objects.exists())
+        self.assertEqual(json.loads(self.client.get(upload['url']).content)['received'], 10)
+
+        with mock.patch('pages.uploads.create_blob_ticket_file', side_effect=RuntimeError('Database unavailable')):
+            with self.assertRaises(RuntimeError):
+                self.client.post(upload['url'])
+        status, data = self.send(upload, 8, 10)
+        self.assertEqual(status, 201)
+        with models.TicketFiles.objects.get(pk=data['id']).file.open('rb') as file:
+            self.assertEqual(file.read(), self.content)
+        self.assertEqual(self.client.post(upload['url']).status_code, 404)
+
+    def test_incomplete_upload_cannot_be_completed(self):
+        """Returns true if completing an upload still missing chunks tells the client where to resume"""
+        status, upload = self.start()
+        self.send(upload, 0, 4)
+        response = self.client.post(upload['url'])
+        self.assertEqual((response.status_code, json.loads(response.content)['errors']['received']), (409, 4))
+
+    def test_abandoned_uploads_are_collected(self):
+        """Returns true if uploads not sent a chunk for TICKET_FILE_UPLOAD_EXPIRY are aborted and others kept"""
+        status, upload = self.start()
+        self.send(upload, 0, 4)
+        status, recent = self.start()
+        abandoned = models.TicketFileUpload.objects.get(pk=upload['id'])
+        abandoned.updated = timezone.now() - timedelta(days=2)
+        abandoned.save()
+
+        output = StringIO()
+        call_command('collect_file_uploads', stdout=output)
+        self.assertIn('Aborted 1 abandoned uploads (4 bytes received)', output.getvalue())
+        self.assertEqual([str(pk) for pk in models.TicketFileUpload.objects.values_list('pk', flat=True)], [recent['id']])
+        self.assertFalse(os.path.exists(os.path.join(MEDIA_ROOT, abandoned.name + '.part')))
+
+    def test_chunks_must_be_chunk_size_except_the_last(self):
+        """Returns true if a short chunk in the middle of the file is refused"""
+        status, upload = self.start()
+        status, _ = self.send(upload, 0, 3)
+        self.assertEqual(status, 400)
+
+    def test_abort_removes_partial_file(self):
+        """Returns true if an aborted upload leaves neither the upload nor its partial file behind"""
+        status, upload = self.start()
+        self.send(upload, 0, 4)
+        upload_row = models.TicketFileUpload.objects.get()
+        response = self.client.delete(upload['url'])
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(models.TicketFileUpload.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(MEDIA_ROOT, upload_row.name + '.part')))
+
+    def test_uploads_of_other_users_are_not_found(self):
+        """Returns true if users cannot send chunks to uploads they did not start"""
+        status, upload = self.start()
+        other = factories.CustomUserFactory(username='test_uploader')
+        other.user_permissions.add(*get_permissions(['add_ticketfiles']))
+        self.client.force_login(other)
+        status, _ = self.send(upload, 0, 4)
+        self.assertEqual(status, 404)
+
+    def test_requires_permission(self):
+        """Returns true if users without the add_ticketfiles permission cannot start an upload"""
+        self.user.groups.clear()
+        self.user.user_permissions.clear()
+        status, _ = self.start()
+        self.assertEqual(status, 403)
@@ -1,13 +1,31 @@
+import io
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
 import factory
-from django.test import RequestFactory, TestCase
+from django.test import RequestFactory, TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group, Permission
 from django.urls import reverse
+from django.utils.http import http_date
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
+from accounts.helpers import get_permissions
 from allauth.account.models import EmailAddress
 from .. import factories
+from .. import models
 from .. import views
+from ..helpers import fragment_cache_stats
+from .utils import MEMORY_CACHES
+
 
 class LoginSharedTestsMixin:
     """
@@ -85,6 +103,8 @@ class PermissionSharedTestsMixin:
         self.assertTemplateUsed(response, self.template)
     
     def test_redirects_without_permission(self):
+        # drop the permissions granted by the user's default Submitter group
+        self.user.groups.clear()
         response = self.get_response('get', self.name, is_url=False)        
         self.assertEqual(response.status_code, 302)
 
@@ -164,6 +184,8 @@ class TicketPKSharedTestsMixin:
 
     def test_page_redirects_if_user_is_not_permitted(self):
         """Returns true if user is not permitted and so is redirected"""
+        # drop the permissions granted by the user's default Submitter group
+        self.user.groups.clear()
         response = self.get_response()
         self.assertEqual(response.status_code, 302)  
 
@@ -186,6 +208,8 @@ class ValidUserTestCase(TestCase):
         return super().setUpTestData()
 
     def setUp(self):
+        # cached counts and group names would otherwise outlive each test's rolled back data
+        cache.clear()
         self.client.force_login(self.user)
         return super().setUp()
 
@@ -264,8 +288,64 @@ class ProjectDetailViewTests(ValidUserTestCase):
         response = self.get_response()
         self.assertEqual(response.status_code, 302)
 
+    def test_page_does_not_list_tickets(self):
+        """Returns true if the tickets of the project are left to the tickets endpoint"""
+        self.user.project_set.add(self.project)
+        factories.TicketFactory(title='Listed Ticket', description='Test', project=self.project, submitter=self.user)
+        response = self.get_response().render()
+        self.assertNotContains(response, 'Listed Ticket')
+        self.assertContains(response, reverse('project_tickets_data', args=[self.project.pk]))
+
+
+class ProjectDataViewTests(ValidUserTestCase):
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.project = factories.ProjectFactory(title='Test Project', description='Test Project Description')
+        self.user.project_set.add(self.project)
+        for i in range(12):
+            factories.TicketFactory(
+                title='Ticket %d' % i, description='x' * 500, project=self.project, submitter=self.user,
+                status=models.Ticket.Status.CLOSED if i % 3 == 0 else models.Ticket.Status.OPEN)
+        return super().setUp()
+
+    def get_data(self, name, **params):
+        response = self.client.get(reverse(name, args=[self.project.pk]), {'draw': 1, **params})
+        return response.status_code, json.loads(response.content) if response.status_code == 200 else None
+
+    def test_tickets_are_paged_and_filtered_by_status(self):
+        """Returns true if one page of the project's tickets is returned, filtered by status, descriptions cut short"""
+        status, data = self.get_data('project_tickets_data', start=0, length=5)
+        self.assertEqual((data['recordsTotal'], len(data['data'])), (12, 5))
+        self.assertLessEqual(len(data['data'][0][1]), 100)
+
+        status, data = self.get_data('project_tickets_data', start=0, length=50, status='CLOSED')
+        self.assertEqual({row[2] for row in data['data']}, {'CLOSED'})
+        self.assertEqual(data['recordsTotal'], 4)
+
+    def test_tickets_are_ordered_by_column(self):
+        """Returns true if the tickets are ordered by the column the table asks for"""
+        params = {'start': 0, 'length': 50, 'order[0][column]': 0, 'order[0][dir]': 'desc'}
+        for index, name in enumerate(['title', 'description', 'status', 'date_updated', 'id']):
+            params['columns[%d][data]' % index] = index
+        status, data = self.get_data('project_tickets_data', **params)
+        titles = [row[0] for row in data['data']]
+        self.assertEqual(titles, sorted(titles, reverse=True))
+
+    def test_personnel_are_listed_with_their_own_role(self):
+        """Returns true if personnel are listed with their role rather than the viewing user's"""
+        developer = factories.CustomUserFactory(username='test_developer', user_role='DV')
+        developer.project_set.add(self.project)
+        status, data = self.get_data('project_personnel_data', start=0, length=10)
+        self.assertIn(['', 'test_developer', 'Developer'], data['data'])
+
+    def test_projects_user_cannot_see_are_not_found(self):
+        """Returns true if the tables of a project the user is not part of are not returned"""
+        self.user.project_set.remove(self.project)
+        # refused before the table is built, which would log the 404 as an error
+        with self.assertNoLogs(level='ERROR'):
+            self.assertEqual(self.get_data('project_tickets_data')[0], 404)
+            self.assertEqual(self.get_data('project_personnel_data')[0], 404)
 
-        
 
 class MyTicketViewTests(LoginSharedTestsMixin, ValidUserTestCase):
     view = views.MyTicketView
@@ -273,6 +353,106 @@ class MyTicketViewTests(LoginSharedTestsMixin, ValidUserTestCase):
     url = 'tickets/'
     template = 'my_tickets.html'
 
+class MyTicketDataViewTests(ValidUserTestCase):
+    view = views.MyTicketDataView
+    name = 'my_tickets_data'
+    factory = RequestFactory()
+
+    def setUp(self):
+        self.project = factories.ProjectFactory(title='Test Project', description='Test Project Description')
+        for i in range(15):
+            factories.TicketFactory(title='Ticket %d' % i, description='Test', project=self.project, submitter=self.user)
+        return super().setUp()
+
+    def get_response(self, **params):
+        request = self.factory.get(reverse(self.name), data=params)
+        request.user = self.user
+        return self.view.as_view()(request)
+
+    def test_returns_only_requested_page_of_tickets(self):
+        """Returns true if only one page of rows is returned along with the total count"""
+        response = self.get_response(draw=1, start=0, length=10)
+        data = json.loads(response.content)
+        self.assertEqual(data['recordsTotal'], 15)
+        self.assertEqual(len(data['data']), 10)
+
+    def test_excludes_tickets_not_associated_with_user(self):
+        """Returns true if tickets submitted by other users are not returned to a submitter"""
+        submitter = factories.CustomUserFactory(username='test_submitter')
+        factories.TicketFactory(title='Other Ticket', description='Test', project=self.project, submitter=submitter)
+        response = self.get_response(draw=1, start=0, length=100)
+        titles = [row[0] for row in json.loads(response.content)['data']]
+        self.assertNotIn('Other Ticket', titles)
+
+class TicketSearchViewTests(ValidUserTestCase):
+    view = views.TicketSearchView
+    name = 'search_tickets'
+    factory = RequestFactory()
+
+    def setUp(self):
+        self.project = factories.ProjectFactory(title='Test Project', description='Test Project Description')
+        self.ticket = factories.TicketFactory(
+            title='Login button broken',
+            description='Nothing happens on click',
+            project=self.project,
+            submitter=self.user)
+        return super().setUp()
+
+    def get_results(self, query, **params):
+        request = self.factory.get(reverse(self.name), data=dict(q=query, **params))
+        request.user = self.user
+        return json.loads(self.view.as_view()(request).content)
+
+    def test_matches_title_and_description(self):
+        """Returns true if tickets are found by words in their title or description"""
+        self.assertEqual([r['id'] for r in self.get_results('login')['results']], [self.ticket.pk])
+        self.assertEqual([r['id'] for r in self.get_results('click')['results']], [self.ticket.pk])
+
+    def test_matches_comments(self):
+        """Returns true if tickets are found by words in their comments"""
+        models.TicketComment.objects.create(commenter=self.user, message='Happens in Firefox', ticket=self.ticket)
+        self.assertEqual(self.get_results('firefox')['count'], 1)
+
+    def test_index_follows_ticket_updates(self):
+        """Returns true if a ticket is found by its new title only once renamed"""
+        self.ticket.title = 'Signup form broken'
+        self.ticket.save()
+        self.assertEqual(self.get_results('login')['count'], 0)
+        self.assertEqual(self.get_results('signup')['count'], 1)
+
+    def test_better_matches_ranked_first(self):
+        """Returns true if a ticket matching the query in more places is ranked higher"""
+        other = factories.TicketFactory(
+            title='Broken footer', description='Login link in footer is broken', project=self.project, submitter=self.user)
+        models.TicketComment.objects.create(commenter=self.user, message='login login login', ticket=other)
+        results = self.get_results('login')['results']
+        self.assertEqual([r['id'] for r in results], [other.pk, self.ticket.pk])
+
+    def test_results_are_paginated(self):
+        """Returns true if only one page of results is returned"""
+        for i in range(25):
+            factories.TicketFactory(title='Login issue %d' % i, description='Test', project=self.project, submitter=self.user)
+        data = self.get_results('login', page=2)
+        self.assertEqual(data['count'], 26)
+        self.assertEqual(len(data['results']), 6)
+        self.assertFalse(data['has_next'])
+
+    def test_excludes_tickets_user_cannot_see(self):
+        """Returns true if matching tickets of other submitters are not returned"""
+        submitter = factories.CustomUserFactory(username='test_submitter')
+        factories.TicketFactory(title='Login again', description='Test', project=self.project, submitter=submitter)
+        self.assertEqual(self.get_results('login')['count'], 1)
+
+    def test_saves_keeping_the_text_are_not_reindexed(self):
+        """Returns true if saving a ticket without changing its title or description leaves the index alone"""
+        ticket = models.Ticket.objects.get(pk=self.ticket.pk)
+        ticket.priority = models.Ticket.Priority.HIGH
+        with CaptureQueriesContext(connection) as queries:
+            ticket.save()
+        self.assertEqual([q['sql'] for q in queries if 'ticketcomment' in q['sql'] or '_fts' in q['sql']], [])
+        self.assertEqual(self.get_results('login')['count'], 1)
+
+
 class TicketDetailViewTests(ValidUserTestCase):
     view = views.TicketDetailView
     name = 'ticket_details'
@@ -343,6 +523,66 @@ class TicketDetailViewTests(ValidUserTestCase):
         ticket = self.create_ticket_from_user(submitter=submitter)
         response = self.get_response(ticket=ticket)
         self.assertEqual(response.status_code, 302)
+
+    def count_render_queries(self, ticket):
+        with CaptureQueriesContext(connection) as queries:
+            self.get_response(ticket=ticket).render()
+        return len(queries)
+
+    # every fragment is rendered, as on a cache miss
+    @override_settings(FRAGMENT_CACHE_TIMEOUT=0, CACHES=MEMORY_CACHES)
+    def test_query_count_does_not_grow_with_comments_and_files(self):
+        """Returns true if rendering a ticket runs the same number of queries regardless of its related rows"""
+        ticket = self.create_ticket_from_user(submitter=self.user)
+        models.TicketComment.objects.create(commenter=self.user, message='Comment', ticket=ticket)
+        models.TicketFiles.objects.create(uploaded_by=self.user, ticket=ticket, file='file.txt')
+        # first render warms the user's permission cache
+        self.count_render_queries(ticket)
+        baseline = self.count_render_queries(ticket)
+
+        for i in range(5):
+            models.TicketComment.objects.create(commenter=self.user, message='Comment %d' % i, ticket=ticket)
+            models.TicketFiles.objects.create(uploaded_by=self.user, ticket=ticket, file='file%d.txt' % i)
+        self.assertEqual(self.count_render_queries(ticket), baseline)
+
+    def test_cached_fragments_skip_their_queries(self):
+        """Returns true if rendering an unchanged ticket again takes its tables from the cache"""
+        ticket = self.create_ticket_from_user(submitter=self.user)
+        models.TicketComment.objects.create(commenter=self.user, message='Comment', ticket=ticket)
+        # counted from here, earlier tests' lookups may still be in this process's counts
+        fragment_cache_stats(reset=True)
+        uncached = self.count_render_queries(ticket)
+        self.assertLess(self.count_render_queries(ticket), uncached)
+
+        stdout = io.StringIO()
+        call_command('fragment_cache_stats', stdout=stdout)
+        self.assertRegex(stdout.getvalue(), r'ticket_comments +1 hits +1 misses 50.0%')
+
+    def test_cached_ticket_reads_the_cache_once(self):
+        """Returns true if a cached ticket takes every fragment from one lookup of the database cache, and counts it in memory"""
+        ticket = self.create_ticket_from_user(submitter=self.user)
+        models.TicketComment.objects.create(commenter=self.user, message='Comment', ticket=ticket)
+        self.get_response(ticket=ticket).render()
+        with CaptureQueriesContext(connection) as queries:
+            self.get_response(ticket=ticket).render()
+        fragment_queries = [q['sql'] for q in queries if '"django_cache"' in q['sql'] and 'fragment' in q['sql']]
+        self.assertEqual(len(fragment_queries), 1)
+        self.assertNotIn('fragment_stats', fragment_queries[0])
+        # the session-less request's user, the ticket's versions and the ticket
+        self.assertLessEqual(len(queries), 4)
+
+    @override_settings(CACHES=MEMORY_CACHES)
+    def test_stats_cannot_be_read_from_a_local_memory_cache(self):
+        """Returns true if the stats command fails rather than report the empty counters of its own process"""
+        with self.assertRaisesMessage(CommandError, 'local-memory cache'):
+            call_command('fragment_cache_stats', stdout=io.StringIO())
+
+    def test_cached_fragments_show_new_comments(self):
+        """Returns true if a comment added after the ticket was cached is shown"""
+        ticket = self.create_ticket_from_user(submitter=self.user)
+        self.get_response(ticket=ticket).render()
+        models.TicketComment.objects.create(commenter=self.user, message='Late comment', ticket=ticket)
+        self.assertContains(self.get_response(ticket=ticket).render(), 'Late comment')
     
 """PERMISSION-RESTRICTED VIEWS TESTS"""
 class ManageUserRolesViewTests(PermissionSharedTestsMixin, ValidUserTestCase):
@@ -502,3 +742,122 @@ class UploadTicketFileViewTests(TicketPKSharedTestsMixin, ValidUserTestCase):
 
         
 
+
+
+class TicketFileViewTests(ValidUserTestCase):
+    def setUp(self):
+        project = factories.ProjectFactory(title='Test Project', description='Test Project Description')
+        self.ticket = factories.TicketFactory(title='Test Ticket', description='Test', project=project, submitter=self.user)
+        self.ticket_file = models.TicketFiles(uploaded_by=self.user, ticket=self.ticket, original_name='crash.log')
+        self.ticket_file.file.name = 'log.txt'
+        self.ticket_file.save()
+        return super().setUp()
+
+    def test_redirects_to_signed_url_with_original_name(self):
+        """Returns true if the view redirects to a signed URL sending the file under its original name"""
+        # as S3Boto3Storage with querystring auth
+        storage = mock.Mock(querystring_auth=True, querystring_expire=3600)
+        storage.url.return_value = 'https://bucket.example.com/log.txt?Signature=1'
+        with mock.patch.object(models.TicketFiles._meta.get_field('file'), 'storage', storage):
+            response = self.client.get(reverse('ticket_file', args=[self.ticket_file.pk]))
+        self.assertRedirects(response, storage.url.return_value, fetch_redirect_response=False)
+        storage.url.assert_called_once_with(
+            'log.txt', parameters={'ResponseContentDisposition': 'inline; filename="crash.log"'})
+
+    def test_serves_local_file_under_original_name(self):
+        """Returns true if files in local storage are served with the name they were uploaded with"""
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+                DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage', MEDIA_ROOT=media_root):
+            with open(os.path.join(media_root, 'log.txt'), 'wb') as file:
+                file.write(b'content')
+            response = self.client.get(reverse('ticket_file', args=[self.ticket_file.pk]))
+            self.assertEqual(response['Content-Disposition'], 'inline; filename="crash.log"')
+            self.assertEqual(b''.join(response.streaming_content), b'content')
+
+    def test_file_of_ticket_user_cannot_see_is_not_found(self):
+        """Returns true if files of tickets submitted by other users are not served"""
+        self.ticket.submitter = factories.CustomUserFactory(username='test_submitter')
+        self.ticket.save()
+        response = self.client.get(reverse('ticket_file', args=[self.ticket_file.pk]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_ticket_detail_does_not_build_file_urls(self):
+        """Returns true if the detail page links files through the redirect view"""
+        storage = FileSystemStorage(base_url='/tickets/')
+        with mock.patch.object(models.TicketFiles._meta.get_field('file'), 'storage', storage):
+            response = self.client.get(reverse('ticket_details', args=[self.ticket.pk]))
+        self.assertContains(response, reverse('ticket_file', args=[self.ticket_file.pk]))
+        self.assertNotContains(response, storage.url(self.ticket_file.file.name))
+
+
+class ConditionalGetTests(ValidUserTestCase):
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.project = factories.ProjectFactory(title='Test Project', description='Test Project Description')
+        self.user.project_set.add(self.project)
+        self.ticket = factories.TicketFactory(
+            title='Test Ticket', description='Test', project=self.project, submitter=self.user)
+        # the CSRF cookie is part of the ETag, it is set by the first page with a form
+        self.client.get(reverse('ticket_details', args=[self.ticket.pk]))
+        return super().setUp()
+
+    def revalidate(self, url, **headers):
+        response = self.client.get(url)
+        return response, self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'], **headers)
+
+    @override_settings(CACHES=MEMORY_CACHES)
+    def test_unchanged_ticket_is_not_modified(self):
+        """Returns true if revalidating an unchanged ticket answers 304 without loading the ticket again"""
+        url = reverse('ticket_details', args=[self.ticket.pk])
+        response = self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            revalidated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+        # the session, the user and the version lookup
+        self.assertLessEqual(len(queries), 3)
+
+    def test_ticket_changes_are_modified(self):
+        """Returns true if a new comment or a change to the user's permissions gives the ticket page a new ETag"""
+        url = reverse('ticket_details', args=[self.ticket.pk])
+        response = self.client.get(url)
+        models.TicketComment.objects.create(commenter=self.user, message='Comment', ticket=self.ticket)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+        response = self.client.get(url)
+        self.user.user_permissions.add(*get_permissions(['change_ticket']))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_etag_does_not_depend_on_the_cache(self):
+        """Returns true if another server process, with nothing cached, gives the page the same ETag"""
+        url = reverse('ticket_details', args=[self.ticket.pk])
+        response = self.client.get(url)
+        cache.clear()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_if_modified_since_alone_is_not_answered(self):
+        """Returns true if pages send no Last-Modified, so If-Modified-Since alone cannot miss a permission change"""
+        url = reverse('ticket_details', args=[self.ticket.pk])
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+
+        self.user.user_permissions.add(*get_permissions(['change_ticket']))
+        since = http_date(time.time() + 60)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=since).status_code, 200)
+
+    def test_project_pages_are_revalidated(self):
+        """Returns true if project pages answer 304 until the project changes"""
+        for url in (reverse('project_details', args=[self.project.pk]), reverse('my_projects')):
+            response, revalidated = self.revalidate(url)
+            self.assertEqual(revalidated.status_code, 304)
+
+            self.project.title = 'Renamed %s' % self.project.title
+            self.project.save()
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_tickets_of_other_users_are_not_revalidated(self):
+        """Returns true if a ticket the user cannot see is redirected rather than answered from its version"""
+        self.ticket.submitter = factories.CustomUserFactory(username='test_submitter')
+        self.ticket.save()
+        self.user.project_set.remove(self.project)
+        response = self.client.get(reverse('ticket_details', args=[self.ticket.pk]), HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 302)
@@ -0,0 +1,3 @@
+# The cache kept in memory, for tests that count the queries of the code under test or run without a
+# database: the database cache configured by default would add queries of its own
+MEMORY_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
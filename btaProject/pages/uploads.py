@@ -0,0 +1,245 @@
+import mimetypes
+import os
+from datetime import timedelta
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat
+from django.utils import timezone
+
+from .blobs import combine_block_digests, create_blob_ticket_file, get_or_create_blob
+from .models import TicketFileUpload, TicketFiles
+
+# block size used to copy a chunk from the request to a file
+COPY_BLOCK_SIZE = 64 * 1024
+
+
+class HashingReader:
+    """
+    Wraps a stream, hashing what is read from it
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.digest = sha256()
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.digest.update(data)
+        return data
+
+
+class FileSystemMultipartUpload:
+    """
+    Multipart uploads for FileSystemStorage. Chunks are written at their offset in a partial file next to
+    the final one, which is renamed into place once complete, so a chunk sent twice is harmless.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+
+    def partial_path(self, upload):
+        return self.storage.path(upload.name) + '.part'
+
+    def start(self, upload):
+        path = self.partial_path(upload)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()
+        return ''
+
+    def write_chunk(self, upload, offset, index, stream, length):
+        with open(self.partial_path(upload), 'r+b') as file:
+            file.seek(offset)
+            remaining = length
+            while remaining:
+                block = stream.read(min(COPY_BLOCK_SIZE, remaining))
+                if not block:
+                    raise ValueError('The chunk is shorter than its Content-Range')
+                file.write(block)
+                remaining -= len(block)
+
+    def complete(self, upload):
+        try:
+            os.replace(self.partial_path(upload), self.storage.path(upload.name))
+        except FileNotFoundError:
+            # already moved into place by an earlier attempt to complete the upload
+            if not os.path.exists(self.storage.path(upload.name)):
+                raise
+
+    def abort(self, upload):
+        try:
+            os.remove(self.partial_path(upload))
+        except FileNotFoundError:
+            pass
+
+
+class S3MultipartUpload:
+    """
+    Multipart uploads for django-storages' S3Boto3Storage, each chunk is uploaded as one part
+    """
+    def __init__(self, storage):
+        self.storage = storage
+        self.client = storage.connection.meta.client
+
+    def params(self, upload):
+        return {'Bucket': self.storage.bucket_name, 'Key': self.storage._normalize_name(upload.name)}
+
+    def start(self, upload):
+        content_type = mimetypes.guess_type(upload.name)[0] or 'application/octet-stream'
+        response = self.client.create_multipart_upload(ContentType=content_type, **self.params(upload))
+        return response['UploadId']
+
+    def write_chunk(self, upload, offset, index, stream, length):
+        # parts are at most one chunk, read whole so that the client can retry the request to S3
+        body = stream.read(length)
+        if len(body) != length:
+            raise ValueError('The chunk is shorter than its Content-Range')
+        self.client.upload_part(
+            UploadId=upload.storage_upload_id, PartNumber=index + 1, Body=body, ContentLength=length,
+            **self.params(upload))
+
+    def complete(self, upload):
+        # S3 keeps the ETag of every part, so they are listed here rather than stored with the upload
+        parts = []
+        paginator = self.client.get_paginator('list_parts')
+        try:
+            for page in paginator.paginate(UploadId=upload.storage_upload_id, **self.params(upload)):
+                parts += [{'ETag': part['ETag'], 'PartNumber': part['PartNumber']} for part in page.get('Parts', [])]
+            self.client.complete_multipart_upload(
+                UploadId=upload.storage_upload_id, MultipartUpload={'Parts': parts}, **self.params(upload))
+        except self.client.exceptions.NoSuchUpload:
+            # already completed by an earlier attempt, the object is in place
+            self.client.head_object(**self.params(upload))
+
+    def abort(self, upload):
+        try:
+            self.client.abort_multipart_upload(UploadId=upload.storage_upload_id, **self.params(upload))
+        except self.client.exceptions.NoSuchUpload:
+            pass
+
+
+def is_s3_storage(storage):
+    # django-storages' S3Boto3Storage, told apart without importing it as it is only installed in production
+    return hasattr(storage, 'bucket_name') and hasattr(storage, 'connection')
+
+
+def get_multipart_upload(storage=None):
+    storage = storage or TicketFiles._meta.get_field('file').storage
+    if isinstance(storage, FileSystemStorage):
+        return FileSystemMultipartUpload(storage)
+    if is_s3_storage(storage):
+        return S3MultipartUpload(storage)
+    raise ImproperlyConfigured('Chunked uploads are not supported by %s' % type(storage).__name__)
+
+
+def start_upload(ticket, user, filename, size):
+    """
+    Starts the chunked upload of a file of size bytes to ticket
+    """
+    file_field = TicketFiles._meta.get_field('file')
+    storage = file_field.storage
+    original_name = os.path.basename(filename)
+    upload = TicketFileUpload(
+        ticket=ticket, uploaded_by=user, size=size, chunk_size=settings.TICKET_FILE_CHUNK_SIZE,
+        original_name=original_name[:255])
+    # under a directory of its own so that concurrent uploads of the same file name cannot collide
+    upload.name = storage.generate_filename('%s/%s' % (upload.pk.hex, original_name))
+    if len(upload.name) > file_field.max_length:
+        raise ValueError('The file name is too long')
+    upload.storage_upload_id = get_multipart_upload(storage).start(upload)
+    upload.save()
+    return upload
+
+
+class ChunkError(ValueError):
+    pass
+
+
+class OffsetConflict(ChunkError):
+    # the chunk is not the one the upload expects next, the client should resume from upload.received
+    pass
+
+
+def store_chunk(upload, offset, length, stream):
+    """
+    Stores the chunk of length bytes at offset read from stream. Chunks must arrive in order and all but the
+    last be chunk_size long. Returns the TicketFiles row once the last chunk is stored, otherwise None.
+    The last chunk sent again after every chunk was stored completes the upload again, if it failed before.
+    """
+    if upload.received == upload.size and offset + length == upload.size:
+        return complete_upload(upload)
+    if offset != upload.received:
+        raise OffsetConflict('Expected the chunk at offset %d' % upload.received)
+    if offset + length > upload.size:
+        raise ChunkError('The chunk ends after the end of the file')
+    if length != upload.chunk_size and offset + length != upload.size:
+        raise ChunkError('Every chunk but the last must be %d bytes' % upload.chunk_size)
+
+    multipart = get_multipart_upload()
+    # each chunk is one block of the content digest, hashed as it is stored
+    reader = HashingReader(stream)
+    multipart.write_chunk(upload, offset, offset // upload.chunk_size, reader, length)
+    chunk_digest = reader.digest.hexdigest()
+    # only one request can move the upload past this offset, a concurrent copy of the chunk is refused
+    moved = TicketFileUpload.objects.filter(pk=upload.pk, received=offset).update(
+        received=F('received') + length, chunk_digests=Concat(F('chunk_digests'), Value(chunk_digest)),
+        updated=timezone.now())
+    if not moved:
+        raise OffsetConflict('The chunk at offset %d was already stored' % offset)
+    upload.received = offset + length
+    upload.chunk_digests += chunk_digest
+    if upload.received < upload.size:
+        return None
+    return complete_upload(upload)
+
+
+def complete_upload(upload):
+    """
+    Assembles an upload whose chunks have all been stored into its TicketFiles row and returns it. Safe to
+    call again after a failure, e.g. the storage could not be reached, as the upload is kept until it succeeds.
+    """
+    if upload.received != upload.size:
+        raise OffsetConflict('Expected the chunk at offset %d' % upload.received)
+    digest = combine_block_digests([
+        bytes.fromhex(upload.chunk_digests[start:start + 64]) for start in range(0, len(upload.chunk_digests), 64)])
+    multipart = get_multipart_upload()
+
+    def complete():
+        multipart.complete(upload)
+        return upload.name
+
+    storage = TicketFiles._meta.get_field('file').storage
+    with transaction.atomic():
+        # a concurrent request completing the same upload has deleted it by the time the lock is released
+        if not TicketFileUpload.objects.select_for_update().filter(pk=upload.pk).exists():
+            raise ChunkError('The upload was already completed')
+        blob, created = get_or_create_blob(digest, upload.size, write=complete, discard=storage.delete)
+        if not created:
+            # the content is already stored, the parts uploaded for this copy are dropped
+            multipart.abort(upload)
+        ticket_file = create_blob_ticket_file(upload.ticket, upload.uploaded_by, blob, upload.original_name)
+        upload.delete()
+    return ticket_file
+
+
+def abort_upload(upload):
+    get_multipart_upload().abort(upload)
+    upload.delete()
+
+
+def collect_uploads(dry_run=False):
+    """
+    Aborts the uploads not sent a chunk for TICKET_FILE_UPLOAD_EXPIRY seconds, dropping their stored parts.
+    Returns the number of uploads and bytes received freed.
+    """
+    expired = TicketFileUpload.objects.filter(
+        updated__lt=timezone.now() - timedelta(seconds=settings.TICKET_FILE_UPLOAD_EXPIRY))
+    count = size = 0
+    for upload in expired.iterator():
+        if not dry_run:
+            abort_upload(upload)
+        count += 1
+        size += upload.received
+    return count, size
@@ -1,4 +1,5 @@
 from django.urls import path
+import pages.api as page_api
 import pages.views as page_views
 
 urlpatterns = [
@@ -9,11 +10,26 @@ urlpatterns = [
     path('projects/archived', page_views.ArchivedProjectsView.as_view(), name='archived_projects'),
     path('projects/create', page_views.ProjectCreateView.as_view(), name='create_project'),
     path('projects/<int:pk>', page_views.ProjectDetailView.as_view(), name='project_details' ),
+    path('projects/<int:pk>/tickets', page_views.ProjectTicketDataView.as_view(), name='project_tickets_data'),
+    path('projects/<int:pk>/personnel', page_views.ProjectPersonnelDataView.as_view(), name='project_personnel_data'),
     path('projects/users/<int:pk>', page_views.ManageProjectUsersView.as_view(), name='manage_project_users'),
     path('projects/edit/<int:pk>', page_views.ProjectUpdateView.as_view(), name='update_project'),
     path('tickets/', page_views.MyTicketView.as_view(), name='my_tickets'),
+    path('tickets/data', page_views.MyTicketDataView.as_view(), name='my_tickets_data'),
+    path('tickets/export', page_views.TicketExportView.as_view(), name='export_tickets'),
+    path('tickets/search', page_views.TicketSearchView.as_view(), name='search_tickets'),
     path('tickets/create', page_views.TicketSubmitView.as_view(), name='submit_ticket'),
     path('tickets/<int:pk>', page_views.TicketObjectView.as_view(), name='ticket_details'),
+    path('tickets/files/<int:pk>', page_views.TicketFileView.as_view(), name='ticket_file'),
+    path('tickets/files/<int:pk>/thumbnail', page_views.TicketFileView.as_view(thumbnail=True), name='ticket_file_thumbnail'),
     path('tickets/newfile/<int:pk>', page_views.UploadTicketFileView.as_view(), name='upload_ticket_file'),
     path('tickets/edit/<int:pk>', page_views.TicketUpdateView.as_view(), name='update_ticket'),
+    path('api/projects', page_api.ProjectListApiView.as_view(), name='api_projects'),
+    path('api/projects/<int:pk>', page_api.ProjectApiView.as_view(), name='api_project'),
+    path('api/tickets', page_api.TicketListApiView.as_view(), name='api_tickets'),
+    path('api/tickets/<int:pk>', page_api.TicketApiView.as_view(), name='api_ticket'),
+    path('api/tickets/<int:pk>/comments', page_api.TicketCommentListApiView.as_view(), name='api_ticket_comments'),
+    path('api/tickets/<int:pk>/uploads', page_api.TicketFileUploadListApiView.as_view(), name='api_ticket_file_uploads'),
+    path('api/uploads/<uuid:pk>', page_api.TicketFileUploadApiView.as_view(), name='api_ticket_file_upload'),
+    path('api/tickets/<int:pk>/history', page_api.TicketHistoryListApiView.as_view(), name='api_ticket_history'),
 ]
\ No newline at end of file
@@ -1,15 +1,37 @@
+import os
+from hashlib import md5
+
+from django.conf import settings
 from django.views import View
 from django.views.generic import CreateView, DetailView, FormView, ListView, TemplateView, UpdateView
 from django.views.generic.detail import SingleObjectMixin
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.contrib.auth import get_user_model
 from django.contrib.auth.views import redirect_to_login
-from django.db.models import Count
+from django.core.cache import cache
+from django.db.models import Count, Max, Sum
+from django.db.models.fields.files import FieldFile
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect, get_object_or_404
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.utils.html import escape, format_html
+from django.utils import timezone
+from django.utils.formats import date_format
+from django.utils.text import Truncator
+from django_datatables_view.base_datatable_view import BaseDatatableView
+
+from accounts.helpers import assign_role_to_users, get_user_group_names
 
-from .forms import TicketFilesForm, UserRolesForm, TicketCommentForm, TicketSubmitForm, TicketUpdateForm, ProjectCreateForm, ProjectUpdateForm, ManageProjectUsersForm
-from .models import Project, Ticket, TicketComment, TicketFiles
+from .blobs import create_ticket_file
+from .exports import export_lines, export_rows
+from .forms import TicketFilesForm, UserRolesForm, TicketCommentForm, TicketExportForm, TicketSubmitForm, TicketUpdateForm, ProjectCreateForm, ProjectUpdateForm, ManageProjectUsersForm
+from .helpers import get_file_url, touch_projects
+from .models import Project, Ticket, TicketComment, TicketCounter, TicketFiles
+from .routers import get_read_database, iterate_reading_from, reading_from
+from .search import search_tickets
 
 
 class UserAccessMixin(PermissionRequiredMixin):
@@ -26,15 +48,82 @@ class UserAccessMixin(PermissionRequiredMixin):
         return super(UserAccessMixin, self).dispatch(request, *args, **kwargs)
 
 
+class ConditionalGetMixin:
+    """
+    Answers conditional GETs with 304 Not Modified from get_version() alone, before the object is loaded or
+    the template rendered. The ETag covers the version, the user's role and permissions and the CSRF cookie
+    used by the page's forms. It is built from data alone, so every server process gives a page the same ETag.
+    No Last-Modified is sent: If-Modified-Since alone would miss changes to the user's role, permissions and
+    CSRF cookie, which have no time of their own.
+    """
+    def get_version(self):
+        """
+        Returns a tuple of values that change whenever the data shown changes, or None to skip the checks
+        (e.g. the object is not visible to the user)
+        """
+        raise NotImplementedError
+
+    def get_etag(self):
+        version = self.get_version()
+        if version is None:
+            return None
+        request = self.request
+        user = request.user
+        parts = [
+            settings.RELEASE_VERSION, user.pk, user.user_role, user.is_superuser,
+            *sorted(get_user_group_names(user)), *sorted(user.get_all_permissions()),
+            request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''), *version,
+        ]
+        return quote_etag(md5(':'.join(str(part) for part in parts).encode()).hexdigest())
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or not request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+
+        etag = self.get_etag()
+        if etag is None:
+            return super().dispatch(request, *args, **kwargs)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response.headers.setdefault('ETag', etag)
+        # browsers check back on every visit, shared caches keep nothing
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class ReplicaReadMixin:
+    """
+    Reads the data of GET requests from a read replica (see pages.routers), for pages that only read and
+    can show data a few seconds old. Template responses are rendered, and streaming responses read, from
+    the same replica. Mixed in after the login and permission checks, which read from the default database.
+    """
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+
+        alias = get_read_database(request)
+        with reading_from(alias):
+            response = super().dispatch(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+        if response.streaming:
+            response.streaming_content = iterate_reading_from(alias, response.streaming_content)
+        return response
+
 
-class DashboardView(LoginRequiredMixin, TemplateView):
+class DashboardView(LoginRequiredMixin, ReplicaReadMixin, TemplateView):
     login_url = '/accounts/login/'
     template_name = 'dashboard.html'
 
     def get_context_data(self, **kwargs):
         context =  super().get_context_data(**kwargs)
-        context['statuses'] = Ticket.objects.values('status').annotate(count=Count('status')).order_by('-status')
-        context['types'] = Ticket.objects.values('type').annotate(type_count=Count('type'))
+        # read from the counters maintained by the ticket signals rather than aggregating the ticket table
+        counters = TicketCounter.objects.filter(count__gt=0)
+        context['statuses'] = counters.filter(dimension=TicketCounter.Dimension.STATUS).order_by('-value')
+        context['types'] = counters.filter(dimension=TicketCounter.Dimension.TYPE).order_by('value')
 
         return context
 
@@ -55,28 +144,27 @@ class ManageUserRolesView(UserAccessMixin, FormView):
     
     def form_valid(self, form):
         """
-        assign user roles: signal is called when user is saved to change group based on role
+        assign user roles and the matching groups to all selected users at once
         """
-        for user in form.cleaned_data['users']:
-            user.user_role = form.cleaned_data['role']
-            user.save(update_fields=['user_role'])
+        assign_role_to_users(form.cleaned_data['users'], form.cleaned_data['role'])
+        # the roles are listed with the personnel of their projects
+        touch_projects(Project.objects.filter(assigned_personnel__in=form.cleaned_data['users']).values('pk'))
         return super().form_valid(form)
 
-class MyProjectsView(LoginRequiredMixin, ListView):
+class ProjectListVersionMixin(ConditionalGetMixin):
+    def get_version(self):
+        # projects appear, leave or change, or their tickets or personnel change
+        return tuple(self.get_queryset().aggregate(
+            Count('pk'), Max('date_updated'), Max('child_updated'), Sum('child_version')).values())
+
+
+class MyProjectsView(LoginRequiredMixin, ReplicaReadMixin, ProjectListVersionMixin, ListView):
     model = Project
     template_name = 'my_projects.html'
     context_object_name = 'projects'
 
     def get_queryset(self):
-        if self.request.user.groups.filter(name='Administrator').exists():
-            return self.model.objects.filter(is_active=True)
-
-        
-        elif self.request.user.groups.filter(name='Project Manager').exists():
-            return self.model.objects.filter(project_manager=self.request.user, is_active=True)
-
-        # if not admin or PM, return projects user is assigned to
-        return self.request.user.project_set.filter(is_active=True)
+        return self.model.objects.visible_to(self.request.user).filter(is_active=True)
 
 
 class AboutPageView(LoginRequiredMixin, TemplateView):
@@ -98,7 +186,7 @@ class ProjectCreateView(UserAccessMixin, CreateView):
         
 
 
-class ProjectDetailView(LoginRequiredMixin, DetailView):
+class ProjectDetailView(LoginRequiredMixin, ConditionalGetMixin, DetailView):
     model = Project
     template_name = 'project_detail.html'
     context_object_name = 'project'
@@ -108,13 +196,21 @@ class ProjectDetailView(LoginRequiredMixin, DetailView):
          returns template if user is administrator or they are assigned to/manage the
          current project being requested
         """
-        if (self.request.user.groups.filter(name='Administrator').exists() or
-            self.model.objects.filter(project_manager=self.request.user).exists() or
-            self.request.user.project_set.filter(pk=self.kwargs['pk']).exists()):
+        if self.model.objects.visible_to(self.request.user).filter(pk=self.kwargs['pk']).exists():
             return super().dispatch(request, *args, **kwargs)
 
         return redirect(request.META.get('HTTP_REFERER', '/'))
 
+    def get_version(self):
+        # the tickets and personnel tables are loaded separately, from ProjectTicketDataView and
+        # ProjectPersonnelDataView
+        return self.model.objects.filter(pk=self.kwargs['pk']).values_list('date_updated').first()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['ticket_statuses'] = Ticket.Status.choices
+        return context
+
 class ProjectUpdateView(UserAccessMixin, UpdateView):
     permission_required = 'pages.change_project'
     model = Project
@@ -146,7 +242,7 @@ class ManageProjectUsersView(UserAccessMixin, UpdateView):
 
 
 
-class ArchivedProjectsView(UserAccessMixin, ListView):
+class ArchivedProjectsView(UserAccessMixin, ReplicaReadMixin, ProjectListVersionMixin, ListView):
     permission_required = 'pages.add_project'
     model = Project 
     template_name = 'archived_projects.html'
@@ -157,37 +253,212 @@ class ArchivedProjectsView(UserAccessMixin, ListView):
 
 
 
-"""
-Should show tickets that a user submitted or is assigned to
-"""
-class MyTicketView(LoginRequiredMixin, ListView):
-    model = Ticket
+class AssociatedTicketsMixin:
+    """
+    Should return open tickets that a user submitted or is assigned to (all open tickets for administrators)
+    """
+    def get_associated_tickets(self):
+        return Ticket.objects.visible_to(self.request.user).filter(status='OPEN')
+
+
+class MyTicketView(LoginRequiredMixin, ReplicaReadMixin, ConditionalGetMixin, TemplateView):
+    """
+    Renders the tickets table only, rows are requested page by page from MyTicketDataView
+    """
     template_name = 'my_tickets.html'
-    context_object_name = 'tickets'
 
-    def get_queryset(self):
-        # returns all tickets if user is administrator, otherwise returns associated tickets (those assigned/submitted by user)
-        if self.request.user.groups.filter(name='Administrator').exists():
-            return self.model.objects.filter(status='OPEN')
-
-        elif self.request.user.groups.filter(name__in=['Developer', 'Project Manager']).exists():
-            return self.model.objects.filter(assigned_developer = self.request.user, status='OPEN')
-        else:
-            return self.model.objects.filter(submitter = self.request.user, status='OPEN')
+    def get_version(self):
+        # the page only changes with the user
+        return ()
+
+
+class CachedCountDatatableMixin:
+    """
+    DataTables server-side processing with the COUNT(*) cached per distinct query, so that paging through
+    a table does not recount every time. Each view counts under a count_cache_prefix of its own.
+    """
+    max_display_length = 100
+    count_cache_timeout = 60
+    count_cache_prefix = None
+
+    def count_records(self, qs):
+        key = '%s:%s' % (self.count_cache_prefix, md5(str(qs.query).encode()).hexdigest())
+        count = cache.get(key)
+        if count is None:
+            count = qs.count()
+            cache.set(key, count, self.count_cache_timeout)
+        return count
+
+
+class MyTicketDataView(LoginRequiredMixin, ReplicaReadMixin, AssociatedTicketsMixin, CachedCountDatatableMixin, BaseDatatableView):
+    """
+    Server-side processing endpoint for the DataTables tickets table (paging, ordering and search)
+    """
+    columns = ['title', 'description', 'id']
+    order_columns = ['title', 'description', 'id']
+    count_cache_prefix = 'ticket_count'
+
+    def get_initial_queryset(self):
+        return self.get_associated_tickets().only('id', 'title', 'description')
+
+    def render_column(self, row, column):
+        if column == 'id':
+            return format_html('<a href="{}" class="table-link">Details</a>', row.get_absolute_url())
+        return escape(getattr(row, column))
+
+
+class ProjectDataMixin:
+    """
+    Loads the project of the URL for the tables of the project page, if the user can see it
+    """
+    def dispatch(self, request, *args, **kwargs):
+        # before BaseDatatableView.get_context_data, which logs every exception raised within it as an error
+        self.project = Project.objects.visible_to(request.user).filter(pk=kwargs['pk']).first()
+        if self.project is None:
+            raise Http404('No project matches the given query.')
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_project(self):
+        return self.project
+
+
+class ProjectTicketDataView(LoginRequiredMixin, ProjectDataMixin, CachedCountDatatableMixin, BaseDatatableView):
+    """
+    Server-side processing endpoint for the tickets table of the project page, optionally limited to the
+    tickets with the status given by the status parameter
+    """
+    columns = ['title', 'description', 'status', 'date_updated', 'id']
+    order_columns = ['title', 'description', 'status', 'date_updated', 'id']
+    count_cache_prefix = 'project_ticket_count'
+    # descriptions are cut short in the table, the whole text is on the ticket page
+    description_length = 100
+
+    def get_initial_queryset(self):
+        tickets = self.get_project().tickets.only('id', 'title', 'description', 'status', 'date_updated')
+        status = self.request.GET.get('status')
+        if status in Ticket.Status.values:
+            tickets = tickets.filter(status=status)
+        # replaced by the table's own ordering when it sends one
+        return tickets.order_by('-date_updated', '-id')
+
+    def render_column(self, row, column):
+        if column == 'id':
+            return format_html('<a href="{}" class="table-link">Details</a>', row.get_absolute_url())
+        if column == 'description':
+            return escape(Truncator(row.description).chars(self.description_length))
+        if column == 'date_updated':
+            return date_format(timezone.localtime(row.date_updated), 'SHORT_DATETIME_FORMAT')
+        return escape(getattr(row, column))
+
+
+class ProjectPersonnelDataView(LoginRequiredMixin, ProjectDataMixin, CachedCountDatatableMixin, BaseDatatableView):
+    """
+    Server-side processing endpoint for the personnel table of the project page
+    """
+    columns = ['email', 'username', 'user_role']
+    order_columns = ['email', 'username', 'user_role']
+    count_cache_prefix = 'project_personnel_count'
+
+    def get_initial_queryset(self):
+        return self.get_project().assigned_personnel.only('id', 'email', 'username', 'user_role').order_by('username')
+
+    def render_column(self, row, column):
+        if column == 'user_role':
+            return escape(row.get_user_role_display())
+        return escape(getattr(row, column))
+
+
+class TicketSearchView(LoginRequiredMixin, AssociatedTicketsMixin, View):
+    """
+    Full-text search over the tickets the user can see, returned as ranked pages of JSON
+    """
+    paginate_by = 20
+
+    def get(self, request, *args, **kwargs):
+        query = request.GET.get('q', '').strip()
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+
+        count, tickets = 0, []
+        if query:
+            offset = (page - 1) * self.paginate_by
+            count, tickets = search_tickets(self.get_associated_tickets(), query, offset, self.paginate_by)
+
+        return JsonResponse({
+            'query': query,
+            'page': page,
+            'count': count,
+            'has_next': page * self.paginate_by < count,
+            'results': [{
+                'id': ticket.pk,
+                'title': ticket.title,
+                'status': ticket.status,
+                'url': ticket.get_absolute_url(),
+                'rank': ticket.rank,
+            } for ticket in tickets],
+        })
+
+
+class TicketExportView(LoginRequiredMixin, ReplicaReadMixin, View):
+    """
+    Streams the tickets the user can see, or their history or comments, as a CSV or JSON lines download
+    """
+    content_types = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+    def get(self, request, *args, **kwargs):
+        form = TicketExportForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors.get_json_data()}, status=400)
+
+        filters = form.cleaned_data
+        dataset, format = filters.pop('dataset'), filters.pop('format')
+        tickets = Ticket.objects.visible_to(request.user)
+        columns, rows = export_rows(dataset, tickets=tickets, **filters)
+        # rows are written to the client as they are read, never collected in memory
+        response = StreamingHttpResponse(export_lines(format, columns, rows), content_type=self.content_types[format])
+        response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (dataset, format)
+        return response
+
+
+class TicketDetailContextMixin:
+    """
+    Adds the ticket's history, comments and files to the context of the pages rendering ticket_detail.html.
+    They are only evaluated if the cached fragment listing them has to be rendered again.
+    """
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['histories'] = self.object.histories.all()
+        context['comments'] = self.object.comments.select_related('commenter')
+        context['files'] = self.object.files.select_related('uploaded_by')
+        return context
+
+
 # only be accessed if ticket is assigned or related to user: TODO
-class TicketDetailView(LoginRequiredMixin, DetailView):
+class TicketDetailView(LoginRequiredMixin, ConditionalGetMixin, TicketDetailContextMixin, DetailView):
     model = Ticket
     template_name = 'ticket_detail.html'
     context_object_name = 'ticket'
 
-    def dispatch(self, request, *args, **kwargs):
-        # return http response if admin or developer is related to ticket. Else, redirect url
-        if (self.request.user.groups.filter(name='Administrator').exists() or
-           (self.model.objects.get(pk=self.kwargs['pk']).assigned_developer == self.request.user and self.request.user.user_role == 'DV') or
-            (self.model.objects.get(pk=self.kwargs['pk']).submitter == self.request.user and self.request.user.user_role == 'SM')):
-            return super().dispatch(request, *args, **kwargs)
+    def get_queryset(self):
+        # the related tables are loaded by TicketDetailContextMixin, with one query each when not cached
+        return self.model.objects.visible_to(self.request.user).select_related(
+            'project', 'assigned_developer', 'submitter')
 
-        return redirect(request.META.get('HTTP_REFERER', '/'))
+    def get_version(self):
+        return self.model.objects.visible_to(self.request.user).filter(pk=self.kwargs['pk']).values_list(
+            'date_updated', 'child_version', 'child_updated', 'project__date_updated').first()
+
+    def get(self, request, *args, **kwargs):
+        # return http response if the ticket is visible to the user. Else, redirect url
+        try:
+            self.object = self.get_object()
+        except Http404:
+            return redirect(request.META.get('HTTP_REFERER', '/'))
+
+        context = self.get_context_data(object=self.object)
+        return self.render_to_response(context)
 
     def get_context_data(self, **kwargs):
         context =  super().get_context_data(**kwargs)
@@ -197,6 +468,31 @@ class TicketDetailView(LoginRequiredMixin, DetailView):
 
         
 
+class TicketFileView(LoginRequiredMixin, View):
+    """
+    Redirects to a ticket file the user can see, so that pages link here rather than signing every file URL
+    up front. Files with the same content share their storage name, so signed URLs carry the file's original
+    name for the storage to send as Content-Disposition, and files in local storage are served from here.
+    """
+    # redirects to the thumbnail of the file instead
+    thumbnail = False
+
+    def get(self, request, *args, **kwargs):
+        ticket_file = get_object_or_404(
+            TicketFiles.objects.filter(ticket__in=Ticket.objects.visible_to(request.user)), pk=kwargs['pk'])
+        file = ticket_file.file
+        if self.thumbnail:
+            if not ticket_file.thumbnail:
+                raise Http404('The file has no thumbnail')
+            file = FieldFile(ticket_file, file.field, ticket_file.thumbnail)
+            return redirect(get_file_url(file))
+
+        filename = ticket_file.original_name or os.path.basename(file.name)
+        if isinstance(file.storage, FileSystemStorage):
+            return FileResponse(file.open('rb'), filename=filename)
+        return redirect(get_file_url(file, filename))
+
+
 # Accessed by administrators and Project Managers
 class TicketUpdateView(UserAccessMixin, UpdateView):
     permission_required = 'pages.change_ticket'
@@ -213,7 +509,7 @@ class TicketUpdateView(UserAccessMixin, UpdateView):
         return super().dispatch(request, *args, **kwargs)
 
 
-class TicketCommentFormView(LoginRequiredMixin, SingleObjectMixin, FormView):
+class TicketCommentFormView(LoginRequiredMixin, TicketDetailContextMixin, SingleObjectMixin, FormView):
     template_name = 'ticket_detail.html'
     form_class = TicketCommentForm
     model = Ticket
@@ -282,11 +578,7 @@ class UploadTicketFileView(UserAccessMixin, FormView):
     def form_valid(self, form):
         pk = self.kwargs['pk']
         ticket = get_object_or_404(Ticket, pk=pk)
-        new_file = TicketFiles(
-            uploaded_by = self.request.user,
-            ticket = ticket,
-            file = form.cleaned_data['file']
-        )
-        new_file.save()
+        # files with content that is already stored share it instead of storing another copy
+        create_ticket_file(ticket, self.request.user, form.cleaned_data['file'])
         return super().form_valid(form)
 